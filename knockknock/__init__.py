@@ -10,3 +10,26 @@ from knockknock.matrix_sender import matrix_sender
 from knockknock.dingtalk_sender import dingtalk_sender
 from knockknock.wechat_sender import wechat_sender
 from knockknock.rocketchat_sender import rocketchat_sender
+from knockknock.statsd_sender import statsd_sender
+from knockknock.stall import heartbeat
+from knockknock.metrics import log
+from knockknock.log_handler import KnockKnockHandler
+from knockknock.phases import phase
+from knockknock.parallel import parallel_map
+from knockknock.preflight import PreflightError, check_backends
+from knockknock.routing import Route, RoutingNotifier
+from knockknock.notifier import (Notifier,
+                                 MultiNotifier,
+                                 ChimeNotifier,
+                                 DesktopNotifier,
+                                 DingTalkNotifier,
+                                 DiscordNotifier,
+                                 EmailNotifier,
+                                 MatrixNotifier,
+                                 RocketChatNotifier,
+                                 SlackNotifier,
+                                 SmsNotifier,
+                                 StatsdNotifier,
+                                 TeamsNotifier,
+                                 TelegramNotifier,
+                                 WeChatNotifier)
@@ -1,5 +1,15 @@
 import argparse
 import subprocess
+import sys
+
+from knockknock.history import print_history
+from knockknock.budget import NotificationBudget
+from knockknock.core import track
+from knockknock.guard import parse_size, run_guarded
+from knockknock.pool import read_commands, run_commands
+from knockknock.preflight import PreflightError, check_backends
+from knockknock.tail import tail_log
+from knockknock.watch import watch_pids
 
 from knockknock import (chime_sender,
                         desktop_sender,
@@ -10,17 +20,13 @@ from knockknock import (chime_sender,
                         rocketchat_sender,
                         slack_sender,
                         sms_sender,
+                        statsd_sender,
                         teams_sender,
                         telegram_sender,
                         wechat_sender,)
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="KnockKnock - Be notified when your training is complete.")
-    parser.add_argument("--verbose", required=False, action="store_true",
-                        help="Show full command in notification.")
-    subparsers = parser.add_subparsers()
 
+def add_sender_parsers(subparsers):
     # Chime
     chime_parser = subparsers.add_parser(
         name="chime", description="Send a Chime message before and after function " +
@@ -75,6 +81,9 @@ def main():
     slack_parser.add_argument(
         "--user-mentions", type=lambda s: s.split(","), required=False, default=[],
         help="Optional user ids to notify, as comma seperated list.")
+    slack_parser.add_argument(
+        "--token", type=str, required=False, default=None,
+        help="Optional bot token to upload the attachments (`--channel` must then be a channel id).")
     slack_parser.set_defaults(sender_func=slack_sender)
 
     # DingTalk
@@ -189,9 +198,157 @@ def main():
         help="Optional user phone numbers to notify (use '@all' for all group members), as comma seperated list.")
     wechat_parser.set_defaults(sender_func=wechat_sender)
 
+    # StatsD
+    statsd_parser = subparsers.add_parser(
+        name="statsd", description="Send StatsD counters before and after function execution, " +
+        "and the duration of the run, as UDP datagrams. Optionally write them to a Prometheus textfile.")
+    statsd_parser.add_argument(
+        "--host", type=str, required=False, default="localhost",
+        help="The host of the StatsD server (default: localhost).")
+    statsd_parser.add_argument(
+        "--port", type=int, required=False, default=8125,
+        help="The UDP port of the StatsD server (default: 8125).")
+    statsd_parser.add_argument(
+        "--prefix", type=str, required=False, default="knockknock",
+        help="The prefix of the metric names (default: knockknock).")
+    statsd_parser.add_argument(
+        "--textfile", type=str, required=False, default=None,
+        help="Optional Prometheus textfile (node_exporter textfile collector) to write the metrics to.")
+    statsd_parser.add_argument(
+        "--no-udp", dest="udp", required=False, action="store_false",
+        help="Don't send the StatsD datagrams, only write `--textfile`.")
+    statsd_parser.set_defaults(sender_func=statsd_sender)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="KnockKnock - Be notified when your training is complete.")
+    parser.add_argument("--verbose", required=False, action="store_true",
+                        help="Show full command in notification.")
+    parser.add_argument("--sidecar", required=False, action="store_true",
+                        help="Fork a watchdog process reporting if knockknock is killed " +
+                        "(OOM killer, SIGKILL...) and report SIGTERM/SIGINT before exiting.")
+    parser.add_argument("--stall-timeout", type=float, required=False, default=None,
+                        help="Alert when the command makes no progress (CPU time) within " +
+                        "this number of seconds.")
+    parser.add_argument("--stall-detection", type=str, required=False, default="auto",
+                        choices=["auto", "heartbeat", "cpu"],
+                        help="How progress is detected by `--stall-timeout` (default: auto).")
+    parser.add_argument("--history", action="store_true",
+                        help="Record the run in the local run-history store, " +
+                        "to get the expected duration and flag duration regressions.")
+    parser.add_argument("--history-path", type=str, required=False, default=None,
+                        help="Path of the run-history store used by `--history` " +
+                        "(default: ~/.cache/knockknock/history.sqlite).")
+    parser.add_argument("--rendezvous-dir", type=str, required=False, default=None,
+                        help="Directory shared by all the ranks of a distributed job, used to add " +
+                        "a per-rank timing breakdown to the completion message of rank 0.")
+    parser.add_argument("--rendezvous-timeout", type=float, required=False, default=60.,
+                        help="Maximum number of seconds rank 0 waits for the other ranks (default: 60).")
+    parser.add_argument("--regression-percentile", type=float, required=False, default=90.,
+                        help="Percentile of the past durations above which a run is flagged " +
+                        "as a regression (default: 90).")
+    parser.add_argument("--repeat-window", type=float, required=False, default=None,
+                        help="Don't notify a crash identical to one notified less than this number " +
+                        "of seconds ago (e.g. a requeued job crashing the same way).")
+    parser.add_argument("--system-snapshot", type=str, required=False, default="crash",
+                        choices=["crash", "always", "none"],
+                        help="Add a snapshot of the machine (load, memory, disk, cgroup...) to the crash " +
+                        "messages, to the start message too, or never (default: crash).")
+    parser.add_argument("--watch-dir", type=str, required=False, default=None,
+                        help="Checkpoint directory to follow: report each checkpoint with its size and " +
+                        "write throughput, and warn before the disk is full.")
+    parser.add_argument("--status-address", type=str, required=False, default=None, metavar="ADDRESS",
+                        help="Serve the live state of the run as JSON over HTTP on PORT, HOST:PORT " +
+                        "(localhost by default) or the path of a Unix socket.")
+    parser.add_argument("--max-rss", type=parse_size, required=False, default=None, metavar="SIZE",
+                        help="Terminate the command (SIGTERM, then SIGKILL) and report it when the resident " +
+                        "memory of its process tree goes over SIZE (e.g. 16G).")
+    parser.add_argument("--warn-rss", type=parse_size, required=False, default=None, metavar="SIZE",
+                        help="Send a warning with the memory trend when the resident memory goes over SIZE " +
+                        "(default: 90%% of --max-rss).")
+    parser.add_argument("--timeout", type=float, required=False, default=None,
+                        help="Terminate the command and report it after this number of seconds.")
+    parser.add_argument("--preflight", required=False, action="store_true",
+                        help="Check the configuration of the backend (webhook, token...) before " +
+                        "running the command, and exit if it is wrong.")
+    parser.add_argument("--notification-timeout", type=float, required=False, default=None,
+                        help="Maximum number of seconds spent sending a notification.")
+    parser.add_argument("--notification-budget", type=float, required=False, default=None,
+                        help="Maximum number of seconds spent sending all the notifications of the run.")
+    parser.add_argument("--attach", action="append", dest="attachments", metavar="PATH", default=None,
+                        help="File attached to the completion or crash message, can be repeated.")
+    subparsers = parser.add_subparsers()
+
+    add_sender_parsers(subparsers)
+
+    # History
+    history_parser = subparsers.add_parser(
+        name="history", description="Show the most recent runs recorded in the run-history store.")
+    history_parser.add_argument(
+        "--path", type=str, required=False, default=None,
+        help="Path of the run-history store (default: ~/.cache/knockknock/history.sqlite).")
+    history_parser.add_argument(
+        "--func-name", type=str, required=False, default=None, help="Only show runs of this main call.")
+    history_parser.add_argument(
+        "--host", type=str, required=False, default=None, help="Only show runs on this machine.")
+    history_parser.add_argument(
+        "--status", type=str, required=False, default=None,
+        help="Only show runs with this status (complete, crash, running...).")
+    history_parser.add_argument(
+        "--limit", type=int, required=False, default=20, help="Number of runs to show (default: 20).")
+    history_parser.set_defaults(command_func=print_history)
+
+    # Watch
+    watch_parser = subparsers.add_parser(
+        name="watch", description="Watch already running processes and send a notification " +
+        "with their runtime and exit status when they exit, e.g. " +
+        "`knockknock watch <pid> [<pid> ...] slack --webhook-url ... --channel ...`.")
+    watch_parser.add_argument(
+        "pids", type=int, nargs="+", help="The ids of the processes to watch.")
+    add_sender_parsers(watch_parser.add_subparsers())
+
+    # Tail
+    tail_parser = subparsers.add_parser(
+        name="tail", description="Follow a log file and send a notification when a line matches " +
+        "one of the patterns, e.g. `knockknock tail train.log --pattern 'loss=nan' slack ...`.")
+    tail_parser.add_argument(
+        "logfile", type=str, help="The log file to follow.")
+    tail_parser.add_argument(
+        "--pattern", type=str, action="append", dest="patterns", required=True,
+        help="Regular expression to look for, can be repeated.")
+    tail_parser.add_argument(
+        "--throttle", type=float, required=False, default=60.,
+        help="Minimum number of seconds between two notifications for the same pattern (default: 60).")
+    tail_parser.add_argument(
+        "--from-start", required=False, action="store_true",
+        help="Search the whole file first, instead of only the lines written from now on.")
+    add_sender_parsers(tail_parser.add_subparsers())
+
+    # Run
+    run_parser = subparsers.add_parser(
+        name="run", description="Run the commands of a file (one per line) through a pool of " +
+        "processes, report each failure and send one summary at the end, e.g. " +
+        "`knockknock run -j 8 --commands-file cmds.txt slack ...`.")
+    run_parser.add_argument(
+        "--commands-file", type=str, required=True,
+        help="File with one command per line (`#` comments allowed), or - for stdin.")
+    run_parser.add_argument(
+        "-j", "--jobs", type=int, required=False, default=1,
+        help="Number of commands run at the same time (default: 1).")
+    run_parser.add_argument(
+        "--fail-fast", required=False, action="store_true",
+        help="Stop the running commands and cancel the remaining ones after the first failure.")
+    add_sender_parsers(run_parser.add_subparsers())
+
     args, remaining_args = parser.parse_known_args()
     args = vars(args)
 
+    command_func = args.pop("command_func", None)
+    if command_func is not None:
+        command_func(**{key: args[key] for key in ("path", "func_name", "host", "status", "limit")})
+        return
+
     sender_func = args.pop("sender_func", None)
 
     if sender_func is None:
@@ -199,12 +356,54 @@ def main():
         exit(1)
 
     verbose = args.pop("verbose")
+    history_path = args.pop("history_path")
+    if history_path is not None:
+        args["history"] = history_path
+    if args["system_snapshot"] == "none":
+        args["system_snapshot"] = None
+
+    pids = args.pop("pids", None)
+    commands_file = args.pop("commands_file", None)
+    pool_options = {key: args.pop(key) for key in ("jobs", "fail_fast") if key in args}
+    logfile = args.pop("logfile", None)
+    tail_options = {key: args.pop(key) for key in ("patterns", "throttle", "from_start") if key in args}
+    guard_options = {key: args.pop(key) for key in ("max_rss", "warn_rss", "timeout")}
+
+    if args.pop("preflight"):
+        try:
+            check_backends([sender_func(**args)])
+        except PreflightError as ex:
+            print("knockknock: %s" % ex, file=sys.stderr)
+            exit(1)
+
+    if pids is not None or commands_file is not None or logfile is not None:
+        if any(value is not None for value in guard_options.values()):
+            parser.error("--max-rss, --warn-rss and --timeout only apply to a command run by knockknock, "
+                         "not to watch, tail and run.")
+        # Long-running monitors only get a deadline per notification.
+        send_message = NotificationBudget(args["notification_timeout"]).wrap(sender_func(**args).send_message)
+        if pids is not None:
+            try:
+                watch_pids(pids, send_message)
+            except ProcessLookupError as ex:
+                print("knockknock: %s" % ex, file=sys.stderr)
+                exit(1)
+        elif commands_file is not None:
+            if not run_commands(read_commands(commands_file), send_message, **pool_options):
+                exit(1)
+        else:
+            tail_log(logfile, send_message=send_message, **tail_options)
+        return
 
-    def run_func(): return subprocess.run(remaining_args, check=True)
-    run_func.__name__ = " ".join(
-        remaining_args) if verbose else remaining_args[0]
+    decorator = sender_func(command=remaining_args, **args)
+    func_name = " ".join(remaining_args) if verbose else remaining_args[0]
 
-    sender_func(**args)(run_func)()
+    with track(decorator.send_message, func_name, **decorator.options) as run:
+        if any(value is not None for value in guard_options.values()):
+            # The warnings go through the deadlines of the run, with its fields.
+            run.value = run_guarded(remaining_args, run.send_message, func_name, **guard_options)
+        else:
+            run.value = subprocess.run(remaining_args, check=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+import datetime
+import threading
+import tracemalloc
+from typing import List
+
+from knockknock.snapshot import format_size, read_key_values
+
+# Number of source lines (or tracebacks) listed in the notifications.
+TOP_ALLOCATIONS = 10
+# Number of source lines listed in the growth since the last periodic snapshot.
+TOP_GROWTH = 5
+
+# Allocations of tracemalloc itself and of the import system are not interesting.
+SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                    tracemalloc.Filter(False, '<unknown>'))
+
+
+def current_rss():
+    """
+    Resident memory of the current process in bytes, None if unknown (not on Linux).
+    """
+    try:
+        # In kB.
+        return int(read_key_values('/proc/self/status')['VmRSS'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError, IndexError):
+        return None
+
+
+class AllocationProfiler:
+    """
+    Allocation profiling with `tracemalloc`, keeping `frames` frames per allocation, and
+    a thread taking a snapshot every `interval` seconds. `report` takes a last snapshot
+    and describes the source lines holding the most memory, and those that grew the
+    most since the last periodic snapshot.
+
+    Tracing has a cost while it is on: every allocation of Python objects records its
+    traceback, which makes allocation-heavy Python code noticeably slower (the more
+    `frames`, the slower) and adds memory per live block. Snapshots copy the traces,
+    which takes from milliseconds to seconds on large heaps, and the last periodic one
+    is kept in memory. Memory allocated outside of the Python allocators (e.g. tensors
+    on the GPU, most native libraries) is not traced.
+    """
+
+    def __init__(self, frames: int = 1, interval: float = 300.):
+        self.frames = frames
+        self.interval = interval
+        self.started = False
+        # (snapshot, date) of the last periodic snapshot.
+        self.previous = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # Tracing started with `-X tracemalloc` or by the code is left as it is.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started = True
+        self.thread = threading.Thread(target=self.watch, name='knockknock-allocations', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.previous = None
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    def take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            self.previous = (self.take_snapshot(), datetime.datetime.now())
+
+    def report(self) -> List[str]:
+        """
+        Lines describing the allocations, for the notifications. Only the traced memory
+        if the process is too short of memory to describe them.
+        """
+        if not tracemalloc.is_tracing():
+            return []
+        current, peak = tracemalloc.get_traced_memory()
+        traced = 'Traced Python memory: %s (peak %s)' % (format_size(current), format_size(peak))
+        try:
+            return [traced] + self.describe_allocations()
+        except MemoryError:
+            return [traced, 'Top allocations not available: out of memory']
+
+    def describe_allocations(self) -> List[str]:
+        snapshot = self.take_snapshot()
+        by_traceback = self.frames > 1 and tracemalloc.get_traceback_limit() > 1
+        contents = ['Top allocations:']
+        for stat in snapshot.statistics('traceback' if by_traceback else 'lineno')[:TOP_ALLOCATIONS]:
+            frames = stat.traceback
+            contents.append('    %s:%d: %s (%d blocks)' % (frames[-1].filename, frames[-1].lineno,
+                                                           format_size(stat.size), stat.count))
+            # Callers, innermost first.
+            for frame in reversed(frames[:-1]):
+                contents.append('        from %s:%d' % (frame.filename, frame.lineno))
+        if self.previous is not None:
+            previous, date = self.previous
+            growth = [stat for stat in snapshot.compare_to(previous, 'lineno') if stat.size_diff > 0]
+            if growth:
+                contents.append('Growth since %s:' % date.strftime('%H:%M:%S'))
+                for stat in growth[:TOP_GROWTH]:
+                    frame = stat.traceback[-1]
+                    contents.append('    %s:%d: +%s (now %s)' % (frame.filename, frame.lineno,
+                                                                 format_size(stat.size_diff), format_size(stat.size)))
+        return contents
+
+    def should_report(self, ex: BaseException = None, rss_threshold: int = None) -> bool:
+        """
+        Whether the notification of the end of the run includes the allocations: after
+        a `MemoryError`, or when the resident memory is over `rss_threshold` bytes.
+        """
+        if isinstance(ex, MemoryError):
+            return True
+        if rss_threshold is None:
+            return False
+        rss = current_rss()
+        return rss is not None and rss > rss_threshold
@@ -0,0 +1,195 @@
+import contextlib
+import gzip
+import io
+import mimetypes
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Dict, List
+
+# Size of the reads when compressing or uploading a file: files are streamed, never
+# loaded whole.
+CHUNK_SIZE = 1024 * 1024
+# Text files above this size are gzipped before being sent.
+GZIP_MIN_SIZE = 64 * 1024
+# Number of bytes inspected to tell text from binary files.
+SNIFF_SIZE = 8192
+
+
+def is_text(path: str) -> bool:
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+    if b'\0' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as ex:
+        # A multi-byte character cut at the end of the sample is fine.
+        return ex.start >= len(head) - 3
+    return True
+
+
+def gzip_file(source: str, destination: str, offset: int = 0, header: bytes = b'') -> int:
+    """
+    Compress `source`, from `offset` on and preceded by `header`, into `destination`
+    by chunks. Return the compressed size.
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        src.seek(offset)
+        with gzip.GzipFile(filename=os.path.basename(source), mode='wb', fileobj=dst, mtime=0) as gz:
+            gz.write(header)
+            shutil.copyfileobj(src, gz, CHUNK_SIZE)
+    return os.path.getsize(destination)
+
+
+class Attachment:
+    """
+    File ready to be sent: `path` is the file to upload (the original file, or a
+    gzipped and possibly truncated copy) and `name` its name in the notification.
+    """
+
+    def __init__(self, path: str, name: str, note: str = None):
+        self.path = path
+        self.name = name
+        self.size = os.path.getsize(path)
+        self.content_type = 'application/gzip' if name.endswith('.gz') else (
+            mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        # Why the file differs from the original, if it does.
+        self.note = note
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+def prepare_attachment(path: str, directory: str, max_size: int) -> Attachment:
+    """
+    Prepare `path` to be sent to a backend accepting files of at most `max_size`
+    bytes. Large text files are gzipped; if they are still too large, only their end
+    is kept (the most useful part of a log). Binary files too large are not sent.
+    Return None if the file can't be sent.
+    """
+    size = os.path.getsize(path)
+    name = os.path.basename(path)
+    text = is_text(path)
+    if size <= max_size and (size <= GZIP_MIN_SIZE or not text):
+        return Attachment(path, name)
+    if not text:
+        return None
+
+    # Names are unique in `directory`, but keep the name of the original file.
+    destination = os.path.join(directory, uuid.uuid4().hex[:8], name + '.gz')
+    os.makedirs(os.path.dirname(destination))
+    compressed_size = gzip_file(path, destination)
+    if compressed_size <= max_size:
+        return Attachment(destination, name + '.gz', 'gzipped')
+
+    # Keep the end of the file, estimating the number of bytes fitting in `max_size`
+    # from the compression ratio, with some margin.
+    kept = size
+    for _ in range(5):
+        kept = int(kept * 0.9 * max_size / compressed_size)
+        with open(path, 'rb') as f:
+            # Start at the beginning of a line.
+            f.seek(size - kept)
+            f.readline()
+            offset = f.tell()
+        header = b'[knockknock: the first %d bytes of the file were truncated]\n' % offset
+        compressed_size = gzip_file(path, destination, offset=offset, header=header)
+        if compressed_size <= max_size:
+            return Attachment(destination, name + '.gz', 'gzipped, truncated to the last %d bytes' % (size - offset))
+    return None
+
+
+@contextlib.contextmanager
+def prepare_attachments(paths: List[str], max_size: int):
+    """
+    Context manager yielding the `Attachment`s prepared from `paths` for a backend
+    accepting files of at most `max_size` bytes, and the list of the files that
+    could not be sent. Temporary files are removed when leaving the block.
+    """
+    directory = tempfile.mkdtemp(prefix='knockknock-')
+    try:
+        attachments, skipped = [], []
+        for path in paths:
+            try:
+                attachment = prepare_attachment(path, directory, max_size)
+            except OSError:
+                attachment = None
+            if attachment is None:
+                skipped.append(path)
+            else:
+                attachments.append(attachment)
+        yield attachments, skipped
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def describe_attachments(attachments: List[Attachment], skipped: List[str]) -> List[str]:
+    """
+    Lines listing the attached files, for the message sent with them.
+    """
+    contents = ['Attachment: %s (%d bytes%s)' % (attachment.name, attachment.size,
+                                                 ', ' + attachment.note if attachment.note else '')
+                for attachment in attachments]
+    contents += ['Attachment not sent (missing or too large): %s' % path for path in skipped]
+    return contents
+
+
+class MultipartStream:
+    """
+    `multipart/form-data` body with a file, read by chunks by `requests` instead of
+    being built in memory.
+
+    `fields`: Dict[str, str]
+        Form fields sent before the file.
+    `file_field`: str
+        Name of the form field of the file.
+    `attachment`: Attachment
+        The file to send.
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, attachment: Attachment):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for key, value in fields.items():
+            head += (b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                     % (self.boundary.encode(), key.encode(), str(value).encode()))
+        head += (b'--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                 b'Content-Type: %s\r\n\r\n' % (self.boundary.encode(), file_field.encode(),
+                                                attachment.name.replace('"', '').encode(),
+                                                attachment.content_type.encode()))
+        tail = b'\r\n--%s--\r\n' % self.boundary.encode()
+        self.parts = [io.BytesIO(head), attachment, io.BytesIO(tail)]
+        self.length = len(head) + attachment.size + len(tail)
+        self.current = None
+
+    @property
+    def content_type(self) -> str:
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.length
+        data = b''
+        while len(data) < size:
+            if self.current is None:
+                if not self.parts:
+                    break
+                part = self.parts.pop(0)
+                self.current = part.open() if isinstance(part, Attachment) else part
+            chunk = self.current.read(size - len(data))
+            if chunk:
+                data += chunk
+            else:
+                self.current.close()
+                self.current = None
+        return data
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
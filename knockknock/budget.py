@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+
+
+class BackgroundCall:
+    """
+    Call of `func(*args)` in a daemon thread, abandoned if it doesn't return in time:
+    a hung connection (`requests` and `smtplib` calls have no timeout by default) can
+    then neither block the caller nor the exit of the process.
+    """
+
+    def __init__(self, func, *args):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(func, args), name='knockknock-call', daemon=True)
+        self.thread.start()
+
+    def run(self, func, args):
+        try:
+            self.result = func(*args)
+        except BaseException as ex:
+            self.error = ex
+        finally:
+            self.done.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait `timeout` seconds at most for the call to return. Return whether it did.
+        """
+        return self.done.wait(timeout)
+
+    def get(self):
+        """
+        Value returned by the call, or raise the exception it raised.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class NotificationBudget:
+    """
+    Deadline on the time spent sending notifications, so that knockknock never adds
+    more than `budget` seconds to the duration of a run: each notification can take
+    `timeout` seconds at most, and all of them `budget` seconds at most. A notification
+    over its deadline is abandoned, once the budget is spent the following ones are
+    not sent, and both are reported on stderr rather than raised.
+    """
+
+    def __init__(self, timeout: float = None, budget: float = None):
+        self.timeout = timeout
+        self.remaining = budget
+        self.lock = threading.Lock()
+
+    def wrap(self, send):
+        """
+        `send` (`send_message` or `send_attachments`) within the budget.
+        """
+        if send is None or (self.timeout is None and self.remaining is None):
+            return send
+
+        def send_within_budget(*args):
+            with self.lock:
+                deadline = min(value for value in (self.timeout, self.remaining) if value is not None)
+            if deadline <= 0:
+                print('knockknock: notification not sent, the notification time budget is spent.',
+                      file=sys.stderr)
+                return None
+            start = time.monotonic()
+            call = BackgroundCall(send, *args)
+            done = call.wait(deadline)
+            if self.remaining is not None:
+                with self.lock:
+                    self.remaining -= time.monotonic() - start
+            if not done:
+                print('knockknock: notification abandoned after %gs.' % deadline, file=sys.stderr)
+                return None
+            return call.get()
+        return send_within_budget
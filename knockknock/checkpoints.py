@@ -0,0 +1,223 @@
+import datetime
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from knockknock import inotify
+from knockknock.core import DATE_FORMAT
+from knockknock.snapshot import format_size
+
+# A checkpoint is reported once no file of the directory was written for this number
+# of seconds, so that the files of a checkpoint (weights, optimizer, config...) are
+# reported together.
+SETTLE_TIME = 2.
+# Seconds between two checks of `stop`.
+STOP_CHECK_INTERVAL = 0.5
+# See `man 7 inotify`: the event is about a directory.
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (inotify.IN_CREATE | inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE
+              | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO | inotify.IN_DELETE)
+
+
+class WrittenFile:
+    """
+    File written in the watched directory: first and last write times, and size once
+    closed.
+    """
+
+    def __init__(self, now: float):
+        self.first_write = now
+        self.last_write = now
+        self.closed = None
+        self.size = 0
+
+
+class CheckpointWatcher:
+    """
+    Thread following a checkpoint directory (and its new subdirectories) with inotify,
+    and sending a "checkpoint" notification for each checkpoint written: its files,
+    size and write throughput (from the first write to the close of the last file,
+    `IN_CLOSE_WRITE`). Files written then renamed (atomic saves) are reported under
+    their final name. A warning is added when the free space of the filesystem will
+    run out before the next checkpoint at the current rate.
+    """
+
+    def __init__(self, send_message, host_name: str, func_name: str, directory: str):
+        self.send_message = send_message
+        self.host_name = host_name
+        self.func_name = func_name
+        self.directory = directory
+        self.stopped = threading.Event()
+        self.thread = None
+        self.notifier = None
+        # Watch descriptor -> path of the directory, relative to `directory`.
+        self.directories = {}
+        # Files being written, and files of the current checkpoint, by relative path.
+        self.writing: Dict[str, WrittenFile] = {}
+        self.written: Dict[str, WrittenFile] = {}
+        # Files renamed, by inotify cookie, until the matching IN_MOVED_TO.
+        self.moved: Dict[int, WrittenFile] = {}
+        # Time and free space after the previous checkpoint.
+        self.previous_checkpoint = None
+        self.previous_free = None
+
+    def start(self):
+        """
+        Start following the directory (created if needed). Print a warning and don't
+        start where inotify isn't available.
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.notifier = inotify.Inotify()
+            self.add_watch('')
+        except OSError as ex:
+            print('knockknock: checkpoints in %s are not reported: %s' % (self.directory, ex), file=sys.stderr)
+            if self.notifier is not None:
+                self.notifier.close()
+            self.notifier = None
+            return
+        self.previous_checkpoint = time.monotonic()
+        self.thread = threading.Thread(target=self.watch, name='knockknock-checkpoints', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop following the directory, after reporting a checkpoint written just before.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.notifier is not None:
+            self.notifier.close()
+            self.notifier = None
+
+    def add_watch(self, path: str):
+        wd = self.notifier.add_watch(os.path.join(self.directory, path), WATCH_MASK)
+        self.directories[wd] = path
+
+    def add_directory(self, path: str, now: float):
+        """
+        Follow the new subdirectory `path` too. Files written in it before it was
+        watched are taken as they are.
+        """
+        try:
+            self.add_watch(path)
+            names = os.listdir(os.path.join(self.directory, path))
+        except OSError:
+            return
+        for name in names:
+            full_path = os.path.join(self.directory, path, name)
+            if os.path.isdir(full_path):
+                self.add_directory(os.path.join(path, name), now)
+            elif os.path.join(path, name) not in self.writing:
+                written = WrittenFile(now)
+                written.closed = now
+                try:
+                    written.size = os.path.getsize(full_path)
+                except OSError:
+                    continue
+                self.written[os.path.join(path, name)] = written
+
+    def settled(self, now: float) -> bool:
+        """
+        Whether the current checkpoint is complete: files were written and closed, and
+        none was written for `SETTLE_TIME` seconds.
+        """
+        if not self.written:
+            return False
+        last_write = max([written.closed for written in self.written.values()]
+                         + [written.last_write for written in self.writing.values()])
+        return now - last_write >= SETTLE_TIME
+
+    def watch(self):
+        while not self.stopped.is_set():
+            for event in self.notifier.read_events(STOP_CHECK_INTERVAL):
+                self.handle(event, time.monotonic())
+            if self.settled(time.monotonic()):
+                self.report()
+        # The last checkpoint is often saved right before the end of the run.
+        for event in self.notifier.read_events(0):
+            self.handle(event, time.monotonic())
+        if self.written:
+            self.report()
+
+    def handle(self, event: inotify.Event, now: float):
+        directory = self.directories.get(event.wd)
+        if directory is None or not event.name:
+            return
+        path = os.path.join(directory, event.name)
+        if event.mask & IN_ISDIR:
+            if event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                self.add_directory(path, now)
+        elif event.mask & (inotify.IN_CREATE | inotify.IN_MODIFY):
+            if path in self.writing:
+                self.writing[path].last_write = now
+            else:
+                self.writing[path] = WrittenFile(now)
+        elif event.mask & inotify.IN_CLOSE_WRITE:
+            written = self.writing.pop(path, None) or WrittenFile(now)
+            written.closed = now
+            try:
+                written.size = os.path.getsize(os.path.join(self.directory, path))
+            except OSError:
+                # Already removed: a temporary file.
+                return
+            self.written[path] = written
+        elif event.mask & inotify.IN_MOVED_FROM:
+            written = self.written.pop(path, None)
+            if written is not None:
+                self.moved[event.cookie] = written
+        elif event.mask & inotify.IN_MOVED_TO:
+            written = self.moved.pop(event.cookie, None)
+            if written is not None:
+                self.written[path] = written
+        elif event.mask & inotify.IN_DELETE:
+            self.writing.pop(path, None)
+            self.written.pop(path, None)
+
+    def report(self):
+        now = time.monotonic()
+        files, self.written = self.written, {}
+        self.moved.clear()
+        size = sum(written.size for written in files.values())
+        first_write = min(written.first_write for written in files.values())
+        last_close = max(written.closed for written in files.values())
+        names = sorted(files)
+        contents = ['A checkpoint was saved 💾',
+                    'Machine name: %s' % self.host_name,
+                    'Main call: %s' % self.func_name,
+                    'Date: %s' % datetime.datetime.now().strftime(DATE_FORMAT),
+                    'Directory: %s' % self.directory,
+                    'Files: %s%s' % (', '.join(names[:10]), ' and %d more' % (len(names) - 10) if len(names) > 10 else ''),
+                    'Size: %s' % format_size(size)]
+        if last_close > first_write:
+            contents.append('Write throughput: %.1f MB/s (%.1fs from first write to close)'
+                            % (size / (last_close - first_write) / 1e6, last_close - first_write))
+        contents.extend(self.check_free_space(size, now))
+        self.send_message('checkpoint', contents)
+
+    def check_free_space(self, size: int, now: float) -> List[str]:
+        """
+        Free space lines, with a warning if it will run out before the next checkpoint:
+        if it is smaller than the last checkpoint, or than what the filesystem lost
+        since the previous checkpoint.
+        """
+        try:
+            stat = os.statvfs(self.directory)
+        except OSError:
+            return []
+        free = stat.f_bavail * stat.f_frsize
+        contents = ['Free space: %s' % format_size(free)]
+        consumed = size
+        if self.previous_free is not None:
+            consumed = max(consumed, self.previous_free - free)
+        if free < consumed:
+            contents.append('⚠️ Disk full before the next checkpoint: %s free, %s used in the last %s'
+                            % (format_size(free), format_size(consumed),
+                               datetime.timedelta(seconds=int(now - self.previous_checkpoint))))
+        self.previous_free = free
+        self.previous_checkpoint = now
+        return contents
@@ -1,16 +1,16 @@
-import datetime
-import functools
-import os
-import socket
-import traceback
 from typing import List
 
 import requests
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
+from knockknock.preflight import check_reachable
 
+# Maximum length of a Chime message.
+MAX_MESSAGE_LENGTH = 4096
 
-def chime_sender(webhook_url: str, user_mentions: List[str] = []):
+
+@picklable_sender
+def chime_sender(webhook_url: str, user_mentions: List[str] = [], **kwargs):
     """
     Chime sender wrapper: execute func, send a chime notification with the end status
     (successfully finished or crashed) at the end. Also send a Chime notification before
@@ -21,86 +21,21 @@ def chime_sender(webhook_url: str, user_mentions: List[str] = []):
         Visit https://docs.aws.amazon.com/chime/latest/dg/webhooks.html for more details.
     `user_mentions`: List[str] (default=[])
         Optional users alias or full email address to notify.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
 
     dump = {}
 
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = [
-                    'Your training has started 🎬',
-                    'Machine name: %s' % host_name,
-                    'Main call: %s' % func_name,
-                    'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                    ' '.join(user_mentions)
-                ]
-                dump['Content'] = '\n'.join(contents)
-                requests.post(url=webhook_url, json=dump)
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = [
-                        "Your training is complete 🎉",
-                        'Machine name: %s' % host_name,
-                        'Main call: %s' % func_name,
-                        'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                        'End date: %s' % end_time.strftime(DATE_FORMAT),
-                        'Training duration: %s' % str(elapsed_time)
-                    ]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s' % str_value)
-                    except:
-                        contents.append('Main call returned value: %s' %
-                                        "ERROR - Couldn't str the returned value.")
-
-                    contents.append(' '.join(user_mentions))
-                    dump['Content'] = '\n'.join(contents)
-                    requests.post(url=webhook_url, json=dump)
-
-                return value
+    session = PerProcess(requests.Session)
 
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = [
-                    "Your training has crashed ☠️",
-                    'Machine name: %s' % host_name,
-                    'Main call: %s' % func_name,
-                    'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                    'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                    'Crashed training duration: %s\n\n' % str(elapsed_time),
-                    "Here's the error:", '%s\n\n' % ex,
-                    "Traceback:", '%s' % traceback.format_exc(),
-                    ' '.join(user_mentions)
-                ]
-                dump['Content'] = '\n'.join(contents)
-                requests.post(url=webhook_url, json=dump)
-                raise ex
+    def send_message(event: str, contents: List[str]):
+        contents = contents + [' '.join(user_mentions)]
+        payload = dict(dump, Content='\n'.join(contents))
+        session.get().post(url=webhook_url, json=payload)
 
-        return wrapper_sender
+    def check(timeout: float):
+        check_reachable(session.get(), webhook_url, timeout)
 
-    return decorator_sender
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH, check=check, **kwargs)
@@ -0,0 +1,798 @@
+import contextlib
+import datetime
+import functools
+import inspect
+import os
+import pickle
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+import types
+import weakref
+from typing import List
+
+from knockknock import distributed
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Signals reported before the process exits when `sidecar=True`.
+HANDLED_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+# Objects of the current process that must not be shared with forked children.
+_per_process = weakref.WeakSet()
+
+# Number of `track` blocks running in the process. The metrics and phases stores are
+# global: only the outermost block resets them, so that a nested block (a tracked
+# function called by another one) doesn't wipe the metrics of the outer run.
+_active_tracks = 0
+_active_tracks_lock = threading.Lock()
+
+
+def _reset_in_child():
+    global _active_tracks, _active_tracks_lock
+    for instance in list(_per_process):
+        # Not closed: the connection still belongs to the parent.
+        instance.value = None
+    # The blocks of the parent don't run in the child.
+    _active_tracks = 0
+    _active_tracks_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+class PerProcess:
+    """
+    Object (API client, HTTP session, SMTP connection...) created by `factory` at its
+    first use in each process. The senders then hold only their configuration: they
+    don't connect before the first notification, and forked children (process pools,
+    dataloader workers) open their own connection instead of writing to the parent's
+    socket.
+    """
+
+    def __init__(self, factory, *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        _per_process.add(self)
+
+    def get(self):
+        if self.value is None:
+            self.value = self.factory(*self.args, **self.kwargs)
+        return self.value
+
+
+# Value of a `Run` whose block did not return anything.
+_NO_VALUE = object()
+
+
+class Run:
+    """
+    Handle yielded by `track`, to report the value returned by the tracked block, the
+    items yielded by a tracked iteration (see `track_iteration`), and the progress bars
+    of the block.
+    """
+
+    def __init__(self):
+        self.value = _NO_VALUE
+        # Number of items yielded so far, None if the block is not an iteration.
+        self.items = None
+        # Set if the caller stopped the iteration before the end.
+        self.stopped = False
+        # Sends a progress notification now, set by `track` when progress is reported.
+        self.report_progress = None
+        # `knockknock.progress_bars.TqdmProgress` set by `track` with `progress="tqdm"`.
+        self.progress_bars = None
+        # Sends a notification like `track` does (deadlines, fields of the run), set by
+        # `track`.
+        self.send_message = None
+
+    def format(self, elapsed: float) -> List[str]:
+        """
+        Lines describing the iteration and the progress bars after `elapsed` seconds,
+        for the notifications. Empty if the block is not an iteration and has no
+        progress bars.
+        """
+        contents = []
+        if self.items is not None:
+            line = 'Items yielded: %d' % self.items
+            if elapsed > 0:
+                line += ' (%.3g items/s)' % (self.items / elapsed)
+            contents.append(line)
+            if self.stopped:
+                contents.append('Iteration stopped by the caller before the end')
+        if self.progress_bars is not None:
+            contents.extend(self.progress_bars.format())
+        return contents
+
+
+class Message(list):
+    """
+    Lines of a notification, with the `fields` they are formatted from (`func_name`,
+    `host_name`, `rank`, and `duration` in seconds for the end of a run), for the
+    backends that don't only display the text, e.g. metrics and routing. The other
+    backends see a list of lines.
+    """
+
+    def __init__(self, lines=(), **fields):
+        super().__init__(lines)
+        self.fields = fields
+
+    def __add__(self, other):
+        # Lines appended on the way (e.g. to the attachments) keep the fields.
+        return Message(list(self) + list(other), **self.fields)
+
+
+def message_fields(contents: List[str]) -> dict:
+    """
+    Fields of the notification `contents`, empty if it is a plain list of lines.
+    """
+    return getattr(contents, 'fields', {})
+
+
+def _with_fields(send, fields: dict):
+    """
+    `send` (`send_message` or `send_attachments`) adding `fields` to the messages,
+    without overriding their own.
+    """
+    if send is None:
+        return None
+
+    def send_with_fields(event, contents, *args):
+        return send(event, Message(contents, **dict(fields, **message_fields(contents))), *args)
+    return send_with_fields
+
+
+def send_with_attachments(send_message, send_attachments, event: str, contents: List[str],
+                          attachments: List[str]):
+    """
+    Send a notification with the files `attachments`, if any and if the backend
+    supports them. A failure to send them is printed rather than raised, so that it
+    doesn't turn a completed run into a crash.
+    """
+    if not attachments:
+        send_message(event, contents)
+    elif send_attachments is None:
+        send_message(event, contents + ['Attachments not sent (not supported by this backend): %s'
+                                        % ', '.join(attachments)])
+    else:
+        try:
+            send_attachments(event, contents, attachments)
+        except Exception as ex:
+            print('knockknock: could not send the notification with its attachments: %r' % ex,
+                  file=sys.stderr)
+
+
+def _enter_track():
+    global _active_tracks
+    from knockknock import metrics, phases
+    with _active_tracks_lock:
+        if not _active_tracks:
+            metrics._store.reset()
+            phases._store.reset()
+        _active_tracks += 1
+
+
+def _exit_track():
+    global _active_tracks
+    with _active_tracks_lock:
+        _active_tracks -= 1
+
+
+def _restore_signal_handlers(previous_handlers: dict):
+    for signum, previous in previous_handlers.items():
+        signal.signal(signum, previous)
+
+
+@contextlib.contextmanager
+def track(send_message,
+          func_name: str,
+          sidecar: bool = False,
+          heartbeat_interval: float = 60.,
+          stall_timeout: float = None,
+          stall_detection: str = 'auto',
+          total_steps: int = None,
+          progress_interval: float = None,
+          progress_items: int = None,
+          history=None,
+          regression_percentile: float = 90.,
+          command: List[str] = None,
+          rendezvous_dir: str = None,
+          rendezvous_timeout: float = 60.,
+          attachments: List[str] = None,
+          repeat_window: float = None,
+          crash_index: str = None,
+          system_snapshot: str = 'crash',
+          watch_dir: str = None,
+          progress: str = None,
+          trace_allocations: int = None,
+          allocation_interval: float = 300.,
+          allocation_rss: int = None,
+          status_address: str = None,
+          notification_timeout: float = None,
+          notification_budget: float = None,
+          max_length: int = None,
+          send_attachments=None):
+    """
+    Context manager behind the `*_sender` wrappers: call `send_message` when entering
+    the block, and with the end status (sucessfully finished or crashed) when leaving
+    it. The value returned by the block, if any, can be set on the yielded `Run`.
+
+    `send_message`: Callable[[str, List[str]], Any]
+        Backend specific function posting a notification. It is called with the event
+        ("start", "complete", "crash", "died", "stall", "resume", "progress", "checkpoint",
+        "memory", "log", or any event sent with `knockknock.Notifier.send`) and the list
+        of lines of the message.
+    `func_name`: str
+        Name of the run in the messages and in the history.
+    `sidecar`: bool (default=False)
+        Fork a small watchdog process that sends a "died unexpectedly" notification if
+        the process disappears without a clean completion (SIGKILL from the OOM killer,
+        `os._exit`, segfault in a native extension...). Also install SIGTERM/SIGINT
+        handlers reporting the signal before exiting.
+        See `knockknock.sidecar.Sidecar`.
+    `heartbeat_interval`: float (default=60.)
+        Seconds between two heartbeats sent to the sidecar, reported as the last sign
+        of life of a process that died.
+    `stall_timeout`: float (default=None)
+        Alert, with the stacks of all threads, when the training makes no progress
+        within `stall_timeout` seconds. Disabled by default.
+        See `knockknock.stall.StallWatchdog`.
+    `stall_detection`: str (default='auto')
+        How progress is detected: "heartbeat" (calls to `knockknock.heartbeat()`),
+        "cpu" (CPU time of the process tree) or "auto" (heartbeats once one has been
+        sent, CPU time otherwise).
+    `total_steps`: int (default=None)
+        Total number of steps of the training, used to compute an ETA from the steps
+        logged with `knockknock.log`.
+    `progress_interval`: float (default=None)
+        Send a progress notification with the metrics logged with `knockknock.log`
+        every `progress_interval` seconds. Disabled by default.
+        See `knockknock.metrics.ProgressReporter`.
+    `progress_items`: int (default=None)
+        Send a progress notification, with the number of items and the item rate,
+        every `progress_items` items yielded by a decorated generator. Disabled by
+        default. See `track_iteration`.
+    `history`: Union[bool, str] (default=None)
+        Record the run in a local SQLite run-history store (`True` for the default
+        `~/.cache/knockknock/history.sqlite`, or a path). The start message then
+        includes the expected duration and end date from the past runs, and the
+        completion message flags duration regressions.
+        See `knockknock.history.RunHistory`.
+    `regression_percentile`: float (default=90.)
+        Percentile of the durations of the past runs above which the duration of the
+        run is flagged as a regression.
+    `command`: List[str] (default=None)
+        Command line identifying the run in the history, `sys.argv` by default.
+    `rendezvous_dir`: str (default=None)
+        Directory on a filesystem shared by all the ranks of a distributed job. Each
+        rank writes its duration there, and the completion message of rank 0 includes
+        a per-rank timing breakdown (min, median, max and slowest ranks with their host)
+        to spot stragglers. See `knockknock.distributed.gather_rank_timings`.
+    `rendezvous_timeout`: float (default=60.)
+        Maximum number of seconds rank 0 waits for the timings of the other ranks.
+    `attachments`: List[str] (default=None)
+        Files (e.g. a loss curve, the final metrics, the full log) attached to the
+        completion or crash message, read when the run ends. They are streamed to the
+        backend; large text files are gzipped and, above the size limit of the backend,
+        truncated to their end. See `knockknock.attachments.prepare_attachments`.
+    `repeat_window`: float (default=None)
+        Fingerprint each crash (exception type and innermost frames) and don't notify
+        a crash identical to one notified less than `repeat_window` seconds ago, e.g.
+        by a job restarted by torchelastic or SLURM `--requeue`, or by the other ranks.
+        The next occurrence after the window is notified with the number of repeats.
+        See `knockknock.fingerprint.CrashIndex`.
+    `crash_index`: str (default=None)
+        Path of the local crash index, `~/.cache/knockknock/crashes.sqlite` by default.
+    `system_snapshot`: str (default='crash')
+        Add a snapshot of the machine (load, memory, swap, free disk space, file
+        descriptors, threads, cgroup memory) to the crash messages ("crash"), to the
+        start message too ("always"), or never (None). It is read from `/proc` and
+        `/sys/fs/cgroup` within a fraction of a second.
+        See `knockknock.snapshot.system_snapshot`.
+    `watch_dir`: str (default=None)
+        Checkpoint directory to follow with inotify: each checkpoint written there is
+        reported with its size and write throughput, with a warning when the free
+        space will run out before the next one.
+        See `knockknock.checkpoints.CheckpointWatcher`.
+    `progress`: str (default=None)
+        With "tqdm", add the description, n/total, smoothed rate and ETA of the tqdm
+        progress bars of the block to the progress, completion and crash messages,
+        without any change to the loops. See `knockknock.progress_bars.TqdmProgress`.
+    `trace_allocations`: int (default=None)
+        Trace the allocations with `tracemalloc`, keeping this number of frames per
+        allocation. The crash message of a `MemoryError` then includes the source
+        lines holding the most memory and their growth since the last periodic
+        snapshot. Off by default: tracing makes allocation-heavy Python code
+        noticeably slower and uses more memory.
+        See `knockknock.allocations.AllocationProfiler`.
+    `allocation_interval`: float (default=300.)
+        Seconds between two periodic snapshots of the allocations.
+    `allocation_rss`: int (default=None)
+        Also include the allocations in the completion or crash message when the run
+        ends with a resident memory over this number of bytes.
+    `status_address`: str (default=None)
+        Serve the live state of the run (elapsed time, phase, metrics, resource usage,
+        recent notifications) as JSON over HTTP on this address: "PORT" or "HOST:PORT"
+        (localhost by default), or the path of a Unix socket. Polling it costs nothing
+        between requests. See `knockknock.status.StatusServer`.
+    `notification_timeout`: float (default=None)
+        Maximum number of seconds spent sending a notification. A notification over
+        this deadline is abandoned (and reported on stderr).
+    `notification_budget`: float (default=None)
+        Maximum number of seconds spent sending all the notifications of the run, so
+        that knockknock never delays the end of a job by more than that.
+        See `knockknock.budget.NotificationBudget`.
+    `max_length`: int (default=None)
+        Maximum length of a message on the backend, used to trim stack dumps.
+    `send_attachments`: Callable[[str, List[str], List[str]], Any] (default=None)
+        Backend specific function posting a notification with the files `attachments`,
+        None if the backend doesn't support attachments.
+    """
+    if progress not in (None, 'tqdm'):
+        raise ValueError('Unknown progress integration: %s' % progress)
+    from knockknock.budget import NotificationBudget
+    budget = NotificationBudget(notification_timeout, notification_budget)
+    send_message = budget.wrap(send_message)
+    send_attachments = budget.wrap(send_attachments)
+
+    start_time = datetime.datetime.now()
+    # Durations are measured with a monotonic clock, not affected by NTP or DST changes.
+    start_counter = time.perf_counter()
+    from knockknock.snapshot import system_snapshot as take_snapshot
+    host_name = socket.gethostname()
+    # Set once a notification about the end of the run has been sent, so that
+    # an exception raised by a signal handler is not reported twice.
+    reported = []
+
+    # Handling distributed training edge case.
+    # Distributed launchers (torch.distributed, SLURM, Open MPI, MPICH...) set up the rank of each
+    # process in environment variables, see `knockknock.distributed.get_rank`.
+    # This can be used to detect the master process.
+    # Except for errors, only the master process will send notifications.
+    rank = distributed.get_rank()
+    if rank is not None:
+        master_process = (rank == 0)
+        host_name += ' - RANK: %s' % rank
+    else:
+        master_process = True
+    job_id = distributed.get_job_id(func_name)
+    if rendezvous_dir is not None and rank is not None and job_id is None:
+        if master_process:
+            print('knockknock: no job identifier shared by the ranks (e.g. SLURM_JOB_ID, MASTER_ADDR), '
+                  'skipping the per-rank timing breakdown.', file=sys.stderr)
+        rendezvous_dir = None
+    fields = {'func_name': func_name, 'host_name': socket.gethostname(), 'rank': rank}
+    send_message = _with_fields(send_message, fields)
+    send_attachments = _with_fields(send_attachments, fields)
+
+    # Everything started below is stopped, in reverse order, when the block ends or
+    # when the setup fails half-way.
+    cleanup = contextlib.ExitStack()
+    try:
+        # Opened first: the signal handlers read it, and it is the likeliest to fail (a
+        # wrong path).
+        run_history = None
+        past_durations = []
+        if history:
+            from knockknock.history import RunHistory
+            run_history = RunHistory(None if history is True else history,
+                                     regression_percentile=regression_percentile)
+            cleanup.callback(run_history.close)
+            history_key = (func_name, ' '.join(command or sys.argv), socket.gethostname(), rank or 0)
+            past_durations = run_history.durations(*history_key)
+            run_history.start(*history_key, start_time.timestamp())
+
+        status_server = None
+        if status_address is not None and master_process:
+            from knockknock.status import StatusServer
+            status_server = StatusServer(status_address, host_name, func_name, start_time, total_steps=total_steps)
+            send_message = status_server.record(send_message)
+            if send_attachments is not None:
+                send_attachments = status_server.record(send_attachments)
+
+        sidecar_process = None
+        previous_handlers = {}
+        if sidecar:
+            from knockknock.sidecar import Sidecar
+            sidecar_process = Sidecar(send_message, host_name, func_name, start_time,
+                                      heartbeat_interval=heartbeat_interval, start_counter=start_counter)
+            sidecar_process.start()
+            cleanup.callback(sidecar_process.done)
+
+            def handle_signal(signum, frame):
+                end_time = datetime.datetime.now()
+                elapsed_time = datetime.timedelta(seconds=time.perf_counter() - start_counter)
+                contents = Message(["Your training has been stopped by %s ☠️" % signal.Signals(signum).name,
+                                    'Machine name: %s' % host_name,
+                                    'Main call: %s' % func_name,
+                                    'Starting date: %s' % start_time.strftime(DATE_FORMAT),
+                                    'Crash date: %s' % end_time.strftime(DATE_FORMAT),
+                                    'Crashed training duration: %s' % str(elapsed_time)],
+                                   duration=elapsed_time.total_seconds())
+                if system_snapshot is not None:
+                    contents.extend(take_snapshot())
+                contents += ['\n',
+                             "Interrupted at:",
+                             '%s' % ''.join(traceback.format_stack(frame))]
+                if run_history is not None:
+                    run_history.finish(signal.Signals(signum).name, elapsed_time.total_seconds())
+                if not reported:
+                    reported.append(signum)
+                    send_message('crash', contents)
+                sidecar_process.done()
+
+                # Let the process exit the way it would have without knockknock.
+                previous = previous_handlers.pop(signum)
+                signal.signal(signum, previous)
+                if callable(previous):
+                    previous(signum, frame)
+                elif previous == signal.SIG_DFL:
+                    os.kill(os.getpid(), signum)
+
+            # Signal handlers can only be installed from the main thread.
+            if threading.current_thread() is threading.main_thread():
+                for signum in HANDLED_SIGNALS:
+                    previous_handlers[signum] = signal.signal(signum, handle_signal)
+                cleanup.callback(_restore_signal_handlers, previous_handlers)
+
+        if status_server is not None:
+            # Started after the fork of the sidecar, which must not hold the listening socket.
+            status_server.start()
+            cleanup.callback(status_server.stop)
+
+        stall_watchdog = None
+        if stall_timeout is not None:
+            from knockknock.stall import StallWatchdog
+            stall_watchdog = StallWatchdog(send_message, host_name, func_name, start_time,
+                                           timeout=stall_timeout, detection=stall_detection,
+                                           max_length=max_length)
+            stall_watchdog.start()
+            cleanup.callback(stall_watchdog.stop)
+
+        checkpoint_watcher = None
+        if watch_dir is not None and master_process:
+            from knockknock.checkpoints import CheckpointWatcher
+            checkpoint_watcher = CheckpointWatcher(send_message, host_name, func_name, watch_dir)
+            checkpoint_watcher.start()
+            cleanup.callback(checkpoint_watcher.stop)
+
+        from knockknock import metrics, phases
+        _enter_track()
+        cleanup.callback(_exit_track)
+        allocation_profiler = None
+        if trace_allocations is not None:
+            from knockknock.allocations import AllocationProfiler
+            allocation_profiler = AllocationProfiler(trace_allocations, allocation_interval)
+            allocation_profiler.start()
+            cleanup.callback(allocation_profiler.stop)
+
+        run = Run()
+        run.send_message = send_message
+        if status_server is not None:
+            status_server.run = run
+        if progress == 'tqdm':
+            from knockknock.progress_bars import TqdmProgress
+            run.progress_bars = TqdmProgress()
+            run.progress_bars.start()
+            cleanup.callback(run.progress_bars.stop)
+        progress_reporter = None
+        if (progress_interval is not None or progress_items is not None) and master_process:
+            progress_reporter = metrics.ProgressReporter(send_message, host_name, func_name, start_time,
+                                                         interval=progress_interval, total_steps=total_steps,
+                                                         run=run, start_counter=start_counter)
+            run.report_progress = progress_reporter.send
+            if progress_interval is not None:
+                progress_reporter.start()
+                cleanup.callback(progress_reporter.stop)
+
+        if master_process:
+            contents = ['Your training has started 🎬',
+                        'Machine name: %s' % host_name,
+                        'Main call: %s' % func_name,
+                        'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
+            if run_history is not None:
+                contents.extend(run_history.expected_duration(past_durations, start_time))
+            if system_snapshot == 'always':
+                contents.extend(take_snapshot())
+            send_message('start', contents)
+
+        try:
+            yield run
+            value = run.value
+
+            end_time = datetime.datetime.now()
+            elapsed_time = datetime.timedelta(seconds=time.perf_counter() - start_counter)
+            if run_history is not None:
+                run_history.finish('complete', elapsed_time.total_seconds())
+            if rendezvous_dir is not None and rank is not None:
+                distributed.report_rank_timing(rendezvous_dir, job_id, rank,
+                                               elapsed_time.total_seconds(), 'complete')
+
+            if master_process:
+                contents = Message(["Your training is complete 🎉",
+                                    'Machine name: %s' % host_name,
+                                    'Main call: %s' % func_name,
+                                    'Starting date: %s' % start_time.strftime(DATE_FORMAT),
+                                    'End date: %s' % end_time.strftime(DATE_FORMAT),
+                                    'Training duration: %s' % str(elapsed_time)],
+                                   duration=elapsed_time.total_seconds())
+
+                if value is not _NO_VALUE:
+                    try:
+                        str_value = str(value)
+                        contents.append('Main call returned value: %s'% str_value)
+                    except:
+                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
+
+                contents.extend(run.format(elapsed_time.total_seconds()))
+                contents.extend(metrics._store.format(total_steps))
+                contents.extend(phases._store.format(elapsed_time.total_seconds()))
+                if allocation_profiler is not None and allocation_profiler.should_report(rss_threshold=allocation_rss):
+                    contents.extend(allocation_profiler.report())
+                if run_history is not None:
+                    contents.extend(run_history.regression(past_durations, elapsed_time.total_seconds()))
+                if rendezvous_dir is not None and rank is not None:
+                    contents.extend(distributed.gather_rank_timings(
+                        rendezvous_dir, job_id, distributed.get_world_size() or 1, rendezvous_timeout,
+                        start_time.timestamp()))
+                send_with_attachments(send_message, send_attachments, 'complete', contents, attachments)
+
+        except BaseException as ex:
+            # `sys.exit(0)` is a clean completion, `KeyboardInterrupt` and other
+            # exits are reported like any crash.
+            end_time = datetime.datetime.now()
+            elapsed_time = datetime.timedelta(seconds=time.perf_counter() - start_counter)
+            if isinstance(ex, SystemExit) and ex.code in (0, None):
+                if run_history is not None:
+                    run_history.finish('complete', elapsed_time.total_seconds())
+                raise ex
+            if run_history is not None:
+                run_history.finish('crash' if isinstance(ex, Exception) else type(ex).__name__,
+                                   elapsed_time.total_seconds())
+            if rendezvous_dir is not None and rank is not None and not master_process:
+                distributed.report_rank_timing(rendezvous_dir, job_id, rank,
+                                               elapsed_time.total_seconds(), 'crash')
+            if reported:
+                raise ex
+            crash_contents = []
+            if repeat_window is not None:
+                from knockknock.fingerprint import check_crash
+                crash_contents = check_crash(ex, crash_index, window=repeat_window, func_name=func_name,
+                                             command=' '.join(command or sys.argv))
+                if crash_contents is None:
+                    # Already notified recently.
+                    raise ex
+            contents = Message(["Your training has crashed ☠️",
+                                'Machine name: %s' % host_name,
+                                'Main call: %s' % func_name,
+                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
+                                'Crash date: %s' % end_time.strftime(DATE_FORMAT),
+                                'Crashed training duration: %s' % str(elapsed_time)],
+                               duration=elapsed_time.total_seconds())
+            contents.extend(crash_contents)
+            contents.extend(run.format(elapsed_time.total_seconds()))
+            contents.extend(metrics._store.format(total_steps))
+            contents.extend(phases._store.format(elapsed_time.total_seconds()))
+            if allocation_profiler is not None and allocation_profiler.should_report(ex, allocation_rss):
+                contents.extend(allocation_profiler.report())
+            if system_snapshot is not None:
+                contents.extend(take_snapshot())
+            contents += ['\n',
+                         "Here's the error:",
+                         '%s\n\n' % (ex if str(ex) else type(ex).__name__),
+                         "Traceback:",
+                         '%s' % traceback.format_exc()]
+            reported.append(ex)
+            send_with_attachments(send_message, send_attachments, 'crash', contents, attachments)
+            raise ex
+
+    finally:
+        cleanup.close()
+
+
+def track_iteration(send_message, func_name: str, iterable, **options):
+    """
+    Generator yielding the items of `iterable`, tracked like a decorated function: the
+    start notification is sent when the iteration starts, the completion notification
+    when `iterable` is exhausted or the caller stops iterating, and the crash
+    notification if it raises. Messages include the number of items and the item rate.
+    Values sent and exceptions thrown into the generator are passed on to `iterable`
+    when it is a generator.
+
+    `send_message`: Callable[[str, List[str]], Any]
+        Backend specific function posting a notification, see `track`.
+    `func_name`: str
+        Name of the run in the messages and in the history.
+    `iterable`: Iterable
+        The items to yield.
+    `options`:
+        Options shared by all senders, see `track`.
+    """
+    iterator = iter(iterable)
+    forward = inspect.isgenerator(iterator)
+    with track(send_message, func_name, **options) as run:
+        every = options.get('progress_items') if run.report_progress is not None else None
+        next_report = every or -1
+        run.items = items = 0
+        try:
+            item = next(iterator)
+            while True:
+                # Hot path: a counter increment per item.
+                items += 1
+                run.items = items
+                if items == next_report:
+                    run.report_progress()
+                    next_report += every
+                try:
+                    sent = yield item
+                except GeneratorExit:
+                    if forward:
+                        iterator.close()
+                    run.stopped = True
+                    break
+                except BaseException as ex:
+                    if not forward:
+                        raise
+                    item = iterator.throw(ex)
+                else:
+                    item = iterator.send(sent) if forward else next(iterator)
+        except StopIteration as stop:
+            if stop.value is not None:
+                run.value = stop.value
+
+
+async def track_async_iteration(send_message, func_name: str, iterable, **options):
+    """
+    Asynchronous generator yielding the items of the asynchronous iterable `iterable`,
+    see `track_iteration`.
+    """
+    iterator = iterable.__aiter__()
+    forward = inspect.isasyncgen(iterator)
+    with track(send_message, func_name, **options) as run:
+        every = options.get('progress_items') if run.report_progress is not None else None
+        next_report = every or -1
+        run.items = items = 0
+        try:
+            item = await iterator.__anext__()
+            while True:
+                items += 1
+                run.items = items
+                if items == next_report:
+                    run.report_progress()
+                    next_report += every
+                try:
+                    sent = yield item
+                except GeneratorExit:
+                    if forward:
+                        await iterator.aclose()
+                    run.stopped = True
+                    break
+                except BaseException as ex:
+                    if not forward:
+                        raise
+                    item = await iterator.athrow(ex)
+                else:
+                    item = await (iterator.asend(sent) if forward else iterator.__anext__())
+        except StopAsyncIteration:
+            pass
+
+
+class TrackedFunction:
+    """
+    Function decorated by a `*_sender` wrapper. Pickled by reference like the function
+    it replaces when defined at the top level of a module, and otherwise with its
+    sender, so that it can be sent to `multiprocessing` and `ProcessPoolExecutor`
+    workers.
+    """
+
+    def __init__(self, func, decorator):
+        self.func = func
+        self.decorator = decorator
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        # Generators are tracked while they are iterated, not when they are created.
+        if inspect.isgeneratorfunction(self.func):
+            return track_iteration(self.decorator.send_message, self.func.__name__,
+                                   self.func(*args, **kwargs), **self.decorator.options)
+        if inspect.isasyncgenfunction(self.func):
+            return track_async_iteration(self.decorator.send_message, self.func.__name__,
+                                         self.func(*args, **kwargs), **self.decorator.options)
+        with track(self.decorator.send_message, self.func.__name__, **self.decorator.options) as run:
+            run.value = self.func(*args, **kwargs)
+        return run.value
+
+    def __get__(self, instance, owner=None):
+        # Decorated methods.
+        return self if instance is None else types.MethodType(self, instance)
+
+    def __reduce__(self):
+        module = sys.modules.get(self.__module__)
+        target = module
+        for name in self.__qualname__.split('.'):
+            target = getattr(target, name, None)
+        if target is self:
+            return self.__qualname__
+        return TrackedFunction, (self.func, self.decorator)
+
+
+class SenderDecorator:
+    """
+    Decorator returned by the `*_sender` wrappers, giving access to the backend and its
+    options for notifications outside of a decorated function (e.g. `knockknock
+    watch`, `knockknock.Notifier`).
+    """
+
+    def __init__(self, send_message, options, check=None):
+        self.send_message = send_message
+        self.options = options
+        # Checks the configuration of the backend, see `knockknock.preflight`.
+        self.check = check
+        # (callable, arguments) rebuilding the decorator, set by `picklable_sender`.
+        self.factory = None
+
+    def __call__(self, func):
+        return TrackedFunction(func, self)
+
+    def with_options(self, **options):
+        """
+        Same decorator with other values for the options shared by all senders.
+        """
+        decorator = sender_decorator(self.send_message, check=self.check, **dict(self.options, **options))
+        if self.factory is not None:
+            decorator.factory = (functools.partial(self.factory[0], **options), ())
+        return decorator
+
+    def __reduce__(self):
+        if self.factory is None:
+            raise pickle.PicklingError('Only the decorators returned by the `*_sender` functions can be pickled.')
+        return self.factory
+
+
+def picklable_sender(sender_func):
+    """
+    Make the decorators returned by the `*_sender` function `sender_func` picklable:
+    they are rebuilt from the arguments of `sender_func` in the other process, where
+    the backend clients are then created on first use (see `PerProcess`).
+    """
+    @functools.wraps(sender_func)
+    def wrapper(*args, **kwargs):
+        decorator = sender_func(*args, **kwargs)
+        # The backends are checked once, not again in every process.
+        kwargs.pop('preflight', None)
+        decorator.factory = (functools.partial(wrapper, *args, **kwargs), ())
+        return decorator
+    return wrapper
+
+
+def sender_decorator(send_message, check=None, preflight: bool = False, **options):
+    """
+    Shared implementation of the `*_sender` wrappers: execute func, call `send_message`
+    with the end status (sucessfully finished or crashed) at the end. Also call
+    `send_message` before executing func.
+
+    `send_message`: Callable[[str, List[str]], Any]
+        Backend specific function posting a notification, see `track`.
+    `check`: Callable[[float], Any] (default=None)
+        Backend specific function checking the configuration of the backend without
+        posting anything, given a timeout in seconds. Raises if it is wrong.
+    `preflight`: bool (default=False)
+        Check the backend now, and raise `knockknock.preflight.PreflightError` if the
+        check fails. See `knockknock.preflight.check_backends`.
+    `options`:
+        Options shared by all senders, see `track`.
+    """
+    # Fail early on unknown options.
+    inspect.signature(track).bind(send_message, None, **options)
+    decorator = SenderDecorator(send_message, options, check=check)
+    if preflight:
+        from knockknock.preflight import check_backends
+        check_backends([decorator])
+    return decorator
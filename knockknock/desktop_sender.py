@@ -1,103 +1,180 @@
+from typing import List
 import os
-import datetime
-import traceback
-import functools
-import socket
+import shutil
 import subprocess
+import sys
 import platform
+import threading
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.core import picklable_sender, sender_decorator
 
-def desktop_sender(title: str = "knockknock"):
-    
-    def show_notification(text: str, title: str):
-        # Check the OS
-        if platform.system() == "Darwin":     
-            subprocess.run(["sh", "-c", "osascript -e 'display notification \"%s\" with title \"%s\"'" % (text, title)])
-        
-        elif platform.system() == "Linux":
+# The notification backend is resolved once per process, see `get_notifier`.
+_notifier = None
+
+
+def _forget_in_child():
+    # A forked child opens its own D-Bus connection instead of sharing the parent's.
+    global _notifier
+    _notifier = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_in_child)
+
+
+class DBusNotifier:
+    """
+    Linux notifier talking directly to `org.freedesktop.Notifications` over a
+    persistent session bus connection, instead of spawning `notify-send` for
+    every event. The id returned by the server is used to update the same
+    notification in place. If no notification server answers on the bus (e.g.
+    headless or SSH sessions), `notify-send` is used from then on.
+    """
+
+    def __init__(self, bus: str = "SESSION", timeout: float = 5.):
+        from jeepney import DBusAddress
+        self.bus = bus
+        self.timeout = timeout
+        self.address = DBusAddress("/org/freedesktop/Notifications",
+                                   bus_name="org.freedesktop.Notifications",
+                                   interface="org.freedesktop.Notifications")
+        self.lock = threading.Lock()
+        self.connection = None
+        # Set once the notification server failed to answer.
+        self.fallback = None
+        self.connect()
+
+    def connect(self):
+        from jeepney.io.blocking import open_dbus_connection
+        self.connection = open_dbus_connection(bus=self.bus)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def call(self, message):
+        from jeepney.wrappers import unwrap_msg
+        return unwrap_msg(self.connection.send_and_get_reply(message, timeout=self.timeout))
+
+    def notify(self, title: str, text: str, replaces_id: int = 0) -> int:
+        from jeepney import new_method_call
+        from jeepney.wrappers import DBusErrorResponse
+        message = new_method_call(self.address, "Notify", "susssasa{sv}i",
+                                  ("knockknock", replaces_id, "", title, text, [], {}, -1))
+        with self.lock:
+            if self.fallback is None:
+                try:
+                    try:
+                        return self.call(message)[0]
+                    except TimeoutError:
+                        raise
+                    except OSError:
+                        # The bus connection went away (e.g. session restarted): reconnect once.
+                        self.connect()
+                        return self.call(message)[0]
+                except (DBusErrorResponse, OSError) as ex:
+                    # E.g. ServiceUnknown: no notification server is registered on the bus.
+                    print('knockknock: no D-Bus notification server (%s), using notify-send.' % ex,
+                          file=sys.stderr)
+                    self.close()
+                    self.fallback = NotifySendNotifier()
+        return self.fallback.notify(title, text)
+
+
+class NotifySendNotifier:
+    """
+    Fallback Linux notifier when no session bus or notification server can be reached
+    from Python.
+    """
+
+    def notify(self, title: str, text: str, replaces_id: int = 0) -> int:
+        try:
             subprocess.run(["notify-send", title, text])
-        
-        elif platform.system() == "Windows":
-            try:
-                from win10toast import ToastNotifier
-            except ImportError as err:
-                print('Error: to use Windows Desktop Notifications, you need to install `win10toast` first. Please run `pip install win10toast==0.9`.')
-
-            toaster = ToastNotifier()
-            toaster.show_toast(title,
-                               text,
-                               icon_path=None,
-                               duration=5)
-
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                text = '\n'.join(contents)
-                show_notification(text, title)
+        except OSError as ex:
+            # Not installed: a missing notification must not stop the run.
+            print('knockknock: the desktop notification was not shown: %s' % ex, file=sys.stderr)
+        return 0
 
+
+class OsascriptNotifier:
+
+    def notify(self, title: str, text: str, replaces_id: int = 0) -> int:
+        script = 'display notification "%s" with title "%s"' % (text.replace('"', '\\"'),
+                                                                title.replace('"', '\\"'))
+        subprocess.run(["osascript", "-e", script])
+        return 0
+
+
+class Win10ToastNotifier:
+
+    def __init__(self):
+        try:
+            from win10toast import ToastNotifier
+        except ImportError as err:
+            print('Error: to use Windows Desktop Notifications, you need to install `win10toast` first. Please run `pip install win10toast==0.9`.')
+            raise err
+        self.toaster = ToastNotifier()
+
+    def notify(self, title: str, text: str, replaces_id: int = 0) -> int:
+        self.toaster.show_toast(title,
+                                text,
+                                icon_path=None,
+                                duration=5)
+        return 0
+
+
+def get_notifier():
+    """
+    Resolve the desktop notification backend for the current platform once,
+    and reuse it (and its D-Bus connection on Linux) for every event.
+    """
+    global _notifier
+    if _notifier is None:
+        system = platform.system()
+        if system == "Darwin":
+            _notifier = OsascriptNotifier()
+        elif system == "Linux":
             try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
+                _notifier = DBusNotifier()
+            except Exception:
+                # `jeepney` is missing or there is no reachable session bus.
+                _notifier = NotifySendNotifier()
+        elif system == "Windows":
+            _notifier = Win10ToastNotifier()
+        else:
+            raise OSError("Desktop notifications are not supported on %s." % system)
+    return _notifier
 
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
-
-                    text = '\n'.join(contents)
-                    show_notification(text, title)
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                text = '\n'.join(contents)
-                show_notification(text, title)
-                raise ex
-
-        return wrapper_sender
-
-    return decorator_sender
+
+@picklable_sender
+def desktop_sender(title: str = "knockknock", **kwargs):
+    """
+    Desktop sender wrapper: execute func, show a desktop notification with the end status
+    (sucessfully finished or crashed) at the end. Also show a notification before
+    executing func. On Linux, the completion or crash notification replaces the start
+    one in place.
+
+    `title`: str (default="knockknock")
+        The title of the notification.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
+    """
+
+    def show_notification(text: str, title: str, replaces_id: int = 0) -> int:
+        return get_notifier().notify(title, text, replaces_id=replaces_id)
+
+    # Id of the last notification, updated in place by the following events of the run.
+    notification = {'id': 0}
+
+    def send_message(event: str, contents: List[str]):
+        text = '\n'.join(contents)
+        replaces_id = 0 if event == 'start' else notification['id']
+        notification['id'] = show_notification(text, title, replaces_id=replaces_id)
+
+    def check(timeout: float):
+        if isinstance(get_notifier(), NotifySendNotifier) and shutil.which("notify-send") is None:
+            raise OSError('No D-Bus session bus and no notify-send to show desktop notifications.')
+
+    return sender_decorator(send_message, check=check, **kwargs)
@@ -1,23 +1,23 @@
 from typing import List
-import os
 import datetime
-import traceback
-import functools
-import json
-import socket
 import requests
-import time
 import hmac
 import hashlib
 import base64
 import urllib
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
+from knockknock.preflight import check_reachable
 
+# Maximum length of a DingTalk message.
+MAX_MESSAGE_LENGTH = 20000
+
+
+@picklable_sender
 def dingtalk_sender(webhook_url: str,
                     user_mentions: List[str] = [],
                     secret: str = '',
-                    keywords: List[str] = []):
+                    keywords: List[str] = [], **kwargs):
     """
     DingTalk sender wrapper: execute func, send a DingTalk notification with the end status
     (sucessfully finished or crashed) at the end. Also send a DingTalk notification before
@@ -38,7 +38,9 @@ def dingtalk_sender(webhook_url: str,
         Vist https://ding-doc.dingtalk.com/doc#/serverapi2/qf2nxq from more details.
     `keywords`: List[str] (default=[])
         see `secret`
-
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
     msg_template = {
         "msgtype": "text", 
@@ -65,98 +67,18 @@ def dingtalk_sender(webhook_url: str,
                         + '&sign={}'.format(sign) 
         return encrypted_url
 
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                contents.extend(['@{}'.format(i) for i in user_mentions])
-                contents.extend(keywords)
-                
-                msg_template['text']['content'] = '\n'.join(contents)
-                if secret:
-                    postto = _construct_encrypted_url()
-                    requests.post(postto, json=msg_template)
-                else:
-                    requests.post(webhook_url, json=msg_template)
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
-
-                    contents.extend(['@{}'.format(i) for i in user_mentions])
-                    contents.extend(keywords)
-
-                    msg_template['text']['content'] = '\n'.join(contents)
-                    if secret:
-                        postto = _construct_encrypted_url()
-                        requests.post(postto, json=msg_template)
-                    else:
-                        requests.post(webhook_url, json=msg_template)
-                        print(msg_template)
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                contents.extend(['@{}'.format(i) for i in user_mentions])
-                contents.extend(keywords)
-                
-                msg_template['text']['content'] = '\n'.join(contents)
-                if secret:
-                    postto = _construct_encrypted_url()
-                    requests.post(postto, json=msg_template)
-                else:
-                    requests.post(webhook_url, json=msg_template)
-                    print(msg_template)
+    session = PerProcess(requests.Session)
 
-                raise ex
+    def send_message(event: str, contents: List[str]):
+        contents = contents + ['@{}'.format(i) for i in user_mentions] + keywords
+        payload = dict(msg_template, text=dict(msg_template['text'], content='\n'.join(contents)))
+        if secret:
+            postto = _construct_encrypted_url()
+            session.get().post(postto, json=payload)
+        else:
+            session.get().post(webhook_url, json=payload)
 
-        return wrapper_sender
+    def check(timeout: float):
+        check_reachable(session.get(), webhook_url, timeout)
 
-    return decorator_sender
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH, check=check, **kwargs)
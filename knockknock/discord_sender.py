@@ -1,15 +1,18 @@
-import datetime
-import functools
+from typing import List
 import json
-import os
 import requests
-import socket
-import traceback
 
+from knockknock.attachments import MultipartStream, describe_attachments, prepare_attachments
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Maximum length of a Discord message.
+MAX_MESSAGE_LENGTH = 2000
+# Maximum size of a file sent through a webhook.
+MAX_ATTACHMENT_SIZE = 10 * 1024 ** 2
 
-def discord_sender(webhook_url: str):
+
+@picklable_sender
+def discord_sender(webhook_url: str, **kwargs):
     """
     Discord sender wrapper: execute func, send a Discord message with the end status
     (sucessfully finished or crashed) at the end. Also send a Discord message before
@@ -19,80 +22,32 @@ def discord_sender(webhook_url: str):
         The Discord webhook URL for posting messages.
         Visit https://support.discordapp.com/hc/en-us/articles/228383668-Intro-to-Webhooks to
         set up your webhook and get your URL.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
-    def decorator_sender(func):
-        def send_message(text: str):
-            headers = {'Content-Type': 'application/json'}
-            payload = json.dumps({'content': text})
-            r = requests.post(url=webhook_url, data=payload, headers=headers)
-        
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                text = '\n'.join(contents)
-                send_message(text=text)
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
-
-                    text = '\n'.join(contents)
-                    send_message(text=text)
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                text = '\n'.join(contents)
-                send_message(text=text)
-                raise ex
-
-        return wrapper_sender
-
-    return decorator_sender
+    session = PerProcess(requests.Session)
+
+    def send_message(event: str, contents: List[str]):
+        headers = {'Content-Type': 'application/json'}
+        payload = json.dumps({'content': '\n'.join(contents)})
+        r = session.get().post(url=webhook_url, data=payload, headers=headers)
+
+    def send_attachments(event: str, contents: List[str], paths: List[str]):
+        with prepare_attachments(paths, MAX_ATTACHMENT_SIZE) as (attachments, skipped):
+            send_message(event, contents + describe_attachments(attachments, skipped))
+            for attachment in attachments:
+                body = MultipartStream({'payload_json': json.dumps({'content': attachment.name})},
+                                       'files[0]', attachment)
+                try:
+                    session.get().post(url=webhook_url, data=body,
+                                       headers={'Content-Type': body.content_type}).raise_for_status()
+                finally:
+                    body.close()
+
+    def check(timeout: float):
+        # Returns the webhook without posting anything.
+        session.get().get(webhook_url, timeout=timeout).raise_for_status()
+
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH,
+                            send_attachments=send_attachments, check=check, **kwargs)
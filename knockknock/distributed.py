@@ -0,0 +1,142 @@
+import json
+import os
+import socket
+import statistics
+import time
+from typing import List, Optional
+
+# Environment variables set by the usual launchers, by order of precedence:
+# torch.distributed / torchrun, SLURM, Open MPI, MPICH / Intel MPI (PMI), PMIx.
+RANK_VARIABLES = ('RANK', 'SLURM_PROCID', 'OMPI_COMM_WORLD_RANK', 'PMI_RANK', 'PMIX_RANK')
+WORLD_SIZE_VARIABLES = ('WORLD_SIZE', 'SLURM_NTASKS', 'OMPI_COMM_WORLD_SIZE', 'PMI_SIZE')
+LOCAL_RANK_VARIABLES = ('LOCAL_RANK', 'SLURM_LOCALID', 'OMPI_COMM_WORLD_LOCAL_RANK', 'MPI_LOCALRANKID')
+# Identifiers shared by all the processes of a job, used to name the rendezvous directory.
+JOB_ID_VARIABLES = ('TORCHELASTIC_RUN_ID', 'SLURM_JOB_ID', 'PBS_JOBID', 'LSB_JOBID', 'OMPI_MCA_ess_base_jobid')
+# Attempts of a requeued or restarted job, which keeps its identifier.
+RESTART_COUNT_VARIABLES = ('TORCHELASTIC_RESTART_COUNT', 'SLURM_RESTART_COUNT')
+
+# Number of slowest ranks listed in the timing breakdown.
+SLOWEST_RANKS = 3
+
+
+def _first_int(variables) -> Optional[int]:
+    for variable in variables:
+        value = os.environ.get(variable)
+        if value is not None and value.strip().isdigit():
+            return int(value)
+    return None
+
+
+def get_rank() -> Optional[int]:
+    """
+    Global rank of the process in a distributed job, or None when not launched by a
+    distributed launcher. A single-node launcher only setting `LOCAL_RANK` (and
+    `WORLD_SIZE`) is handled as well.
+    """
+    rank = _first_int(RANK_VARIABLES)
+    if rank is None and _first_int(WORLD_SIZE_VARIABLES) is not None:
+        rank = _first_int(LOCAL_RANK_VARIABLES)
+    return rank
+
+
+def get_world_size() -> Optional[int]:
+    return _first_int(WORLD_SIZE_VARIABLES)
+
+
+def get_job_id(func_name: str) -> Optional[str]:
+    """
+    Identifier of the run shared by all its ranks, or None when the environment has
+    none (a per-node value like the host name would split the ranks apart).
+    """
+    for variable in JOB_ID_VARIABLES:
+        if os.environ.get(variable):
+            job_id = os.environ[variable]
+            if variable == 'SLURM_JOB_ID' and os.environ.get('SLURM_STEP_ID'):
+                job_id += '.' + os.environ['SLURM_STEP_ID']
+            break
+    else:
+        if not os.environ.get('MASTER_ADDR'):
+            return None
+        job_id = '%s-%s' % (os.environ['MASTER_ADDR'], os.environ.get('MASTER_PORT', '0'))
+    for variable in RESTART_COUNT_VARIABLES:
+        if os.environ.get(variable):
+            job_id += '-restart%s' % os.environ[variable]
+            break
+    return '%s-%s' % (func_name, job_id)
+
+
+def report_rank_timing(rendezvous_dir: str, job_id: str, rank: int, duration: float, status: str):
+    """
+    Write the timing of this rank to the shared `rendezvous_dir`, atomically so that
+    rank 0 never reads a partial file.
+    """
+    directory = os.path.join(rendezvous_dir, job_id)
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, 'rank-%d.json' % rank)
+    with open(file_name + '.tmp', 'w') as f:
+        json.dump({'rank': rank, 'host': socket.gethostname(), 'duration': duration, 'status': status}, f)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def _remove_if_stale(file_name: str, start_time: float) -> bool:
+    try:
+        if os.stat(file_name).st_mtime >= start_time:
+            return False
+        os.remove(file_name)
+    except OSError:
+        pass
+    return True
+
+
+def gather_rank_timings(rendezvous_dir: str, job_id: str, world_size: int, timeout: float,
+                        start_time: float = None) -> List[str]:
+    """
+    On rank 0, wait up to `timeout` seconds for the timings of the `world_size` ranks,
+    then return the lines of the per-rank breakdown (min, median, max duration and the
+    slowest ranks with their hosts). The timings are removed once read; files older
+    than `start_time` (a timestamp), left by a previous attempt of the job, are removed
+    without being read.
+    """
+    directory = os.path.join(rendezvous_dir, job_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            file_names = [name for name in os.listdir(directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            file_names = []
+        if start_time is not None:
+            file_names = [name for name in file_names if not _remove_if_stale(os.path.join(directory, name),
+                                                                              start_time)]
+        if len(file_names) >= world_size or time.monotonic() >= deadline:
+            break
+        time.sleep(0.5)
+
+    timings = []
+    for name in file_names:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                timings.append(json.load(f))
+            os.remove(os.path.join(directory, name))
+        except (OSError, ValueError):
+            continue
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass
+    if not timings:
+        return []
+
+    durations = [timing['duration'] for timing in timings]
+    contents = ['Per-rank durations (%d/%d ranks): min %.1fs, median %.1fs, max %.1fs'
+                % (len(timings), world_size, min(durations), statistics.median(durations), max(durations))]
+    slowest = sorted(timings, key=lambda timing: timing['duration'], reverse=True)[:SLOWEST_RANKS]
+    contents.append('Slowest ranks: %s' % ', '.join(
+        'rank %d on %s (%.1fs%s)' % (timing['rank'], timing['host'], timing['duration'],
+                                    '' if timing['status'] == 'complete' else ', ' + timing['status'])
+        for timing in slowest))
+    if len(timings) < world_size:
+        reported = {timing['rank'] for timing in timings}
+        missing = [rank for rank in range(world_size) if rank not in reported]
+        contents.append('Ranks without timing after %ds: %s' % (timeout, ', '.join(map(str, missing[:20]))
+                                                               + (' ...' if len(missing) > 20 else '')))
+    return contents
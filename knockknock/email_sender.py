@@ -1,13 +1,15 @@
-import os
-import datetime
-import traceback
-import functools
-import socket
+from typing import List
 import yagmail
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.attachments import describe_attachments, prepare_attachments
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
 
-def email_sender(recipient_emails: list, sender_email: str = None):
+# Maximum size of an attachment, for a 25 MB email once base64 encoded.
+MAX_ATTACHMENT_SIZE = 18 * 1024 ** 2
+
+
+@picklable_sender
+def email_sender(recipient_emails: list, sender_email: str = None, **kwargs):
     """
     Email sender wrapper: execute func, send an email with the end status
     (sucessfully finished or crashed) at the end. Also send an email before
@@ -19,81 +21,44 @@ def email_sender(recipient_emails: list, sender_email: str = None):
         The email adress to send the messages. If None, use the same
         address as the first recipient email in `recipient_emails`
         if length of `recipient_emails` is more than 0.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
     if sender_email is None and len(recipient_emails) > 0:
         sender_email = recipient_emails[0]
-    yag_sender = yagmail.SMTP(sender_email)
-
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started.',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                for i in range(len(recipient_emails)):
-                    current_recipient = recipient_emails[i]
-                    yag_sender.send(current_recipient, 'Training has started 🎬', contents)
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete.",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
+    yag_sender = PerProcess(yagmail.SMTP, sender_email)
 
-                    for i in range(len(recipient_emails)):
-                        current_recipient = recipient_emails[i]
-                        yag_sender.send(current_recipient, 'Training has sucessfully finished 🎉', contents)
+    subjects = {'start': 'Training has started 🎬',
+                'complete': 'Training has sucessfully finished 🎉',
+                'crash': 'Training has crashed ☠️',
+                'died': 'Training has died unexpectedly 💀',
+                'stall': 'Training seems stalled ⏳',
+                'resume': 'Training has resumed ▶️',
+                'progress': 'Training is still running 🏃',
+                'match': 'A pattern matched in your log 🔎',
+                'checkpoint': 'A checkpoint was saved 💾',
+                'memory': 'Training is running out of memory 📈',
+                'log': 'Training logged warnings ⚠️'}
 
-                return value
+    def send_message(event: str, contents: List[str], attachments: List[str] = None):
+        for i in range(len(recipient_emails)):
+            current_recipient = recipient_emails[i]
+            yag_sender.get().send(current_recipient, subjects.get(event, contents[0]), contents,
+                                  attachments=attachments)
 
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed.",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                for i in range(len(recipient_emails)):
-                    current_recipient = recipient_emails[i]
-                    yag_sender.send(current_recipient, 'Training has crashed ☠️', contents)
-                raise ex
+    def send_attachments(event: str, contents: List[str], paths: List[str]):
+        with prepare_attachments(paths, MAX_ATTACHMENT_SIZE) as (attachments, skipped):
+            send_message(event, contents + describe_attachments(attachments, skipped),
+                         [attachment.path for attachment in attachments])
 
-        return wrapper_sender
+    def check(timeout: float):
+        # Connects and authenticates to the SMTP server, with its own connection: the
+        # one of the notifications has no timeout.
+        smtp = yagmail.SMTP(sender_email, timeout=timeout)
+        try:
+            smtp.login()
+        finally:
+            smtp.close()
 
-    return decorator_sender
+    return sender_decorator(send_message, send_attachments=send_attachments, check=check, **kwargs)
@@ -0,0 +1,140 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import subprocess
+import time
+import traceback
+from typing import List, Optional
+
+from knockknock.core import DATE_FORMAT
+
+DEFAULT_CRASH_INDEX_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'knockknock', 'crashes.sqlite')
+# Number of innermost frames identifying a crash.
+FINGERPRINT_FRAMES = 5
+# Frames of the wrapper itself, identical for every crash.
+_WRAPPER_FILES = (os.path.join(os.path.dirname(os.path.abspath(__file__)), 'core.py'),
+                  os.path.abspath(contextlib.__file__))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crashes (
+    fingerprint TEXT PRIMARY KEY,
+    exception TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_notified REAL NOT NULL,
+    count INTEGER NOT NULL,
+    count_since_notified INTEGER NOT NULL
+);
+"""
+
+
+def normalize_filename(filename: str) -> str:
+    """
+    File name independent of where the code is installed (virtualenv, container,
+    checkout directory), so that the same crash on other machines matches.
+    """
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        if marker in filename:
+            return filename.rsplit(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+def fingerprint(ex: BaseException, func_name: str = None, command: str = None) -> str:
+    """
+    Identifier of a crash: the name of the run, its command line, the type of the
+    exception and the innermost frames of its traceback (file, function and source
+    line, but not the line number, which changes with unrelated edits, nor the
+    message, which often contains values). The traceback of a failed command
+    (`subprocess.CalledProcessError`) is the same for every command, so its command
+    line and exit status are included too.
+    """
+    frames = [frame for frame in traceback.extract_tb(ex.__traceback__)
+              if os.path.abspath(frame.filename) not in _WRAPPER_FILES]
+    parts = [func_name or '', command or '', '%s.%s' % (type(ex).__module__, type(ex).__qualname__)]
+    if isinstance(ex, subprocess.CalledProcessError):
+        cmd = ex.cmd if isinstance(ex.cmd, (str, bytes)) else ' '.join(map(str, ex.cmd))
+        parts += ['%s' % cmd, '%s' % ex.returncode]
+    parts += ['%s:%s:%s' % (normalize_filename(frame.filename), frame.name, (frame.line or '').strip())
+              for frame in frames[-FINGERPRINT_FRAMES:]]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:12]
+
+
+class CrashIndex:
+    """
+    Local SQLite index of the crashes notified recently, by fingerprint, shared by
+    the restarts of a job (torchelastic, SLURM `--requeue`...) and by its ranks.
+    A crash identical to one notified less than `window` seconds ago is not notified;
+    the next one after the window is, with the number of occurrences folded in it.
+    """
+
+    def __init__(self, path: str = None, window: float = 3600.):
+        self.path = path or DEFAULT_CRASH_INDEX_PATH
+        self.window = window
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=30., isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, fingerprint: str, exception: str, now: float = None) -> Optional[List[str]]:
+        """
+        Record an occurrence of the crash `fingerprint`. Return None if it must not be
+        notified, or the lines to add to its notification.
+        """
+        now = time.time() if now is None else now
+        # Several ranks crashing at the same time must not all notify.
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                "SELECT first_seen, last_seen, last_notified, count, count_since_notified "
+                "FROM crashes WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row is None or now - row[1] >= self.window:
+                # New crash, or one not seen for a whole window: a new series starts.
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO crashes VALUES (?, ?, ?, ?, ?, 1, 0)",
+                    (fingerprint, exception, now, now, now))
+                contents = ['Crash fingerprint: %s' % fingerprint]
+            else:
+                first_seen, _, last_notified, count, count_since_notified = row
+                if now - last_notified < self.window:
+                    self.connection.execute(
+                        "UPDATE crashes SET last_seen = ?, count = count + 1, "
+                        "count_since_notified = count_since_notified + 1 WHERE fingerprint = ?",
+                        (now, fingerprint))
+                    contents = None
+                else:
+                    self.connection.execute(
+                        "UPDATE crashes SET last_seen = ?, last_notified = ?, count = count + 1, "
+                        "count_since_notified = 0 WHERE fingerprint = ?", (now, now, fingerprint))
+                    contents = ['Crash fingerprint: %s' % fingerprint,
+                                'Seen %d times since %s (%d not notified)'
+                                % (count + 1, time.strftime(DATE_FORMAT, time.localtime(first_seen)),
+                                   count_since_notified)]
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return contents
+
+
+def check_crash(ex: BaseException, path: str = None, window: float = 3600.,
+                func_name: str = None, command: str = None) -> Optional[List[str]]:
+    """
+    Record the crash `ex` of the run `func_name` started by `command` in the crash
+    index at `path`, see `CrashIndex.record`. An unusable index never prevents a
+    notification.
+    """
+    try:
+        index = CrashIndex(path, window=window)
+        try:
+            return index.record(fingerprint(ex, func_name, command), type(ex).__name__)
+        finally:
+            index.close()
+    except (OSError, sqlite3.Error):
+        return []
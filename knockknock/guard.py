@@ -0,0 +1,160 @@
+import collections
+import datetime
+import os
+import re
+import socket
+import subprocess
+import time
+from typing import List
+
+from knockknock.core import DATE_FORMAT, Message
+from knockknock.snapshot import cgroup_lines, format_size
+from knockknock.stall import read_process_tree
+
+# Seconds between two measures of the memory of the process tree: reading `/proc` for
+# every process is cheap, but not free.
+SAMPLE_INTERVAL = 2.
+# Seconds of samples used to compute the memory trend.
+TREND_WINDOW = 300.
+# Seconds given to the command to exit after SIGTERM, before SIGKILL.
+GRACE_PERIOD = 10.
+# The warning is sent again only after the memory went back below this fraction of
+# the warning threshold.
+REARM_FRACTION = 0.9
+
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+class GuardError(RuntimeError):
+    """
+    The command was terminated by knockknock for going over a limit.
+    """
+
+
+def parse_size(text: str) -> int:
+    """
+    Number of bytes in `text`, e.g. "512M", "16G", "1.5GiB" or "1000000".
+    """
+    match = re.match(r'^\s*([0-9.]+)\s*([kmgt]?)(i?b)?\s*$', text.lower())
+    if match is None:
+        raise ValueError('Invalid size: %s' % text)
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def process_tree_rss(pid: int) -> int:
+    """
+    Resident memory (bytes) of the process `pid` and its live descendants, read from
+    `/proc`. Memory shared between them (e.g. by forked dataloader workers) is counted
+    once per process, so this overestimates rather than misses a blowup.
+    """
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return sum(int(fields[21]) for fields in read_process_tree(pid)) * page_size
+
+
+class MemoryTrend:
+    """
+    Growth rate of the memory over the last `TREND_WINDOW` seconds.
+    """
+
+    def __init__(self):
+        self.samples = collections.deque()
+
+    def add(self, now: float, rss: int):
+        self.samples.append((now, rss))
+        while now - self.samples[0][0] > TREND_WINDOW:
+            self.samples.popleft()
+
+    def rate(self) -> float:
+        """
+        Bytes per second, 0 without enough samples.
+        """
+        (first_time, first_rss), (last_time, last_rss) = self.samples[0], self.samples[-1]
+        if last_time - first_time < SAMPLE_INTERVAL:
+            return 0.
+        return (last_rss - first_rss) / (last_time - first_time)
+
+
+def run_guarded(command: List[str], send_message, func_name: str, max_rss: int = None,
+                warn_rss: int = None, timeout: float = None) -> subprocess.CompletedProcess:
+    """
+    Run `command` like `subprocess.run(command, check=True)`, watching the resident
+    memory of its process tree every `SAMPLE_INTERVAL` seconds. A "memory" notification
+    with the trend and the estimated time to `max_rss` is sent when it goes over
+    `warn_rss` (90% of `max_rss` by default). Over `max_rss` bytes, or after `timeout`
+    seconds, the command is terminated (SIGTERM, then SIGKILL after `GRACE_PERIOD`
+    seconds) and `GuardError` is raised, so that the crash notification says why
+    instead of a silent OOM kill.
+    """
+    if warn_rss is None and max_rss is not None:
+        warn_rss = int(0.9 * max_rss)
+    host_name = socket.gethostname()
+    start = time.monotonic()
+    trend = MemoryTrend()
+    warned = False
+    process = subprocess.Popen(command)
+    try:
+        while True:
+            try:
+                wait = SAMPLE_INTERVAL
+                if timeout is not None:
+                    wait = max(min(wait, start + timeout - time.monotonic()), 0)
+                returncode = process.wait(wait)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            now = time.monotonic()
+            if timeout is not None and now - start >= timeout:
+                terminate(process)
+                raise GuardError('Terminated by knockknock after the --timeout of %s'
+                                 % datetime.timedelta(seconds=int(timeout)))
+            if max_rss is None and warn_rss is None:
+                continue
+            try:
+                rss = process_tree_rss(process.pid)
+            except OSError:
+                continue
+            trend.add(now, rss)
+            if max_rss is not None and rss > max_rss:
+                terminate(process)
+                raise GuardError('Terminated by knockknock: resident memory %s over the --max-rss of %s'
+                                 % (format_size(rss), format_size(max_rss)))
+            if warn_rss is not None and not warned and rss > warn_rss:
+                warned = True
+                send_message('memory', memory_warning(host_name, func_name, rss, warn_rss, max_rss, trend.rate()))
+            elif warned and rss < REARM_FRACTION * warn_rss:
+                warned = False
+    except BaseException:
+        # E.g. KeyboardInterrupt: don't leave the command running.
+        if process.poll() is None:
+            terminate(process)
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return subprocess.CompletedProcess(command, returncode)
+
+
+def memory_warning(host_name: str, func_name: str, rss: int, warn_rss: int, max_rss: int,
+                   rate: float) -> List[str]:
+    contents = Message(['Your training is running out of memory 📈',
+                        'Machine name: %s' % host_name,
+                        'Main call: %s' % func_name,
+                        'Date: %s' % datetime.datetime.now().strftime(DATE_FORMAT),
+                        'Resident memory: %s (warning at %s%s)'
+                        % (format_size(rss), format_size(warn_rss),
+                           ', limit %s' % format_size(max_rss) if max_rss else ''),
+                        'Trend: %s%s/min' % ('+' if rate >= 0 else '-', format_size(abs(rate) * 60))],
+                       func_name=func_name, host_name=host_name)
+    if max_rss is not None and rate > 0:
+        contents.append('Estimated time to the limit: %s'
+                        % datetime.timedelta(seconds=int((max_rss - rss) / rate)))
+    contents.extend(cgroup_lines())
+    return contents
+
+
+def terminate(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,199 @@
+import datetime
+import os
+import sqlite3
+import statistics
+import time
+from typing import List
+
+from knockknock.core import DATE_FORMAT
+
+DEFAULT_HISTORY_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'knockknock', 'history.sqlite')
+# Number of previous successful runs used to estimate durations.
+HISTORY_WINDOW = 50
+# Minimum number of previous successful runs before flagging a regression.
+MIN_HISTORY_RUNS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    func_name TEXT NOT NULL,
+    command TEXT NOT NULL,
+    host TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL,
+    user_time REAL,
+    system_time REAL,
+    max_rss_kb INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_key ON runs (func_name, command, host, rank, status, start_time);
+CREATE INDEX IF NOT EXISTS runs_by_start_time ON runs (start_time);
+CREATE INDEX IF NOT EXISTS runs_by_func_name ON runs (func_name, start_time);
+CREATE INDEX IF NOT EXISTS runs_by_host ON runs (host, start_time);
+CREATE INDEX IF NOT EXISTS runs_by_status ON runs (status, start_time);
+"""
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    `q`-th percentile (0-100) of `values`, linearly interpolated.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def resource_usage():
+    """
+    (user time, system time, max RSS in kB) of the process and its waited-for children,
+    None if unknown (on Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None, None, None
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + children.ru_utime,
+            own.ru_stime + children.ru_stime,
+            max(own.ru_maxrss, children.ru_maxrss))
+
+
+class RunHistory:
+    """
+    Local SQLite store of past runs, keyed by function name, command line, host and
+    rank, with their duration, exit status and resource usage. Used to estimate the
+    duration of a run when it starts and to flag duration regressions when it ends.
+    """
+
+    def __init__(self, path: str = None, regression_percentile: float = 90.):
+        self.path = path or DEFAULT_HISTORY_PATH
+        self.regression_percentile = regression_percentile
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Several ranks may write to the same store at the same time.
+        self.connection = sqlite3.connect(self.path, timeout=30., check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.run_id = None
+
+    def close(self):
+        self.connection.close()
+
+    def start(self, func_name: str, command: str, host: str, rank: int, start_time: float) -> int:
+        """
+        Record a new run, as "running" until `finish` is called: runs that died without
+        reporting stay visible as such.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (func_name, command, host, rank, start_time, status) "
+                "VALUES (?, ?, ?, ?, ?, 'running')",
+                (func_name, command, host, rank, start_time))
+        self.usage_at_start = resource_usage()
+        self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def finish(self, status: str, duration: float):
+        """
+        Record the end of the run started with `start`. Only the first call has an effect.
+        """
+        if self.run_id is None:
+            return
+        user_time, system_time, max_rss_kb = resource_usage()
+        if user_time is not None:
+            user_time -= self.usage_at_start[0]
+            system_time -= self.usage_at_start[1]
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, duration = ?, user_time = ?, system_time = ?, max_rss_kb = ? "
+                "WHERE id = ?",
+                (status, duration, user_time, system_time, max_rss_kb, self.run_id))
+        self.run_id = None
+
+    def durations(self, func_name: str, command: str, host: str, rank: int,
+                  limit: int = HISTORY_WINDOW) -> List[float]:
+        """
+        Durations of the last `limit` successful runs with the same key.
+        """
+        rows = self.connection.execute(
+            "SELECT duration FROM runs "
+            "WHERE func_name = ? AND command = ? AND host = ? AND rank = ? AND status = 'complete' "
+            "ORDER BY start_time DESC LIMIT ?",
+            (func_name, command, host, rank, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def expected_duration(self, durations: List[float], start_time: datetime.datetime) -> List[str]:
+        """
+        Lines for the start message: expected duration and ETA from the past runs.
+        """
+        if not durations:
+            return []
+        expected = datetime.timedelta(seconds=int(statistics.median(durations)))
+        return ['Expected duration: %s (median of the last %d runs)' % (expected, len(durations)),
+                'Expected end date: %s' % (start_time + expected).strftime(DATE_FORMAT)]
+
+    def regression(self, durations: List[float], duration: float) -> List[str]:
+        """
+        Lines for the completion message, flagging a duration above the configured
+        percentile of the past runs.
+        """
+        if len(durations) < MIN_HISTORY_RUNS:
+            return []
+        threshold = percentile(durations, self.regression_percentile)
+        if duration <= threshold:
+            return []
+        median = statistics.median(durations)
+        return ['⚠️ Duration regression: %s is above the %gth percentile (%s) of the last %d runs (%+.0f%% vs median)'
+                % (datetime.timedelta(seconds=int(duration)), self.regression_percentile,
+                   datetime.timedelta(seconds=int(threshold)), len(durations),
+                   100. * (duration - median) / median if median else float('inf'))]
+
+    def query(self, func_name: str = None, host: str = None, status: str = None,
+              limit: int = 20) -> List[sqlite3.Row]:
+        """
+        Most recent runs, optionally filtered.
+        """
+        conditions, parameters = [], []
+        for column, value in (('func_name', func_name), ('host', host), ('status', status)):
+            if value is not None:
+                conditions.append('%s = ?' % column)
+                parameters.append(value)
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        self.connection.row_factory = sqlite3.Row
+        try:
+            return self.connection.execute(
+                "SELECT * FROM runs %s ORDER BY start_time DESC LIMIT ?" % where,
+                parameters + [limit]).fetchall()
+        finally:
+            self.connection.row_factory = None
+
+
+def print_history(path: str = None, func_name: str = None, host: str = None,
+                  status: str = None, limit: int = 20):
+    """
+    Print the most recent runs of the history store, for `knockknock history`.
+    """
+    history = RunHistory(path)
+    rows = history.query(func_name=func_name, host=host, status=status, limit=limit)
+    history.close()
+    columns = ['start', 'duration', 'status', 'host', 'rank', 'main call', 'max RSS (MB)', 'command']
+    table = [columns]
+    for row in rows:
+        table.append([
+            time.strftime(DATE_FORMAT, time.localtime(row['start_time'])),
+            str(datetime.timedelta(seconds=int(row['duration']))) if row['duration'] is not None else '-',
+            row['status'],
+            row['host'],
+            str(row['rank']),
+            row['func_name'],
+            '%.0f' % (row['max_rss_kb'] / 1024.) if row['max_rss_kb'] is not None else '-',
+            row['command']])
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns) - 1)]
+    for line in table:
+        print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)) + '  ' + line[-1])
@@ -0,0 +1,185 @@
+import datetime
+import logging
+import queue
+import socket
+import sys
+import threading
+import time
+
+from knockknock.core import DATE_FORMAT
+
+# Longest message reported in a notification.
+MAX_MESSAGE_LENGTH = 500
+# Number of distinct messages listed in a notification, the others are only counted.
+MAX_GROUPS = 20
+
+# Put in the queue to stop the thread, after the records before it.
+_STOP = object()
+
+
+class LogGroup:
+    """
+    Identical log records (same logger, level and message template): their number,
+    and the last message and date.
+    """
+
+    def __init__(self, record: logging.LogRecord, message: str):
+        self.level = record.levelname
+        self.logger = record.name
+        self.count = 0
+        self.exception = None
+        self.add(record, message)
+
+    def add(self, record: logging.LogRecord, message: str):
+        self.count += 1
+        self.message = message
+        self.last_date = record.created
+
+    def format(self) -> str:
+        message = self.message
+        if len(message) > MAX_MESSAGE_LENGTH:
+            message = message[:MAX_MESSAGE_LENGTH] + '...'
+        line = '[%s] %s: %s' % (self.level, self.logger, message)
+        if self.count > 1:
+            line += ' (x%d, last at %s)' % (self.count,
+                                            datetime.datetime.fromtimestamp(self.last_date).strftime('%H:%M:%S'))
+        return line
+
+
+class KnockKnockHandler(logging.Handler):
+    """
+    `logging` handler sending the warnings and errors of any logger as notifications:
+
+        logging.getLogger().addHandler(KnockKnockHandler(SlackNotifier(...)))
+
+    Records are put in a bounded queue without formatting or I/O, so that the thread
+    emitting them is never blocked (records arriving when the queue is full are
+    dropped and counted). A thread groups identical records with their count and sends
+    them in a single "log" notification once `flush_interval` seconds have passed since
+    the first one, or `flush_size` records are pending. Pending records are sent when
+    the handler is flushed or closed, e.g. by `logging.shutdown` at exit.
+
+    `sender`: a `Notifier`, a `*_sender` decorator or a `send_message` function.
+    `level`: int (default=logging.WARNING)
+        Minimum level of the records sent.
+    `flush_interval`: float (default=60.)
+        Maximum number of seconds a record waits before being sent.
+    `flush_size`: int (default=100)
+        Number of pending records sending them right away.
+    `capacity`: int (default=10000)
+        Maximum number of records waiting in the queue.
+    """
+
+    def __init__(self, sender, level: int = logging.WARNING, flush_interval: float = 60.,
+                 flush_size: int = 100, capacity: int = 10000):
+        super().__init__(level)
+        self.send_message = getattr(sender, 'send_message', sender)
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.host_name = socket.gethostname()
+        self.records = queue.Queue(capacity)
+        self.dropped = 0
+        # (logger, level, message template) -> LogGroup, guarded by `sending`.
+        self.groups = {}
+        self.pending = 0
+        self.first_pending = None
+        self.sending = threading.RLock()
+        # Set in the threads sending a notification: records logged by the backend
+        # (e.g. by urllib3) are not sent, which would never end.
+        self.in_send = threading.local()
+        self.thread = threading.Thread(target=self.forward, name='knockknock-logging', daemon=True)
+        self.thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        if getattr(self.in_send, 'active', False):
+            return
+        try:
+            # Rendered now: the arguments may change by the time the record is sent.
+            self.records.put_nowait((record, record.getMessage()))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def forward(self):
+        self.in_send.active = True
+        while True:
+            with self.sending:
+                first_pending = self.first_pending
+            timeout = None
+            if first_pending is not None:
+                timeout = max(first_pending + self.flush_interval - time.monotonic(), 0)
+            try:
+                item = self.records.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                return
+            with self.sending:
+                if item is not None:
+                    self.add(*item)
+                if self.pending and (self.pending >= self.flush_size
+                                     or time.monotonic() - self.first_pending >= self.flush_interval):
+                    self.send_pending()
+
+    def add(self, record: logging.LogRecord, message: str):
+        key = (record.name, record.levelno, str(record.msg))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = LogGroup(record, message)
+            if record.exc_info:
+                group.exception = logging.Formatter().formatException(record.exc_info)
+        else:
+            group.add(record, message)
+        if not self.pending:
+            self.first_pending = time.monotonic()
+        self.pending += 1
+
+    def send_pending(self):
+        with self.sending:
+            groups, count, dropped = list(self.groups.values()), self.pending, self.dropped
+            self.groups, self.pending, self.first_pending, self.dropped = {}, 0, None, 0
+            if not groups and not dropped:
+                return
+            contents = ['Your training logged %d warning%s or error%s ⚠️'
+                        % (count, '' if count == 1 else 's', '' if count == 1 else 's'),
+                        'Machine name: %s' % self.host_name,
+                        'Date: %s' % datetime.datetime.now().strftime(DATE_FORMAT)]
+            groups.sort(key=lambda group: group.count, reverse=True)
+            contents += [group.format() for group in groups[:MAX_GROUPS]]
+            if len(groups) > MAX_GROUPS:
+                contents.append('And %d other messages' % (len(groups) - MAX_GROUPS))
+            if dropped:
+                contents.append('Records dropped (queue full): %d' % dropped)
+            for group in groups[:MAX_GROUPS]:
+                if group.exception is not None:
+                    contents += ['\n', 'Traceback of "%s":' % group.format(), group.exception]
+            active = getattr(self.in_send, 'active', False)
+            self.in_send.active = True
+            try:
+                self.send_message('log', contents)
+            except Exception as ex:
+                print('knockknock: could not send the log records: %r' % ex, file=sys.stderr)
+            finally:
+                self.in_send.active = active
+
+    def flush(self):
+        """
+        Send the pending records now.
+        """
+        with self.sending:
+            while True:
+                try:
+                    item = self.records.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    self.add(*item)
+            self.send_pending()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.records.put(_STOP)
+            self.thread.join()
+        self.flush()
+        super().close()
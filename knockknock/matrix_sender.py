@@ -1,13 +1,19 @@
-import os
-import datetime
-import traceback
-import functools
-import socket
-from matrix_client.api import MatrixHttpApi
+from typing import List
+from urllib.parse import quote
+from matrix_client.api import MATRIX_V2_API_PATH, MatrixHttpApi
+import requests
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.attachments import describe_attachments, prepare_attachments
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
 
-def matrix_sender(homeserver: str, token: str, room: str):
+# Maximum length of a Matrix message.
+MAX_MESSAGE_LENGTH = 65536
+# Default maximum size of an upload on a Synapse homeserver.
+MAX_ATTACHMENT_SIZE = 50 * 1024 ** 2
+
+
+@picklable_sender
+def matrix_sender(homeserver: str, token: str, room: str, **kwargs):
     """
     Matrix sender wrapper: execute func, send a Matrix message with the end status
     (sucessfully finished or crashed) at the end. Also send a Matrix message before
@@ -26,80 +32,34 @@ def matrix_sender(homeserver: str, token: str, room: str):
         The alias of the room to which messages will be send by the BOT.
         After creating a room, an alias can be set. In Riot, this can be done
         by opening the room settings under 'Room Addresses'.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
 
-    matrix = MatrixHttpApi(homeserver, token=token)
-    room_id = matrix.get_room_id(room)
-
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                text = '\n'.join(contents)
-
-                matrix.send_message(room_id, text)
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
-
-                    text = '\n'.join(contents)
-                    matrix.send_message(room_id, text)
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                text = '\n'.join(contents)
-                matrix.send_message(room_id, text)
-                raise ex
-
-        return wrapper_sender
-
-    return decorator_sender
+    matrix = PerProcess(MatrixHttpApi, homeserver, token=token)
+    room_id = PerProcess(lambda: matrix.get().get_room_id(room))
+
+    def send_message(event: str, contents: List[str]):
+        text = '\n'.join(contents)
+        matrix.get().send_message(room_id.get(), text)
+
+    def send_attachments(event: str, contents: List[str], paths: List[str]):
+        with prepare_attachments(paths, MAX_ATTACHMENT_SIZE) as (attachments, skipped):
+            send_message(event, contents + describe_attachments(attachments, skipped))
+            for attachment in attachments:
+                with attachment.open() as f:
+                    content_uri = matrix.get().media_upload(f, attachment.content_type,
+                                                            filename=attachment.name)['content_uri']
+                matrix.get().send_content(room_id.get(), content_uri, attachment.name, 'm.file',
+                                          extra_information={'size': attachment.size,
+                                                             'mimetype': attachment.content_type})
+
+    def check(timeout: float):
+        # Resolving the room alias checks the homeserver and the room. `MatrixHttpApi`
+        # has no timeout, the request is made directly.
+        requests.get('%s%s/directory/room/%s' % (homeserver.rstrip('/'), MATRIX_V2_API_PATH, quote(room, safe='')),
+                     headers={'Authorization': 'Bearer %s' % token}, timeout=timeout).raise_for_status()
+
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH,
+                            send_attachments=send_attachments, check=check, **kwargs)
@@ -0,0 +1,173 @@
+import datetime
+import math
+import threading
+import time
+from array import array
+from typing import List
+
+from knockknock import stall
+from knockknock.core import DATE_FORMAT
+
+_monotonic = time.monotonic
+
+# Number of values kept per scalar, and of (step, time) samples used for throughput.
+# A power of two, so that ring indices are computed with a mask.
+RING_SIZE = 1024
+# Number of most recent values averaged in the smoothed value of a scalar.
+SMOOTHING_WINDOW = 100
+
+
+class MetricsStore:
+    """
+    Scalars logged with `knockknock.log`, stored in fixed-size ring buffers of doubles
+    (`array('d')`) so that memory stays constant whatever the number of calls, and a
+    call costs about a microsecond.
+    """
+
+    def __init__(self, size: int = RING_SIZE):
+        if size & (size - 1):
+            raise ValueError('The size of the ring buffers must be a power of two.')
+        self.size = size
+        self.mask = size - 1
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.steps = array('d', bytes(8 * self.size))
+        self.times = array('d', bytes(8 * self.size))
+        # name -> [values ring buffer, number of values logged]
+        self.series = {}
+
+    def log(self, step: int = None, **scalars):
+        """
+        Log scalars (loss, accuracy...) at `step` (the number of calls if None). Progress
+        and completion messages include their latest and smoothed values, the throughput
+        in steps/s and an ETA when `total_steps` is given to the sender. Also counts as a
+        `knockknock.heartbeat()`.
+        """
+        # Hot path: called at every step, keep it to a few array stores.
+        now = _monotonic()
+        # Logging is a sign of progress for the stall watchdog.
+        stall._last_heartbeat = now
+        mask = self.mask
+        count = self.count
+        index = count & mask
+        self.count = count = count + 1
+        self.steps[index] = count if step is None else step
+        self.times[index] = now
+        series = self.series
+        for name, value in scalars.items():
+            try:
+                entry = series[name]
+            except KeyError:
+                entry = series[name] = [array('d', bytes(8 * self.size)), 0]
+            logged = entry[1]
+            entry[0][logged & mask] = value
+            entry[1] = logged + 1
+
+    def last_step(self):
+        if not self.count:
+            return None
+        return self.steps[(self.count - 1) % self.size]
+
+    def throughput(self):
+        """
+        Steps per second over the samples kept in the ring buffer.
+        """
+        if self.count < 2:
+            return None
+        last = (self.count - 1) % self.size
+        first = 0 if self.count <= self.size else self.count % self.size
+        elapsed = self.times[last] - self.times[first]
+        if elapsed <= 0:
+            return None
+        return (self.steps[last] - self.steps[first]) / elapsed
+
+    def summary(self, name: str):
+        """
+        Latest and smoothed (mean of the last `SMOOTHING_WINDOW`) values of a scalar.
+        """
+        values, count = self.series[name]
+        kept = min(count, SMOOTHING_WINDOW, self.size)
+        latest = values[(count - 1) % self.size]
+        window = [values[(count - 1 - i) % self.size] for i in range(kept)]
+        window = [value for value in window if not math.isnan(value)]
+        smoothed = sum(window) / len(window) if window else float('nan')
+        return latest, smoothed
+
+    def format(self, total_steps: int = None) -> List[str]:
+        """
+        Lines describing the logged metrics, for the notifications. Empty if nothing
+        was logged.
+        """
+        if not self.count:
+            return []
+        step = self.last_step()
+        step_text = '%d' % step if step == int(step) else '%g' % step
+        if total_steps is not None:
+            step_text += '/%d' % total_steps
+        contents = ['Last logged step: %s' % step_text]
+        for name in sorted(self.series):
+            latest, smoothed = self.summary(name)
+            contents.append('    %s: %.6g (smoothed: %.6g)' % (name, latest, smoothed))
+        throughput = self.throughput()
+        if throughput:
+            contents.append('Throughput: %.3g steps/s' % throughput)
+            if total_steps is not None and step < total_steps:
+                remaining = datetime.timedelta(seconds=int((total_steps - step) / throughput))
+                eta = datetime.datetime.now() + remaining
+                contents.append('ETA: %s (in %s)' % (eta.strftime(DATE_FORMAT), remaining))
+        return contents
+
+
+_store = MetricsStore()
+# Bound method rather than a wrapper function, to save a call on the hot path.
+log = _store.log
+
+
+class ProgressReporter:
+    """
+    Thread sending a "progress" notification with the elapsed time, the logged
+    metrics and the items yielded by `run` every `interval` seconds. The elapsed time
+    is measured from `start_counter`, a `time.perf_counter()` value (now by default),
+    not from the date, which jumps with NTP or DST changes.
+    """
+
+    def __init__(self, send_message, host_name: str, func_name: str,
+                 start_time: datetime.datetime, interval: float, total_steps: int = None,
+                 run=None, start_counter: float = None):
+        self.send_message = send_message
+        self.host_name = host_name
+        self.func_name = func_name
+        self.start_time = start_time
+        self.start_counter = time.perf_counter() if start_counter is None else start_counter
+        self.interval = interval
+        self.total_steps = total_steps
+        self.run = run
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.report, name='knockknock-progress', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def send(self):
+        elapsed = time.perf_counter() - self.start_counter
+        contents = ['Your training is still running 🏃',
+                    'Machine name: %s' % self.host_name,
+                    'Main call: %s' % self.func_name,
+                    'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                    'Elapsed time: %s' % str(datetime.timedelta(seconds=elapsed))]
+        if self.run is not None:
+            contents.extend(self.run.format(elapsed))
+        contents.extend(_store.format(self.total_steps))
+        self.send_message('progress', contents)
+
+    def report(self):
+        while not self.stopped.wait(self.interval):
+            self.send()
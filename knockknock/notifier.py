@@ -0,0 +1,221 @@
+import datetime
+import functools
+import socket
+import sys
+from typing import List
+
+from knockknock.core import DATE_FORMAT, send_with_attachments, sender_decorator, track, track_iteration
+from knockknock.preflight import check_backends
+from knockknock.chime_sender import chime_sender
+from knockknock.desktop_sender import desktop_sender
+from knockknock.dingtalk_sender import dingtalk_sender
+from knockknock.discord_sender import discord_sender
+from knockknock.email_sender import email_sender
+from knockknock.matrix_sender import matrix_sender
+from knockknock.rocketchat_sender import rocketchat_sender
+from knockknock.slack_sender import slack_sender
+from knockknock.sms_sender import sms_sender
+from knockknock.statsd_sender import statsd_sender
+from knockknock.teams_sender import teams_sender
+from knockknock.telegram_sender import telegram_sender
+from knockknock.wechat_sender import wechat_sender
+
+
+class Notifier:
+    """
+    Long-lived handle on a notification backend. The backend (HTTP session, API client,
+    SMTP or D-Bus connection...) is set up once and reused by every notification, to
+    track several blocks of a script or notebook, or to send events explicitly:
+
+        notifier = SlackNotifier(webhook_url="...", channel="...")
+
+        with notifier.track("eval"):
+            evaluate()
+
+        @notifier
+        def train():
+            ...
+
+        notifier.send("checkpoint", "Checkpoint saved 💾", step=1000)
+
+    The arguments are the ones of the matching `*_sender` function, including the
+    options shared by all senders (see `knockknock.core.track`), used as defaults by
+    `track` and the decorator.
+    """
+
+    # The `*_sender` function of the backend, set by the subclasses.
+    sender_func = None
+
+    def __init__(self, *args, **kwargs):
+        # Picklable, see `knockknock.core.picklable_sender`.
+        self.sender = self.sender_func(*args, **kwargs)
+        self.host_name = socket.gethostname()
+
+    @property
+    def send_message(self):
+        return self.sender.send_message
+
+    @property
+    def options(self):
+        return self.sender.options
+
+    def send(self, event: str, message: str = None, **fields):
+        """
+        Send a notification for `event` (e.g. "checkpoint"), with `message` as first
+        line (`event` by default) and a line per keyword argument.
+        """
+        contents = [message or event,
+                    'Machine name: %s' % self.host_name,
+                    'Date: %s' % datetime.datetime.now().strftime(DATE_FORMAT)]
+        contents += ['%s: %s' % (key, value) for key, value in fields.items()]
+        self.send_message(event, contents)
+
+    def track(self, name: str, **options):
+        """
+        Context manager sending the start notification when entering the block and the
+        completion (or crash) notification when leaving it. `options` override the ones
+        given to the notifier.
+        """
+        return track(self.send_message, name, **dict(self.options, **options))
+
+    def iterate(self, iterable, name: str = 'iteration', **options):
+        """
+        Generator yielding the items of `iterable`, with the start notification when
+        the iteration starts and the completion (or crash) notification when it ends,
+        see `knockknock.core.track_iteration`. `options` override the ones given to the
+        notifier, e.g. `progress_items=10000`.
+        """
+        return track_iteration(self.send_message, name, iterable, **dict(self.options, **options))
+
+    def map(self, func, iterable, **kwargs) -> list:
+        """
+        `map` through a process pool, with progress notifications, see
+        `knockknock.parallel.parallel_map`.
+        """
+        from knockknock.parallel import parallel_map
+        return parallel_map(func, iterable, self.send_message, **dict(self.options, **kwargs))
+
+    def __call__(self, func=None, **options):
+        """
+        Decorator, like the `*_sender` functions: `@notifier` or `@notifier(**options)`.
+        """
+        decorator = self.sender.with_options(**options)
+        return decorator if func is None else decorator(func)
+
+
+class MultiNotifier(Notifier):
+    """
+    Send every notification through several notifiers. A backend failing to send a
+    notification does not prevent the others from receiving it.
+
+    `notifiers`: Notifier
+        The notifiers to send the notifications with.
+    `preflight`: bool (default=False)
+        Check all the backends concurrently now, see `knockknock.preflight.check_backends`.
+    `options`:
+        Options shared by all senders (see `knockknock.core.track`), used as defaults
+        by `track` and the decorator.
+    """
+
+    def __init__(self, *notifiers: Notifier, preflight: bool = False, **options):
+        self.notifiers = notifiers
+        if preflight:
+            # All the backends at once.
+            check_backends(notifiers)
+        # Messages must fit in the most limited backend.
+        max_lengths = [notifier.options['max_length'] for notifier in notifiers
+                       if notifier.options.get('max_length') is not None]
+        self.shared_options = dict({'max_length': min(max_lengths)} if max_lengths else {}, **options)
+        self.host_name = socket.gethostname()
+
+    @property
+    def options(self):
+        return dict(self.shared_options, send_attachments=self.send_attachments)
+
+    def __call__(self, func=None, **options):
+        decorator = sender_decorator(self.send_message, **dict(self.options, **options))
+        # Rebuilt from the (picklable) notifier when pickled.
+        decorator.factory = (functools.partial(self, **options), ())
+        return decorator if func is None else decorator(func)
+
+    def send_message(self, event: str, contents: List[str]):
+        for notifier in self.notifiers:
+            try:
+                notifier.send_message(event, contents)
+            except Exception as ex:
+                print('knockknock: %s could not send the notification: %r' % (type(notifier).__name__, ex),
+                      file=sys.stderr)
+
+    def send_attachments(self, event: str, contents: List[str], paths: List[str]):
+        for notifier in self.notifiers:
+            try:
+                send_with_attachments(notifier.send_message, notifier.options.get('send_attachments'),
+                                      event, contents, paths)
+            except Exception as ex:
+                print('knockknock: %s could not send the notification: %r' % (type(notifier).__name__, ex),
+                      file=sys.stderr)
+
+
+class ChimeNotifier(Notifier):
+    """`Notifier` for Amazon Chime, with the arguments of `knockknock.chime_sender`."""
+    sender_func = staticmethod(chime_sender)
+
+
+class DesktopNotifier(Notifier):
+    """`Notifier` for desktop notifications, with the arguments of `knockknock.desktop_sender`."""
+    sender_func = staticmethod(desktop_sender)
+
+
+class DingTalkNotifier(Notifier):
+    """`Notifier` for DingTalk, with the arguments of `knockknock.dingtalk_sender`."""
+    sender_func = staticmethod(dingtalk_sender)
+
+
+class DiscordNotifier(Notifier):
+    """`Notifier` for Discord, with the arguments of `knockknock.discord_sender`."""
+    sender_func = staticmethod(discord_sender)
+
+
+class EmailNotifier(Notifier):
+    """`Notifier` for emails, with the arguments of `knockknock.email_sender`."""
+    sender_func = staticmethod(email_sender)
+
+
+class MatrixNotifier(Notifier):
+    """`Notifier` for Matrix, with the arguments of `knockknock.matrix_sender`."""
+    sender_func = staticmethod(matrix_sender)
+
+
+class RocketChatNotifier(Notifier):
+    """`Notifier` for RocketChat, with the arguments of `knockknock.rocketchat_sender`."""
+    sender_func = staticmethod(rocketchat_sender)
+
+
+class SlackNotifier(Notifier):
+    """`Notifier` for Slack, with the arguments of `knockknock.slack_sender`."""
+    sender_func = staticmethod(slack_sender)
+
+
+class SmsNotifier(Notifier):
+    """`Notifier` for text messages, with the arguments of `knockknock.sms_sender`."""
+    sender_func = staticmethod(sms_sender)
+
+
+class StatsdNotifier(Notifier):
+    """`Notifier` for StatsD and Prometheus textfiles, with the arguments of `knockknock.statsd_sender`."""
+    sender_func = staticmethod(statsd_sender)
+
+
+class TeamsNotifier(Notifier):
+    """`Notifier` for Microsoft Teams, with the arguments of `knockknock.teams_sender`."""
+    sender_func = staticmethod(teams_sender)
+
+
+class TelegramNotifier(Notifier):
+    """`Notifier` for Telegram, with the arguments of `knockknock.telegram_sender`."""
+    sender_func = staticmethod(telegram_sender)
+
+
+class WeChatNotifier(Notifier):
+    """`Notifier` for WeChat Work, with the arguments of `knockknock.wechat_sender`."""
+    sender_func = staticmethod(wechat_sender)
@@ -0,0 +1,50 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, List
+
+from knockknock import metrics
+from knockknock.core import track
+
+
+def _map_chunk(func, chunk: list) -> list:
+    return [func(item) for item in chunk]
+
+
+def parallel_map(func, iterable: Iterable, send_message, max_workers: int = None, chunksize: int = 1,
+                 progress_interval: float = 60., name: str = None, mp_context=None, **options) -> List:
+    """
+    `map` through a `ProcessPoolExecutor`, notified like a decorated function: a start
+    message, a progress message every `progress_interval` seconds with the number of
+    items done, the throughput and the ETA, and a completion (or crash) message. The
+    first failure cancels the remaining items and is raised.
+
+    `func` must be picklable (defined at the top level of a module), and so must be the
+    items. They are sent to the workers by chunks of `chunksize` items, which saves a
+    lot of overhead for small items.
+
+    `send_message`: Callable[[str, List[str]], Any]
+        Backend specific function posting a notification, e.g. `Notifier.send_message`
+        or the `send_message` attribute of a `*_sender` decorator.
+    `options`:
+        Options shared by all senders, see `knockknock.core.track`.
+    """
+    items = list(iterable)
+    options = dict(options, total_steps=len(items), progress_interval=progress_interval)
+    results = [None] * len(items)
+    with track(send_message, name or getattr(func, '__name__', 'parallel_map'), **options) as run:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futures = {executor.submit(_map_chunk, func, items[start:start + chunksize]): start
+                       for start in range(0, len(items), chunksize)}
+            done = 0
+            try:
+                for future in as_completed(futures):
+                    chunk_results = future.result()
+                    start = futures[future]
+                    results[start:start + len(chunk_results)] = chunk_results
+                    done += len(chunk_results)
+                    metrics.log(step=done)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        run.value = '%d results' % len(results)
+    return results
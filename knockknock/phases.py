@@ -0,0 +1,129 @@
+import datetime
+import functools
+import threading
+import time
+from typing import List
+
+_perf_counter = time.perf_counter
+_process_time = time.process_time
+
+
+class _Stack(threading.local):
+    """
+    Paths of the phases entered by the current thread, innermost last.
+    """
+
+    def __init__(self, stacks: dict):
+        self.paths = []
+        # Once per thread: readable from the other threads, e.g. by the status server.
+        stacks[threading.get_ident()] = self.paths
+
+
+class PhaseStore:
+    """
+    Time spent in each phase of the run, timed with `phase`: number of calls, wall time
+    (`time.perf_counter`, which is monotonic, unlike the date) and CPU time of the
+    process (`time.process_time`). Nested phases are stored by path ("epoch/data").
+    """
+
+    def __init__(self):
+        # Thread identifier -> paths of the phases entered by the thread.
+        self.stacks = {}
+        self.stack = _Stack(self.stacks)
+        self.reset()
+
+    def current(self, thread_id: int):
+        """
+        Path of the innermost phase entered by the thread `thread_id`, None if none.
+        """
+        try:
+            return self.stacks[thread_id][-1]
+        except (KeyError, IndexError):
+            # Possibly left by the thread in the meantime.
+            return None
+
+    def reset(self):
+        # path -> [number of calls, wall seconds, CPU seconds]
+        self.totals = {}
+
+    def format(self, total: float) -> List[str]:
+        """
+        Lines with the time, percentage of the `total` seconds of the run, number of
+        calls and CPU time of each phase, nested phases under their parent. Empty if
+        no phase was timed.
+        """
+        if not self.totals:
+            return []
+        contents = ['Phases:']
+        for path in sorted(self.totals, key=lambda path: path.split('/')):
+            calls, wall, cpu = self.totals[path]
+            depth = path.count('/')
+            percent = ' (%.1f%%)' % (100 * wall / total) if total > 0 else ''
+            contents.append('%s%s: %s%s, %d call%s, CPU %s'
+                            % ('    ' * (depth + 1), path.rsplit('/', 1)[-1], format_seconds(wall), percent,
+                               calls, '' if calls == 1 else 's', format_seconds(cpu)))
+        return contents
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 60:
+        return '%.3fs' % seconds
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+_store = PhaseStore()
+
+
+class phase:
+    """
+    Time a phase of the run (data loading, evaluation...), as a context manager or a
+    decorator. Phases can be nested, and a phase entered several times adds up: the
+    completion message includes the time, percentage and number of calls of each one.
+    Entering and leaving a phase costs a couple of microseconds.
+
+        with knockknock.phase("data_loading"):
+            batch = next(loader)
+
+        @knockknock.phase("eval")
+        def evaluate():
+            ...
+
+    `name`: str
+        Name of the phase in the completion message.
+    """
+
+    __slots__ = ('name', 'path', 'start', 'cpu_start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        paths = _store.stack.paths
+        self.path = path = paths[-1] + '/' + self.name if paths else self.name
+        paths.append(path)
+        self.cpu_start = _process_time()
+        self.start = _perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Hot path: a few additions.
+        wall = _perf_counter() - self.start
+        cpu = _process_time() - self.cpu_start
+        _store.stack.paths.pop()
+        totals = _store.totals
+        entry = totals.get(self.path)
+        if entry is None:
+            entry = totals[self.path] = [0, 0., 0.]
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # A new phase per call, so that the function can be reentrant.
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
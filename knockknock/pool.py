@@ -0,0 +1,190 @@
+import datetime
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from knockknock.core import DATE_FORMAT
+
+# Maximum number of commands listed in the summary, failures first.
+MAX_SUMMARY_COMMANDS = 50
+
+
+def read_commands(commands_file: str) -> List[List[str]]:
+    """
+    Commands of `commands_file` (or stdin for "-"), one per line, split like a shell
+    would. Empty lines and `#` comments are ignored.
+    """
+    f = sys.stdin if commands_file == '-' else open(commands_file)
+    try:
+        commands = [shlex.split(line, comments=True) for line in f]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return [command for command in commands if command]
+
+
+def describe_returncode(returncode: int) -> str:
+    if returncode < 0:
+        try:
+            return 'killed by %s' % signal.Signals(-returncode).name
+        except ValueError:
+            return 'killed by signal %d' % -returncode
+    return str(returncode)
+
+
+class Job:
+
+    def __init__(self, index: int, command: List[str]):
+        self.index = index
+        self.command = command
+        # "pending", "running", "complete", "failed", "killed" or "cancelled".
+        self.status = 'pending'
+        self.returncode = None
+        self.duration = None
+        self.process = None
+
+    @property
+    def command_line(self) -> str:
+        return ' '.join(shlex.quote(argument) for argument in self.command)
+
+    def summary_line(self) -> str:
+        duration = str(datetime.timedelta(seconds=int(self.duration))) if self.duration is not None else '-'
+        status = self.status
+        if self.status in ('failed', 'killed'):
+            status += ' (%s)' % describe_returncode(self.returncode)
+        return '%s | %s | %s' % (status, duration, self.command_line)
+
+
+class CommandPool:
+    """
+    Run commands through a pool of at most `jobs` concurrent processes. With
+    `fail_fast`, the first failure terminates the running commands and cancels the
+    ones not started yet.
+    """
+
+    def __init__(self, commands: List[List[str]], jobs: int = 1, fail_fast: bool = False):
+        self.jobs = [Job(index, command) for index, command in enumerate(commands)]
+        self.max_workers = max(1, jobs)
+        self.fail_fast = fail_fast
+        self.lock = threading.Lock()
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Terminate the running commands and cancel the pending ones.
+        """
+        with self.lock:
+            self.cancelled = True
+            for job in self.jobs:
+                if job.status == 'running':
+                    job.process.terminate()
+
+    def run_job(self, job: Job) -> Job:
+        with self.lock:
+            # Checked under the lock, so that no command starts after a cancellation.
+            if self.cancelled:
+                job.status = 'cancelled'
+                return job
+            start_counter = time.perf_counter()
+            try:
+                job.process = subprocess.Popen(job.command)
+                job.status = 'running'
+            except OSError:
+                # Command not found, like a shell would report it.
+                job.status, job.returncode, job.duration = 'failed', 127, 0.
+        if job.process is None:
+            return self.finish(job)
+        job.returncode = job.process.wait()
+        job.duration = time.perf_counter() - start_counter
+        with self.lock:
+            if job.returncode == 0:
+                job.status = 'complete'
+            else:
+                job.status = 'killed' if self.cancelled else 'failed'
+        return self.finish(job)
+
+    def finish(self, job: Job) -> Job:
+        if job.status == 'failed' and self.fail_fast:
+            # Cancel from the worker thread, before it picks up the next command.
+            self.cancel()
+        return job
+
+    def run(self):
+        """
+        Yield each job once it is done (or cancelled).
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.run_job, job) for job in self.jobs]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            except BaseException:
+                self.cancel()
+                raise
+
+
+def run_commands(commands: List[List[str]], send_message, jobs: int = 1, fail_fast: bool = False) -> bool:
+    """
+    Run `commands` with at most `jobs` of them at the same time. Each failure is
+    reported as soon as it happens, and a single summary with the status and duration
+    of every command is sent at the end. Return whether all the commands succeeded.
+    """
+    host_name = socket.gethostname()
+    start_time = datetime.datetime.now()
+    # Durations are measured with a monotonic clock, not affected by NTP or DST changes.
+    start_counter = time.perf_counter()
+    pool = CommandPool(commands, jobs=jobs, fail_fast=fail_fast)
+    send_message('start', ['Your commands have started 🎬',
+                           'Machine name: %s' % host_name,
+                           'Commands: %d (%d at a time%s)' % (len(commands), pool.max_workers,
+                                                            ', fail-fast' if fail_fast else ''),
+                           'Starting date: %s' % start_time.strftime(DATE_FORMAT)])
+
+    interrupted = None
+    done = 0
+    try:
+        for job in pool.run():
+            done += 1
+            if job.status == 'failed':
+                failed = sum(other.status == 'failed' for other in pool.jobs)
+                send_message('crash', ["A command has failed ☠️",
+                                       'Machine name: %s' % host_name,
+                                       'Command: %s' % job.command_line,
+                                       'Exit status: %s' % describe_returncode(job.returncode),
+                                       'Duration: %s' % datetime.timedelta(seconds=int(job.duration)),
+                                       'Progress: %d/%d done, %d failed' % (done, len(pool.jobs), failed)])
+    except KeyboardInterrupt as ex:
+        interrupted = ex
+
+    end_time = datetime.datetime.now()
+    counts = {}
+    for job in pool.jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    success = counts.get('complete', 0) == len(pool.jobs)
+    contents = ["Your commands are complete 🎉" if success else "Some of your commands have failed ☠️",
+                'Machine name: %s' % host_name,
+                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
+                'End date: %s' % end_time.strftime(DATE_FORMAT),
+                'Total duration: %s' % datetime.timedelta(seconds=time.perf_counter() - start_counter),
+                'Status: %s' % ', '.join('%d %s' % (counts[status], status) for status in
+                                         ('complete', 'failed', 'killed', 'cancelled', 'pending')
+                                         if status in counts)]
+    if interrupted is not None:
+        contents.append('Interrupted by KeyboardInterrupt.')
+    # Failures first, then in the order of the commands file.
+    jobs = sorted(pool.jobs, key=lambda job: (job.status == 'complete', job.index))
+    contents += ['', 'status | duration | command']
+    contents += [job.summary_line() for job in jobs[:MAX_SUMMARY_COMMANDS]]
+    if len(jobs) > MAX_SUMMARY_COMMANDS:
+        contents.append('... and %d more' % (len(jobs) - MAX_SUMMARY_COMMANDS))
+    send_message('complete' if success else 'crash', contents)
+
+    if interrupted is not None:
+        raise interrupted
+    return success
@@ -0,0 +1,60 @@
+import time
+from typing import List, Tuple
+
+from knockknock.budget import BackgroundCall
+
+# Seconds given to all the backends to pass their checks.
+PREFLIGHT_TIMEOUT = 5.
+
+
+class PreflightError(Exception):
+    """
+    A backend failed its preflight check: its configuration (webhook, token,
+    credentials...) is wrong or it can't be reached.
+    """
+
+
+def check_reachable(session, url: str, timeout: float):
+    """
+    Check that `url` can be reached (DNS, TLS, firewall), for webhooks that can't be
+    checked without posting a message. Any HTTP status is fine.
+    """
+    session.head(url, timeout=timeout, allow_redirects=False)
+
+
+def backend_checks(senders) -> List[Tuple[str, object]]:
+    """
+    (name, check function) of each backend of `senders`: `*_sender` decorators,
+    `Notifier`s and `MultiNotifier`s.
+    """
+    checks = []
+    for sender in senders:
+        if hasattr(sender, 'notifiers'):
+            checks += backend_checks(sender.notifiers)
+        elif hasattr(sender, 'sender'):
+            checks += [(type(sender).__name__, check) for _, check in backend_checks([sender.sender])]
+        else:
+            checks.append((sender.send_message.__qualname__.split('.')[0], sender.check))
+    return checks
+
+
+def check_backends(senders, timeout: float = PREFLIGHT_TIMEOUT):
+    """
+    Check concurrently, with lightweight requests that don't post anything (auth
+    endpoints, webhook lookups, SMTP login...), that each backend of `senders` is
+    correctly configured and reachable, to learn about a wrong token before the run
+    rather than when its completion message is lost. Raise `PreflightError` listing
+    the backends that failed or didn't answer within `timeout` seconds. Backends
+    without a check (e.g. desktop notifications) pass.
+    """
+    calls = [(name, BackgroundCall(check, timeout)) for name, check in backend_checks(senders)
+             if check is not None]
+    deadline = time.monotonic() + timeout
+    failures = []
+    for name, call in calls:
+        if not call.wait(max(deadline - time.monotonic(), 0)):
+            failures.append('%s: no answer within %gs' % (name, timeout))
+        elif call.error is not None:
+            failures.append('%s: %s' % (name, call.error if str(call.error) else type(call.error).__name__))
+    if failures:
+        raise PreflightError('Preflight check failed for %s' % '; '.join(failures))
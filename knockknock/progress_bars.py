@@ -0,0 +1,108 @@
+import collections
+import datetime
+import functools
+import sys
+from typing import List
+
+# Number of progress bars listed in a notification, the most recent ones.
+MAX_BARS = 10
+
+
+def describe(bar, closed: bool = False) -> str:
+    """
+    Description, n/total, smoothed rate and ETA (or duration, once closed) of the tqdm
+    progress bar `bar`, from its `format_dict`.
+    """
+    state = bar.format_dict
+    n, total, elapsed, unit = state['n'], state['total'], state['elapsed'], state.get('unit') or 'it'
+    # Exponential moving average computed by tqdm, None before enough updates.
+    rate = state.get('rate') or (n / elapsed if elapsed else None)
+    line = '%s: %g' % (state.get('prefix') or 'progress', n)
+    if total:
+        line += '/%g (%d%%)' % (total, 100 * n / total)
+    if rate:
+        line += ', %s %s/s' % ('%.3g' % rate if rate < 1000 else '%d' % rate, unit)
+    if closed:
+        line += ', took %s' % datetime.timedelta(seconds=int(elapsed))
+    elif total and rate and n < total:
+        line += ', ETA %s' % datetime.timedelta(seconds=int((total - n) / rate))
+    return line
+
+
+class TqdmProgress:
+    """
+    State of the tqdm progress bars of the run, for the notifications: the open bars,
+    read from the live instances tracked by tqdm, and the last state of the bars closed
+    since `start` (by description, e.g. the last epoch). Only `tqdm.close` is wrapped,
+    so that the iterations of the bars cost nothing more.
+    """
+
+    def __init__(self):
+        self.tqdm_class = None
+        self.original_close = None
+        # Description -> last line of the closed bars, oldest first, at most `MAX_BARS`:
+        # bars created in a loop with a different description each time add up.
+        self.closed = collections.OrderedDict()
+
+    def start(self):
+        """
+        Start following the bars. Print a warning if tqdm isn't installed.
+        """
+        try:
+            from tqdm.std import tqdm
+        except ImportError:
+            print('knockknock: tqdm progress bars are not reported, tqdm is not installed.', file=sys.stderr)
+            return
+        self.tqdm_class = tqdm
+        self.original_close = original_close = tqdm.close
+
+        @functools.wraps(original_close)
+        def close(bar):
+            # Closed bars are disabled: closing one again reports nothing.
+            if not bar.disable:
+                try:
+                    line = describe(bar, closed=True)
+                except Exception:
+                    line = None
+                if line is not None:
+                    self.closed.pop(bar.desc, None)
+                    self.closed[bar.desc] = line
+                    if len(self.closed) > MAX_BARS:
+                        self.closed.popitem(last=False)
+            return original_close(bar)
+        tqdm.close = close
+
+    def stop(self):
+        if self.tqdm_class is not None:
+            self.tqdm_class.close = self.original_close
+            self.tqdm_class = None
+
+    def open_bars(self) -> list:
+        bars = []
+        classes = [self.tqdm_class]
+        while classes:
+            cls = classes.pop()
+            classes.extend(cls.__subclasses__())
+            try:
+                # WeakSet of the open bars, kept by tqdm to position them.
+                bars.extend(bar for bar in list(cls.__dict__.get('_instances', ())) if bar not in bars)
+            except RuntimeError:
+                # Changed by another thread while copied.
+                continue
+        return [bar for bar in bars if not bar.disable]
+
+    def format(self) -> List[str]:
+        """
+        Lines describing the progress bars. Empty if there is none.
+        """
+        if self.tqdm_class is None:
+            return []
+        lines = list(self.closed.values())
+        for bar in self.open_bars():
+            try:
+                lines.append(describe(bar))
+            except Exception:
+                continue
+        if not lines:
+            return []
+        return ['Progress bars:'] + ['    %s' % line for line in lines[-MAX_BARS:]]
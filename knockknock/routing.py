@@ -0,0 +1,201 @@
+import atexit
+import datetime
+import fnmatch
+import functools
+import os
+import sys
+import threading
+from typing import List
+
+from knockknock import distributed
+from knockknock.core import message_fields, send_with_attachments
+from knockknock.notifier import MultiNotifier, Notifier
+
+# Event of a batch of notifications of different events.
+DIGEST_EVENT = 'digest'
+
+# Routes of the process with a pending batch, sent at exit.
+_pending_routes = set()
+
+
+@atexit.register
+def _flush_at_exit():
+    for route in list(_pending_routes):
+        _report_failure(route, route.flush)
+
+
+def _reset_in_child():
+    # The batches and their timers belong to the parent.
+    for route in _pending_routes:
+        route.lock = threading.Lock()
+        route.batch, route.batch_count, route.timer = [], 0, None
+    _pending_routes.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+def _match(patterns, value) -> bool:
+    return patterns is None or any(fnmatch.fnmatchcase(str(value), str(pattern)) for pattern in patterns)
+
+
+class Route:
+    """
+    Notifications sent to `notifier`: those matching all the given criteria (patterns
+    with `*` wildcards), sent immediately or batched.
+
+    `notifier`: Notifier
+        The notifier to send the notifications with.
+    `events`: List[str] (default=None)
+        Events routed, e.g. ["crash", "died"]. All events by default.
+    `func_names`: List[str] (default=None)
+        Names of the tracked functions (or commands) routed, e.g. ["train*"].
+    `hosts`: List[str] (default=None)
+        Machine names routed, e.g. ["gpu-node-*"].
+    `ranks`: List[int] (default=None)
+        Ranks routed in distributed jobs, e.g. [0]. A process that is not part of a
+        distributed job is rank 0.
+    `batch_window`: float (default=None)
+        Seconds during which the notifications are gathered into a single one, sent
+        when the window is over, or at the exit of the process. Sent immediately by
+        default.
+    `max_batch`: int (default=20)
+        Maximum number of notifications written in full in a batch. The following ones
+        are only counted.
+    """
+
+    def __init__(self, notifier: Notifier, events: List[str] = None, func_names: List[str] = None,
+                 hosts: List[str] = None, ranks: List[int] = None, batch_window: float = None,
+                 max_batch: int = 20):
+        self.notifier = notifier
+        self.events = events
+        self.func_names = func_names
+        self.hosts = hosts
+        self.ranks = ranks
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        # Notifications of the current window, as (event, contents), and their number.
+        self.batch = []
+        self.batch_count = 0
+        self.batch_start = None
+        self.timer = None
+
+    def __reduce__(self):
+        # The pending batch and its timer belong to the current process.
+        return (functools.partial(Route, self.notifier, self.events, self.func_names, self.hosts,
+                                  self.ranks, self.batch_window, self.max_batch), ())
+
+    def matches(self, event: str, func_name: str, host_name: str, rank: int) -> bool:
+        return (_match(self.events, event)
+                and _match(self.func_names, func_name)
+                and _match(self.hosts, host_name)
+                and _match(self.ranks, 0 if rank is None else rank))
+
+    def send_message(self, event: str, contents: List[str]):
+        if self.batch_window is None:
+            self.notifier.send_message(event, contents)
+            return
+        with self.lock:
+            if self.timer is None:
+                self.batch_start = datetime.datetime.now()
+                self.timer = threading.Timer(self.batch_window, _report_failure, (self, self.flush))
+                # Flushed at exit rather than delaying it.
+                self.timer.daemon = True
+                self.timer.start()
+                _pending_routes.add(self)
+            self.batch_count += 1
+            if len(self.batch) < self.max_batch:
+                self.batch.append((event, contents))
+
+    def send_attachments(self, event: str, contents: List[str], paths: List[str]):
+        if self.batch_window is None:
+            send_with_attachments(self.notifier.send_message, self.notifier.options.get('send_attachments'),
+                                  event, contents, paths)
+        else:
+            self.send_message(event, contents + ['Attachments not sent (batched notification): %s'
+                                                 % ', '.join(paths)])
+
+    def flush(self):
+        """
+        Send the notifications of the current window now, as a single one.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            batch, count, start = self.batch, self.batch_count, self.batch_start
+            self.batch, self.batch_count, self.timer = [], 0, None
+            _pending_routes.discard(self)
+        if not batch:
+            return
+        if count == 1:
+            self.notifier.send_message(*batch[0])
+            return
+        events = {event for event, _ in batch}
+        contents = ['%d notifications since %s' % (count, start.strftime('%H:%M:%S'))]
+        for event, lines in batch:
+            contents += [''] + lines
+        if count > len(batch):
+            contents += ['', 'And %d more notifications' % (count - len(batch))]
+        self.notifier.send_message(events.pop() if len(events) == 1 else DIGEST_EVENT, contents)
+
+
+class RoutingNotifier(MultiNotifier):
+    """
+    Send each notification through the routes it matches, e.g. crashes paged
+    immediately by text message, completions batched into Slack every 15 minutes, and
+    progress only to a metrics backend:
+
+        notifier = RoutingNotifier(
+            Route(SmsNotifier(...), events=["crash", "died"]),
+            Route(SlackNotifier(...), events=["complete"], batch_window=900),
+            Route(StatsdNotifier(...), events=["progress"]))
+
+    Notifications matching no route are not sent. Batches are sent when their window
+    is over, and at the exit of the process. A backend failing to send a notification
+    does not prevent the others from receiving it.
+
+    `routes`: Route
+        The routes, each with its notifier.
+    `preflight`: bool (default=False)
+        Check all the backends concurrently now, see `knockknock.preflight.check_backends`.
+    `options`:
+        Options shared by all senders (see `knockknock.core.track`), used as defaults
+        by `track` and the decorator.
+    """
+
+    def __init__(self, *routes: Route, preflight: bool = False, **options):
+        super().__init__(*[route.notifier for route in routes], preflight=preflight, **options)
+        self.routes = routes
+
+    def matching_routes(self, event: str, contents: List[str]) -> List[Route]:
+        # Messages without fields (e.g. `Notifier.send`) are from this process.
+        fields = message_fields(contents)
+        func_name = fields.get('func_name') or ''
+        host_name = fields.get('host_name') or self.host_name
+        rank = fields['rank'] if 'rank' in fields else distributed.get_rank()
+        return [route for route in self.routes if route.matches(event, func_name, host_name, rank)]
+
+    def send_message(self, event: str, contents: List[str]):
+        for route in self.matching_routes(event, contents):
+            _report_failure(route, route.send_message, event, contents)
+
+    def send_attachments(self, event: str, contents: List[str], paths: List[str]):
+        for route in self.matching_routes(event, contents):
+            _report_failure(route, route.send_attachments, event, contents, paths)
+
+    def flush(self):
+        """
+        Send the pending batches now.
+        """
+        for route in self.routes:
+            _report_failure(route, route.flush)
+
+
+def _report_failure(route: Route, send, *args):
+    try:
+        send(*args)
+    except Exception as ex:
+        print('knockknock: %s could not send the notification: %r' % (type(route.notifier).__name__, ex),
+              file=sys.stderr)
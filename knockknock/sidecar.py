@@ -0,0 +1,189 @@
+import datetime
+import faulthandler
+import os
+import signal
+import threading
+import time
+import weakref
+
+from knockknock.core import DATE_FORMAT, Message
+from knockknock.snapshot import cgroup_dirs
+
+# Sidecars of the current process, whose pipe must not stay open in forked children
+# (e.g. dataloader workers), otherwise the sidecar would not notice the parent's death.
+_sidecars = weakref.WeakSet()
+
+
+def _close_in_child():
+    for sidecar in list(_sidecars):
+        sidecar.close_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_close_in_child)
+
+
+def read_oom_kill_count():
+    """
+    Number of processes killed by the OOM killer in the cgroup of the current process,
+    or None if it can't be read (cgroup v2 `memory.events`, then cgroup v1
+    `memory.oom_control`).
+    """
+    for version, directory in cgroup_dirs():
+        file_name = os.path.join(directory, 'memory.events' if version == 'v2' else 'memory.oom_control')
+        try:
+            with open(file_name) as f:
+                for line in f:
+                    name, _, count = line.partition(' ')
+                    if name == 'oom_kill':
+                        return int(count)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class Sidecar:
+    """
+    Out-of-process watchdog: a process forked at the start of the run watches the parent
+    through a pipe. The parent writes heartbeats into it and `done` on clean completion.
+    If the pipe is closed without `done` (the parent was SIGKILLed by the OOM killer,
+    called `os._exit`, segfaulted in a native extension...), the sidecar sends a
+    "died unexpectedly" notification with the last heartbeat and what it could gather
+    about the cause of death.
+
+    The parent also points `faulthandler` to the pipe (unless it is already enabled), so
+    the Python stack of a fatal signal (SIGSEGV, SIGABRT, SIGBUS...) ends up in the
+    notification.
+
+    The duration of the run is measured from `start_counter`, a `time.perf_counter()`
+    value (now by default), which the forked sidecar shares with its parent.
+    """
+
+    def __init__(self, send_message, host_name: str, func_name: str,
+                 start_time: datetime.datetime, heartbeat_interval: float = 60.,
+                 start_counter: float = None):
+        self.send_message = send_message
+        self.host_name = host_name
+        self.func_name = func_name
+        self.start_time = start_time
+        self.start_counter = time.perf_counter() if start_counter is None else start_counter
+        self.heartbeat_interval = heartbeat_interval
+        self.pid = None
+        self.write_fd = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.faulthandler_enabled = False
+
+    def start(self):
+        if not hasattr(os, 'fork'):
+            print('Warning: the knockknock sidecar requires `os.fork`, it is disabled on this platform.')
+            return
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(write_fd)
+            try:
+                self.watch(read_fd)
+            finally:
+                os._exit(0)
+
+        os.close(read_fd)
+        self.pid = pid
+        self.write_fd = write_fd
+        _sidecars.add(self)
+        if not faulthandler.is_enabled():
+            faulthandler.enable(file=write_fd, all_threads=True)
+            self.faulthandler_enabled = True
+        self.write('heartbeat %f\n' % time.time())
+        threading.Thread(target=self.beat, name='knockknock-heartbeat', daemon=True).start()
+
+    def close_in_child(self):
+        if self.write_fd is not None:
+            try:
+                os.close(self.write_fd)
+            except OSError:
+                pass
+            self.write_fd = None
+        self.stopped.set()
+
+    def write(self, line: str):
+        with self.lock:
+            if self.write_fd is None:
+                return
+            try:
+                os.write(self.write_fd, line.encode())
+            except OSError:
+                # The sidecar is gone, nothing left to tell it.
+                pass
+
+    def beat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            self.write('heartbeat %f\n' % time.time())
+
+    def done(self):
+        """
+        Tell the sidecar the run ended cleanly (or was already reported) and reap it.
+        """
+        if self.write_fd is None:
+            return
+        self.stopped.set()
+        if self.faulthandler_enabled:
+            faulthandler.disable()
+            self.faulthandler_enabled = False
+        self.write('done\n')
+        with self.lock:
+            os.close(self.write_fd)
+            self.write_fd = None
+        try:
+            os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            pass
+
+    def watch(self, read_fd: int):
+        """
+        Body of the sidecar process.
+        """
+        # Terminal interrupts and scheduler SIGTERMs target the whole process group:
+        # the sidecar outlives them to report, and exits when the pipe is closed.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        parent_pid = os.getppid()
+        oom_kill_count = read_oom_kill_count()
+        last_heartbeat = None
+        fatal_output = []
+
+        with os.fdopen(read_fd, 'rb') as pipe:
+            for line in pipe:
+                if line == b'done\n':
+                    return
+                if line.startswith(b'heartbeat '):
+                    last_heartbeat = float(line.split()[1])
+                else:
+                    fatal_output.append(line.decode(errors='replace'))
+
+        end_time = datetime.datetime.now()
+        elapsed_time = datetime.timedelta(seconds=time.perf_counter() - self.start_counter)
+        contents = Message(["Your training has died unexpectedly 💀",
+                            'Machine name: %s' % self.host_name,
+                            'Main call: %s' % self.func_name,
+                            'Process id: %d' % parent_pid,
+                            'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                            'Death detected: %s' % end_time.strftime(DATE_FORMAT),
+                            'Crashed training duration: %s' % str(elapsed_time)],
+                           duration=elapsed_time.total_seconds())
+        if last_heartbeat is not None:
+            contents.append('Last heartbeat: %s (%ds before death was detected)' % (
+                datetime.datetime.fromtimestamp(last_heartbeat).strftime(DATE_FORMAT),
+                time.time() - last_heartbeat))
+
+        new_oom_kill_count = read_oom_kill_count()
+        if fatal_output:
+            contents.append('Probable cause: fatal signal, see the stack below.\n\n')
+            contents.append('%s' % ''.join(fatal_output))
+        elif oom_kill_count is not None and new_oom_kill_count is not None \
+                and new_oom_kill_count > oom_kill_count:
+            contents.append('Probable cause: SIGKILL from the OOM killer (%d OOM kill(s) in the cgroup during the run).'
+                            % (new_oom_kill_count - oom_kill_count))
+        else:
+            contents.append('Probable cause: unknown (SIGKILL, `os._exit` or an unhandled native crash).')
+        self.send_message('died', contents)
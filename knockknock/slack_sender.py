@@ -1,15 +1,19 @@
 from typing import List
-import os
-import datetime
-import traceback
-import functools
 import json
-import socket
 import requests
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.attachments import describe_attachments, prepare_attachments
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
 
-def slack_sender(webhook_url: str, channel: str, user_mentions: List[str] = []):
+# Maximum length of a Slack message.
+MAX_MESSAGE_LENGTH = 40000
+# Maximum size of a file uploaded to Slack.
+MAX_ATTACHMENT_SIZE = 1024 ** 3
+SLACK_API_URL = 'https://slack.com/api/'
+
+
+@picklable_sender
+def slack_sender(webhook_url: str, channel: str, user_mentions: List[str] = [], token: str = None, **kwargs):
     """
     Slack sender wrapper: execute func, send a Slack notification with the end status
     (sucessfully finished or crashed) at the end. Also send a Slack notification before
@@ -23,6 +27,13 @@ def slack_sender(webhook_url: str, channel: str, user_mentions: List[str] = []):
     `user_mentions`: List[str] (default=[])
         Optional users ids to notify.
         Visit https://api.slack.com/methods/users.identity for more details.
+    `token`: str (default=None)
+        Optional bot token (with the `files:write` scope) used to upload the
+        `attachments`, which incoming webhooks can't do. `channel` must then be a
+        channel id (e.g. C0123456789).
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
 
     dump = {
@@ -30,80 +41,54 @@ def slack_sender(webhook_url: str, channel: str, user_mentions: List[str] = []):
         "channel": channel,
         "icon_emoji": ":clapper:",
     }
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                contents.append(' '.join(user_mentions))
-                dump['text'] = '\n'.join(contents)
-                dump['icon_emoji'] = ':clapper:'
-                requests.post(webhook_url, json.dumps(dump))
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
+    icons = {'start': ':clapper:',
+             'complete': ':tada:',
+             'crash': ':skull_and_crossbones:',
+             'died': ':skull_and_crossbones:',
+             'stall': ':hourglass:',
+             'resume': ':arrow_forward:',
+             'progress': ':runner:',
+             'match': ':mag:',
+             'checkpoint': ':floppy_disk:',
+             'memory': ':chart_with_upwards_trend:',
+             'log': ':warning:'}
 
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
+    session = PerProcess(requests.Session)
 
-                    contents.append(' '.join(user_mentions))
-                    dump['text'] = '\n'.join(contents)
-                    dump['icon_emoji'] = ':tada:'
-                    requests.post(webhook_url, json.dumps(dump))
+    def send_message(event: str, contents: List[str]):
+        contents = contents + [' '.join(user_mentions)]
+        # Built per call: the threads of a run (watchdog, progress...) send concurrently.
+        payload = dict(dump, text='\n'.join(contents), icon_emoji=icons.get(event, ':bell:'))
+        session.get().post(webhook_url, json.dumps(payload))
 
-                return value
+    def call_api(method: str, **kwargs) -> dict:
+        response = session.get().post(SLACK_API_URL + method, headers={'Authorization': 'Bearer %s' % token}, **kwargs)
+        response.raise_for_status()
+        result = response.json()
+        if not result.get('ok'):
+            raise RuntimeError('Slack API %s failed: %s' % (method, result.get('error')))
+        return result
 
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                contents.append(' '.join(user_mentions))
-                dump['text'] = '\n'.join(contents)
-                dump['icon_emoji'] = ':skull_and_crossbones:'
-                requests.post(webhook_url, json.dumps(dump))
-                raise ex
+    def send_attachments(event: str, contents: List[str], paths: List[str]):
+        with prepare_attachments(paths, MAX_ATTACHMENT_SIZE) as (attachments, skipped):
+            send_message(event, contents + describe_attachments(attachments, skipped))
+            for attachment in attachments:
+                upload = call_api('files.getUploadURLExternal',
+                                  data={'filename': attachment.name, 'length': attachment.size})
+                with attachment.open() as f:
+                    session.get().post(upload['upload_url'], data=f).raise_for_status()
+                call_api('files.completeUploadExternal',
+                         json={'files': [{'id': upload['file_id'], 'title': attachment.name}],
+                               'channel_id': channel})
 
-        return wrapper_sender
+    def check(timeout: float):
+        # An empty payload is rejected without posting anything: 400 for a valid webhook,
+        # 403, 404 or 410 for a wrong or revoked one.
+        response = session.get().post(webhook_url, json={}, timeout=timeout)
+        if response.status_code in (403, 404, 410):
+            raise RuntimeError('Slack webhook rejected: %s' % response.text)
+        if token:
+            call_api('auth.test', timeout=timeout)
 
-    return decorator_sender
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH,
+                            send_attachments=send_attachments if token else None, check=check, **kwargs)
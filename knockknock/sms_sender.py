@@ -1,83 +1,21 @@
-import os
-import datetime
-import traceback
-import functools
-import socket
+from typing import List
 from twilio.rest import Client
 
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Maximum length of a Twilio SMS message.
+MAX_MESSAGE_LENGTH = 1600
 
-def sms_sender(account_sid: str, auth_token: str, recipient_number: str, sender_number: str):
-    client = Client(account_sid, auth_token)
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
 
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
+@picklable_sender
+def sms_sender(account_sid: str, auth_token: str, recipient_number: str, sender_number: str, **kwargs):
+    client = PerProcess(Client, account_sid, auth_token)
 
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
+    def send_message(event: str, contents: List[str]):
+        text = '\n'.join(contents)
+        client.get().messages.create(body=text, from_=sender_number, to=recipient_number)
 
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                text = '\n'.join(contents)
-                client.messages.create(body=text, from_=sender_number, to=recipient_number)
+    def check(timeout: float):
+        client.get().api.accounts(account_sid).fetch()
 
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append('Main call returned value: %s'% str_value)
-                    except:
-                        contents.append('Main call returned value: %s'% "ERROR - Couldn't str the returned value.")
-
-                    text = '\n'.join(contents)
-                    client.messages.create(body=text, from_=sender_number, to=recipient_number)
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                text = '\n'.join(contents)
-                client.messages.create(body=text, from_=sender_number, to=recipient_number)
-                raise ex
-
-        return wrapper_sender
-
-    return decorator_sender
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH, check=check, **kwargs)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+# Maximum number of seconds spent taking a snapshot: a hung network filesystem must
+# not delay the crash notification.
+SNAPSHOT_TIME_BUDGET = 0.2
+
+
+def format_size(size: float) -> str:
+    if size < 1024:
+        return '%d B' % size
+    for unit in ('KiB', 'MiB', 'GiB', 'TiB'):
+        size /= 1024
+        if size < 1024 or unit == 'TiB':
+            return '%.1f %s' % (size, unit)
+
+
+def cgroup_dirs() -> List[Tuple[str, str]]:
+    """
+    Directories of the memory cgroup of the current process, with the cgroup version
+    ("v2" or "v1"), read from `/proc/self/cgroup`. Empty if not available.
+    """
+    try:
+        with open('/proc/self/cgroup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    dirs = []
+    for line in lines:
+        _, controllers, path = line.split(':', 2)
+        if controllers == '':
+            dirs.append(('v2', '/sys/fs/cgroup%s' % path.rstrip('/')))
+        elif 'memory' in controllers.split(','):
+            dirs.append(('v1', '/sys/fs/cgroup/memory%s' % path.rstrip('/')))
+    return dirs
+
+
+def read_key_values(path: str) -> dict:
+    """
+    Fields of a `/proc` file of "Key: value" lines (`/proc/meminfo`, `/proc/self/status`).
+    """
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            values[key] = value.strip()
+    return values
+
+
+def load_lines() -> List[str]:
+    load = os.getloadavg()
+    return ['Load average: %.2f %.2f %.2f (%d CPUs)' % (load + (os.cpu_count() or 0,))]
+
+
+def memory_lines() -> List[str]:
+    meminfo = read_key_values('/proc/meminfo')
+
+    def size(key):
+        # Values are in kB.
+        return int(meminfo[key].split()[0]) * 1024
+
+    contents = ['Memory available: %s of %s' % (format_size(size('MemAvailable')), format_size(size('MemTotal')))]
+    if size('SwapTotal'):
+        contents.append('Swap used: %s of %s' % (format_size(size('SwapTotal') - size('SwapFree')),
+                                                 format_size(size('SwapTotal'))))
+    return contents
+
+
+def disk_lines() -> List[str]:
+    contents = []
+    for label, path in (('working directory', os.getcwd()), ('temporary directory', tempfile.gettempdir())):
+        stat = os.statvfs(path)
+        contents.append('Disk free (%s %s): %s of %s' % (label, path, format_size(stat.f_bavail * stat.f_frsize),
+                                                         format_size(stat.f_blocks * stat.f_frsize)))
+    return contents
+
+
+def process_lines() -> List[str]:
+    import resource
+    soft_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    limit = '' if soft_limit == resource.RLIM_INFINITY else ' (limit %d)' % soft_limit
+    return ['Open file descriptors: %d%s' % (len(os.listdir('/proc/self/fd')), limit),
+            'Threads: %s' % read_key_values('/proc/self/status')['Threads']]
+
+
+def read_cgroup_value(path: str) -> Optional[int]:
+    with open(path) as f:
+        value = f.read().strip()
+    # cgroup v1 reports no limit as a huge number.
+    return None if value == 'max' or int(value) >= 2 ** 62 else int(value)
+
+
+def cgroup_lines() -> List[str]:
+    for version, directory in cgroup_dirs():
+        names = ('memory.current', 'memory.max') if version == 'v2' else ('memory.usage_in_bytes',
+                                                                          'memory.limit_in_bytes')
+        try:
+            usage, limit = (read_cgroup_value(os.path.join(directory, name)) for name in names)
+        except (OSError, ValueError):
+            continue
+        return ['Cgroup memory: %s (%s)' % (format_size(usage),
+                                             'no limit' if limit is None else 'limit %s' % format_size(limit))]
+    return []
+
+
+# Functions returning the lines of the snapshot, from the cheapest to the slowest.
+PROBES = (load_lines, memory_lines, process_lines, cgroup_lines, disk_lines)
+
+
+def system_snapshot(budget: float = SNAPSHOT_TIME_BUDGET) -> List[str]:
+    """
+    Lines describing the state of the machine (load, memory, swap, free disk space,
+    file descriptors, threads, cgroup memory), read from `/proc` and `/sys/fs/cgroup`
+    to tell at a glance whether a node was out of memory, out of disk or overloaded.
+    Probes run in a thread and the snapshot returns after `budget` seconds at most,
+    with the lines collected so far. Probes that fail (e.g. not on Linux) are skipped.
+    """
+    contents = []
+
+    def collect():
+        for probe in PROBES:
+            try:
+                lines = probe()
+            except (OSError, KeyError, ValueError, IndexError):
+                continue
+            contents.extend(lines)
+
+    thread = threading.Thread(target=collect, name='knockknock-snapshot', daemon=True)
+    try:
+        thread.start()
+    except RuntimeError:
+        # Out of threads, or the interpreter is shutting down: the notification
+        # matters more than the snapshot.
+        return []
+    thread.join(budget)
+    # Copied, the thread may still be running.
+    lines = ['    %s' % line for line in list(contents)]
+    if thread.is_alive():
+        lines.append('    (incomplete: over the %gs time budget)' % budget)
+    return ['System snapshot:'] + lines if lines else []
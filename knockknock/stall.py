@@ -0,0 +1,197 @@
+import datetime
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import List
+
+from knockknock.core import DATE_FORMAT
+
+# Monotonic time of the last call to `heartbeat()` in this process.
+_last_heartbeat = None
+
+
+def heartbeat():
+    """
+    Signal that the training is making progress. When stall detection is enabled
+    (`stall_timeout=...` on any sender), an alert is sent if no heartbeat happens
+    within the window. Cheap enough to be called at every step.
+    """
+    global _last_heartbeat
+    _last_heartbeat = time.monotonic()
+
+
+def read_process_tree(root_pid: int) -> List[List[bytes]]:
+    """
+    Fields of `/proc/<pid>/stat` after the command name (i.e. starting at the state) of
+    `root_pid` and of its live descendants.
+    """
+    children = {}
+    stats = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name, 'rb') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces and parentheses: split after the last ')'.
+        fields = stat[stat.rindex(b')') + 2:].split()
+        pid, ppid = int(name), int(fields[1])
+        children.setdefault(ppid, []).append(pid)
+        stats[pid] = fields
+
+    tree = []
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        if pid in stats:
+            tree.append(stats[pid])
+        pending.extend(children.get(pid, []))
+    return tree
+
+
+def process_tree_cpu_time() -> float:
+    """
+    CPU time (user + system, in seconds) consumed by the current process and its live
+    descendants (dataloader workers, command launched by the CLI...), read from `/proc`.
+    Fall back to the CPU time of the current process only when `/proc` isn't available.
+    """
+    if not os.path.isdir('/proc/self'):
+        return time.process_time()
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    return sum(int(fields[11]) + int(fields[12]) for fields in read_process_tree(os.getpid())) / clock_ticks
+
+
+def format_thread_stacks(max_length: int = None) -> str:
+    """
+    Stacks of every thread of the process, innermost frames last. When `max_length` is
+    given, the outermost frames of each thread are trimmed so that the dump fits.
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    current = threading.get_ident()
+    blocks = []
+    for ident, frame in sys._current_frames().items():
+        if ident == current:
+            continue
+        header = 'Thread %s (%d):\n' % (names.get(ident, '<unknown>'), ident)
+        blocks.append((ident != threading.main_thread().ident, header, traceback.format_stack(frame)))
+    # Main thread first.
+    blocks.sort(key=lambda block: block[0])
+
+    if max_length is None:
+        return '\n'.join(header + ''.join(frames) for _, header, frames in blocks)
+
+    budget = max_length // max(len(blocks), 1)
+    dump = []
+    for _, header, frames in blocks:
+        kept = []
+        length = len(header)
+        for frame in reversed(frames):
+            if length + len(frame) > budget:
+                break
+            kept.append(frame)
+            length += len(frame)
+        trimmed = len(frames) - len(kept)
+        if trimmed:
+            header += '  ... %d outer frame(s) trimmed\n' % trimmed
+        dump.append(header + ''.join(reversed(kept)))
+    return '\n'.join(dump)[:max_length]
+
+
+class StallWatchdog:
+    """
+    Watchdog thread alerting when the training makes no progress within `timeout`
+    seconds: no call to `knockknock.heartbeat()` (`detection="heartbeat"`), or no CPU
+    time consumed by the process tree (`detection="cpu"`). With `detection="auto"`,
+    heartbeats are used as soon as one has been sent during the run, CPU time otherwise.
+
+    The alert contains the stacks of all threads, so that deadlocks (dataloader workers,
+    collective ops...) can be diagnosed. A second notification is sent when progress
+    resumes.
+    """
+
+    # Below this fraction of a core, the process tree is considered idle.
+    MIN_CPU_FRACTION = 0.01
+
+    def __init__(self, send_message, host_name: str, func_name: str,
+                 start_time: datetime.datetime, timeout: float,
+                 detection: str = 'auto', max_length: int = None):
+        if detection not in ('auto', 'heartbeat', 'cpu'):
+            raise ValueError('Unknown stall detection mode: %s' % detection)
+        self.send_message = send_message
+        self.host_name = host_name
+        self.func_name = func_name
+        self.start_time = start_time
+        self.timeout = timeout
+        self.detection = detection
+        self.max_length = max_length
+        self.interval = min(timeout / 4, 30.)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.watch, name='knockknock-stall-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def watch(self):
+        started = time.monotonic()
+        heartbeat_at_start = _last_heartbeat
+        last_progress = started
+        last_cpu = process_tree_cpu_time() if self.detection != 'heartbeat' else None
+        last_check = started
+        stalled_since = None
+
+        while not self.stopped.wait(self.interval):
+            now = time.monotonic()
+            uses_heartbeats = self.detection == 'heartbeat' or (
+                self.detection == 'auto' and _last_heartbeat != heartbeat_at_start)
+            if uses_heartbeats:
+                if _last_heartbeat is not None and _last_heartbeat != heartbeat_at_start:
+                    last_progress = max(last_progress, _last_heartbeat)
+            else:
+                cpu = process_tree_cpu_time()
+                if cpu - last_cpu >= self.MIN_CPU_FRACTION * (now - last_check):
+                    last_progress = now
+                last_cpu = cpu
+            last_check = now
+
+            if now - last_progress < self.timeout:
+                if stalled_since is not None:
+                    self.report_resumed(now - stalled_since)
+                    stalled_since = None
+            elif stalled_since is None:
+                stalled_since = last_progress
+                self.report_stall(now - last_progress, 'heartbeat' if uses_heartbeats else 'CPU time')
+
+    def report_stall(self, idle_time: float, signal_name: str):
+        now = datetime.datetime.now()
+        contents = ['Your training seems stalled ⏳',
+                    'Machine name: %s' % self.host_name,
+                    'Main call: %s' % self.func_name,
+                    'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                    'Detection date: %s' % now.strftime(DATE_FORMAT),
+                    'No %s progress for: %s\n\n' % (signal_name, datetime.timedelta(seconds=int(idle_time))),
+                    'Stacks of all threads:']
+        max_length = None
+        if self.max_length is not None:
+            max_length = max(self.max_length - len('\n'.join(contents)) - 1, 0)
+        contents.append(format_thread_stacks(max_length))
+        self.send_message('stall', contents)
+
+    def report_resumed(self, stalled_time: float):
+        now = datetime.datetime.now()
+        contents = ['Your training has resumed ▶️',
+                    'Machine name: %s' % self.host_name,
+                    'Main call: %s' % self.func_name,
+                    'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                    'Resume date: %s' % now.strftime(DATE_FORMAT),
+                    'Stalled for: %s' % datetime.timedelta(seconds=int(stalled_time))]
+        self.send_message('resume', contents)
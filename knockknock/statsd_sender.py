@@ -0,0 +1,153 @@
+from typing import Dict, List, Tuple
+import os
+import re
+import socket
+import tempfile
+import time
+
+from knockknock.core import PerProcess, message_fields, picklable_sender, sender_decorator
+
+# Events reported with the duration of the run.
+END_EVENTS = ('complete', 'crash', 'died', 'exit')
+# Sample of the Prometheus text format: name, labels, value.
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+
+
+def metric_name(text: str) -> str:
+    """
+    `text` (e.g. a command line) as a component of a metric name.
+    """
+    return re.sub(r'[^a-zA-Z0-9_]+', '_', text).strip('_') or 'unknown'
+
+
+class UdpClient:
+    """
+    Non-blocking UDP socket sending datagrams to `host`:`port`, closed with the client.
+    """
+
+    # Not set if `host` can't be resolved.
+    socket = None
+
+    def __init__(self, host: str, port: int):
+        family, kind, proto, _, self.address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        self.socket = socket.socket(family, kind, proto)
+        # Never wait for the network: a full buffer drops the datagram.
+        self.socket.setblocking(False)
+
+    def send(self, data: bytes):
+        self.socket.sendto(data, self.address)
+
+    def __del__(self):
+        if self.socket is not None:
+            self.socket.close()
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def update_textfile(path: str, updates: Dict[Tuple[str, str], float], increments: Dict[Tuple[str, str], float],
+                    types: Dict[str, str]):
+    """
+    Set (`updates`) or increment (`increments`) samples, keyed by metric name and
+    labels, of the Prometheus textfile at `path`, keeping the other samples. The file
+    is replaced atomically, so that the node_exporter textfile collector never reads
+    a partial file, and updates from several processes are serialized with a lock.
+    """
+    # Not available on Windows, where only the StatsD datagrams can be sent.
+    import fcntl
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        samples = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    match = SAMPLE_PATTERN.match(line.strip())
+                    if match is not None:
+                        samples[match.group(1), match.group(2) or ''] = float(match.group(3))
+        except FileNotFoundError:
+            pass
+        samples.update(updates)
+        for key, value in increments.items():
+            samples[key] = samples.get(key, 0.) + value
+
+        lines = []
+        for name in sorted({name for name, _ in samples}):
+            lines.append('# TYPE %s %s' % (name, types.get(name, 'gauge')))
+            lines += ['%s%s %r' % (name, labels, samples[name, labels])
+                      for sample_name, labels in sorted(samples) if sample_name == name]
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            # Readable by the node_exporter.
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+@picklable_sender
+def statsd_sender(host: str = 'localhost', port: int = 8125, prefix: str = 'knockknock',
+                  textfile: str = None, udp: bool = True, **kwargs):
+    """
+    StatsD sender wrapper: execute func, send a counter per event (start, complete,
+    crash...) and the duration of the run as a timing, in UDP datagrams that never
+    block and need no connection. Optionally also write the same metrics to a
+    Prometheus textfile, for the node_exporter textfile collector.
+
+    Metrics are named `<prefix>.<main call>.<event>` (counters) and
+    `<prefix>.<main call>.<event>.duration` (timings in ms, for complete, crash, died
+    and exit).
+
+    `host`: str (default='localhost')
+        Host of the StatsD server.
+    `port`: int (default=8125)
+        UDP port of the StatsD server.
+    `prefix`: str (default='knockknock')
+        Prefix of the metric names.
+    `textfile`: str (default=None)
+        Path of a Prometheus textfile (e.g. `/var/lib/node_exporter/<job>.prom`)
+        replaced atomically with `<prefix>_events_total`,
+        `<prefix>_last_event_timestamp_seconds` and `<prefix>_last_duration_seconds`,
+        labelled by job and event. Not available on Windows.
+    `udp`: bool (default=True)
+        Send the StatsD datagrams. Set to False to only write the textfile.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
+    """
+    client = PerProcess(UdpClient, host, port)
+    prometheus_prefix = metric_name(prefix.replace('.', '_'))
+    types = {'%s_events_total' % prometheus_prefix: 'counter'}
+
+    def send_message(event: str, contents: List[str]):
+        fields = message_fields(contents)
+        name = fields.get('func_name') or 'unknown'
+        duration = fields.get('duration') if event in END_EVENTS else None
+        if udp:
+            metric = '%s.%s.%s' % (prefix, metric_name(name), metric_name(event))
+            lines = ['%s:1|c' % metric]
+            if duration is not None:
+                lines.append('%s.duration:%d|ms' % (metric, duration * 1000))
+            try:
+                client.get().send('\n'.join(lines).encode())
+            except OSError:
+                # Fire and forget: an unreachable or busy server loses the metric.
+                pass
+        if textfile is not None:
+            labels = '{job="%s",event="%s"}' % (escape_label(name), escape_label(event))
+            updates = {('%s_last_event_timestamp_seconds' % prometheus_prefix, labels): time.time()}
+            if duration is not None:
+                updates['%s_last_duration_seconds' % prometheus_prefix, labels] = duration
+            update_textfile(textfile, updates, {('%s_events_total' % prometheus_prefix, labels): 1.}, types)
+
+    def check(timeout: float):
+        if udp:
+            client.get()
+        if textfile is not None and not os.access(os.path.dirname(os.path.abspath(textfile)), os.W_OK):
+            raise OSError('The directory of %s is not writable.' % textfile)
+
+    return sender_decorator(send_message, check=check, **kwargs)
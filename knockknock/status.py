@@ -0,0 +1,169 @@
+import collections
+import datetime
+import http.server
+import json
+import math
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+from typing import List
+
+from knockknock.core import DATE_FORMAT
+
+# Number of notifications kept in the event log of the status.
+EVENT_LOG_SIZE = 50
+# Seconds given to a client to send its request, so that a stuck client can't block
+# the server.
+REQUEST_TIMEOUT = 5.
+
+
+def _number(value: float):
+    # NaN and infinities are not valid JSON.
+    return None if value is None or math.isnan(value) or math.isinf(value) else value
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.status.state(), indent=2).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Polled by dashboards: don't write a line to stderr for each request.
+        pass
+
+
+def parse_address(address: str):
+    """
+    (host, port) of "PORT" or "HOST:PORT", or the path of a Unix socket (any address
+    containing a "/").
+    """
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class StatusServer:
+    """
+    Tiny HTTP server, in a daemon thread, serving the live state of the run as JSON on
+    `GET /`: elapsed time, current phase and phase totals, latest metrics, items
+    yielded, resource usage of the process tree, and the recent notifications. Nothing
+    is computed until a client asks, so leaving it on costs a sleeping thread. It is
+    bound to localhost by default, or to a Unix socket.
+    """
+
+    def __init__(self, address: str, host_name: str, func_name: str, start_time: datetime.datetime,
+                 total_steps: int = None):
+        self.address = parse_address(address)
+        self.host_name = host_name
+        self.func_name = func_name
+        self.start_time = start_time
+        self.start_counter = time.perf_counter()
+        self.total_steps = total_steps
+        # Thread running the tracked block, for its current phase.
+        self.thread_id = threading.get_ident()
+        # `knockknock.core.Run` of the block, set by `track`.
+        self.run = None
+        self.events = collections.deque(maxlen=EVENT_LOG_SIZE)
+        self.server = None
+        self.thread = None
+
+    def record(self, send):
+        """
+        `send` (`send_message` or `send_attachments`), also adding each notification
+        to the event log.
+        """
+        def send_and_record(event: str, contents: List[str], *args):
+            self.events.append({'date': datetime.datetime.now().strftime(DATE_FORMAT), 'event': event,
+                                'message': contents[0] if contents else ''})
+            return send(event, contents, *args)
+        return send_and_record
+
+    def start(self):
+        """
+        Start serving. Print a warning and don't serve if the address can't be bound
+        (e.g. a port already in use, or a path that is not a socket).
+        """
+        try:
+            if isinstance(self.address, str):
+                try:
+                    mode = os.stat(self.address).st_mode
+                except FileNotFoundError:
+                    pass
+                else:
+                    if not stat.S_ISSOCK(mode):
+                        raise FileExistsError('the path exists and is not a socket')
+                    # Left by a previous run.
+                    os.unlink(self.address)
+                self.server = socketserver.UnixStreamServer(self.address, StatusHandler)
+            else:
+                self.server = http.server.HTTPServer(self.address, StatusHandler)
+        except OSError as ex:
+            print('knockknock: the status is not served on %s: %s' % (self.address, ex), file=sys.stderr)
+            return
+        self.server.status = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name='knockknock-status', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+        self.server = None
+
+    def state(self) -> dict:
+        from knockknock import metrics, phases
+        state = {'name': self.func_name,
+                 'machine': self.host_name,
+                 'pid': os.getpid(),
+                 'start_date': self.start_time.strftime(DATE_FORMAT),
+                 'elapsed_seconds': time.perf_counter() - self.start_counter,
+                 'phase': phases._store.current(self.thread_id),
+                 'phases': {path: {'calls': calls, 'wall_seconds': wall, 'cpu_seconds': cpu}
+                            for path, (calls, wall, cpu) in list(phases._store.totals.items())}}
+        if self.run is not None and self.run.items is not None:
+            state['items'] = self.run.items
+        store = metrics._store
+        if store.count:
+            state['step'] = store.last_step()
+            state['total_steps'] = self.total_steps
+            state['throughput'] = _number(store.throughput())
+            state['metrics'] = {}
+            for name in list(store.series):
+                latest, smoothed = store.summary(name)
+                state['metrics'][name] = {'latest': _number(latest), 'smoothed': _number(smoothed)}
+        state['resources'] = self.resources()
+        state['events'] = list(self.events)
+        return state
+
+    def resources(self) -> dict:
+        """
+        Resource usage of the process and its live descendants (dataloader workers,
+        command launched by the CLI...).
+        """
+        from knockknock.guard import process_tree_rss
+        from knockknock.stall import process_tree_cpu_time
+        resources = {'threads': threading.active_count(), 'cpu_seconds': process_tree_cpu_time()}
+        try:
+            resources['rss_bytes'] = process_tree_rss(os.getpid())
+        except (OSError, ValueError):
+            pass
+        return resources
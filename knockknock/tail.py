@@ -0,0 +1,214 @@
+import datetime
+import os
+import re
+import socket
+import time
+from typing import List
+
+from knockknock.core import DATE_FORMAT
+
+# Size of the reads from the log file: the file is streamed, never loaded whole.
+CHUNK_SIZE = 1024 * 1024
+# Seconds between two checks of the file when inotify isn't available.
+POLL_INTERVAL = 1.
+# Longest line reported in a notification.
+MAX_LINE_LENGTH = 500
+# Longest unterminated line kept between two reads, longer ones are searched in pieces.
+MAX_PARTIAL_LINE = CHUNK_SIZE
+
+
+class PatternAlert:
+    """
+    Throttled notifications for one pattern: the first match is sent right away, the
+    following ones within `throttle` seconds are counted and summarized in a single
+    notification at the end of the window.
+    """
+
+    def __init__(self, pattern: str, throttle: float):
+        self.pattern = pattern
+        # Searched in chunks of lines: `^` and `$` match at the line boundaries.
+        self.regex = re.compile(pattern.encode(), re.MULTILINE)
+        self.throttle = throttle
+        self.last_sent = None
+        self.pending = 0
+        self.first_pending = None
+        self.last_line = None
+
+    def match(self, line: bytes):
+        self.last_line = line
+        if self.pending == 0:
+            self.first_pending = datetime.datetime.now()
+        self.pending += 1
+
+    def due(self, now: float) -> bool:
+        return self.pending > 0 and (self.last_sent is None or now - self.last_sent >= self.throttle)
+
+    def deadline(self):
+        if not self.pending or self.last_sent is None:
+            return None
+        return self.last_sent + self.throttle
+
+
+class LogTail:
+    """
+    Follow a log file and send a notification when a line matches one of `patterns`.
+
+    New data is detected with inotify (on the file and on its directory, to follow
+    rotations by rename or re-creation, and truncations), or by checking the file
+    every `POLL_INTERVAL` seconds where inotify isn't available. The file is read by
+    chunks and each pattern is searched in the whole chunk, so that following a fast
+    growing multi-GB log stays cheap. Carriage returns (progress bars redrawing their
+    line) end lines too.
+    """
+
+    def __init__(self, path: str, patterns: List[str], send_message,
+                 throttle: float = 60., from_start: bool = False):
+        self.path = os.path.abspath(path)
+        self.alerts = [PatternAlert(pattern, throttle) for pattern in patterns]
+        self.send_message = send_message
+        self.host_name = socket.gethostname()
+        self.file = None
+        self.inode = None
+        self.buffer = b''
+        self.open(from_start)
+
+    def open(self, from_start: bool = True):
+        if self.file is not None:
+            self.file.close()
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self.file = None
+            self.inode = None
+            return
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if not from_start:
+            self.file.seek(0, os.SEEK_END)
+        self.buffer = b''
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read_new_data(self):
+        """
+        Process everything appended to the file since the last call.
+        """
+        if self.file is None:
+            return
+        if os.fstat(self.file.fileno()).st_size < self.file.tell():
+            # Truncated in place (e.g. logrotate's copytruncate).
+            self.file.seek(0)
+            self.buffer = b''
+        while True:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = self.buffer + chunk.replace(b'\r', b'\n')
+            end = data.rfind(b'\n') + 1
+            # Keep the trailing partial line for the next read, unless it is so long that
+            # copying it at every read would cost more than splitting a match.
+            if len(data) - end > MAX_PARTIAL_LINE:
+                end = len(data)
+            self.buffer = data[end:]
+            self.search(data[:end])
+
+    def search(self, data: bytes):
+        for alert in self.alerts:
+            for match in alert.regex.finditer(data):
+                start = data.rfind(b'\n', 0, match.start()) + 1
+                end = data.find(b'\n', match.end())
+                alert.match(data[start:end if end != -1 else len(data)])
+
+    def check_rotation(self):
+        """
+        Reopen the file if it has been replaced (rotated by rename, or deleted and
+        re-created), after draining the old one.
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self.inode:
+            self.read_new_data()
+            self.open(from_start=True)
+            self.read_new_data()
+
+    def flush_alerts(self):
+        now = time.monotonic()
+        for alert in self.alerts:
+            if alert.due(now):
+                self.report(alert)
+                alert.last_sent = now
+                alert.pending = 0
+
+    def next_deadline(self):
+        deadlines = [alert.deadline() for alert in self.alerts]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    def report(self, alert: PatternAlert):
+        line = alert.last_line.decode(errors='replace').rstrip()
+        if len(line) > MAX_LINE_LENGTH:
+            line = line[:MAX_LINE_LENGTH] + '...'
+        contents = ['A pattern matched in your log 🔎',
+                    'Machine name: %s' % self.host_name,
+                    'Log file: %s' % self.path,
+                    'Pattern: %s' % alert.pattern,
+                    'Date: %s' % datetime.datetime.now().strftime(DATE_FORMAT)]
+        if alert.pending > 1:
+            contents.append('Matches: %d since %s' % (alert.pending, alert.first_pending.strftime(DATE_FORMAT)))
+        contents += ['Last matching line:', line]
+        self.send_message('match', contents)
+
+    def follow(self):
+        """
+        Follow the file until interrupted (Ctrl-C).
+        """
+        from knockknock import inotify
+        try:
+            notifier = inotify.Inotify()
+        except OSError:
+            notifier = None
+        if notifier is not None:
+            directory = os.path.dirname(self.path)
+            notifier.add_watch(directory, inotify.IN_MODIFY | inotify.IN_CREATE | inotify.IN_MOVED_TO
+                               | inotify.IN_MOVED_FROM | inotify.IN_DELETE)
+        name = os.path.basename(self.path)
+
+        self.read_new_data()
+        self.flush_alerts()
+        try:
+            while True:
+                deadline = self.next_deadline()
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0.)
+                if notifier is not None:
+                    events = notifier.read_events(timeout)
+                    if any(event.name == name for event in events):
+                        if any(event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM
+                                             | inotify.IN_DELETE) for event in events):
+                            self.check_rotation()
+                        self.read_new_data()
+                    elif any(event.mask & inotify.IN_Q_OVERFLOW for event in events):
+                        self.check_rotation()
+                        self.read_new_data()
+                else:
+                    time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+                    self.check_rotation()
+                    self.read_new_data()
+                self.flush_alerts()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if notifier is not None:
+                notifier.close()
+            self.close()
+
+
+def tail_log(logfile: str, patterns: List[str], send_message, throttle: float = 60., from_start: bool = False):
+    """
+    Follow `logfile` and send a 'match' notification when a line matches one of the
+    regular expressions `patterns`, at most once every `throttle` seconds per pattern.
+    """
+    LogTail(logfile, patterns, send_message, throttle=throttle, from_start=from_start).follow()
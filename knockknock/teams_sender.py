@@ -1,16 +1,16 @@
 from typing import List
-import os
-import datetime
-import traceback
-import functools
 import json
-import socket
 import requests
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+from knockknock.core import PerProcess, picklable_sender, sender_decorator
+from knockknock.preflight import check_reachable
 
+# Maximum length of a Teams message.
+MAX_MESSAGE_LENGTH = 28000
 
-def teams_sender(webhook_url: str, user_mentions: List[str] = []):
+
+@picklable_sender
+def teams_sender(webhook_url: str, user_mentions: List[str] = [], **kwargs):
     """
     team sender wrapper: execute func, send a team notification with the end status
     (sucessfully finished or crashed) at the end. Also send a Slack notification before
@@ -21,6 +21,9 @@ def teams_sender(webhook_url: str, user_mentions: List[str] = []):
         Visit https://docs.microsoft.com/en-us/microsoftteams/platform/concepts/connectors/connectors-using for more details.
     `user_mentions`: List[str] (default=[])
         Optional users ids to notify.
+    `kwargs`:
+        Options shared by all senders (e.g. `sidecar=True`), see
+        `knockknock.core.sender_decorator`.
     """
 
     dump = {
@@ -28,86 +31,26 @@ def teams_sender(webhook_url: str, user_mentions: List[str] = []):
         "icon_emoji": ":clapper:",
     }
 
-    def decorator_sender(func):
-        @functools.wraps(func)
-        def wrapper_sender(*args, **kwargs):
-
-            start_time = datetime.datetime.now()
-            host_name = socket.gethostname()
-            func_name = func.__name__
-
-            # Handling distributed training edge case.
-            # In PyTorch, the launch of `torch.distributed.launch` sets up a RANK environment variable for each process.
-            # This can be used to detect the master process.
-            # See https://github.com/pytorch/pytorch/blob/master/torch/distributed/launch.py#L211
-            # Except for errors, only the master process will send notifications.
-            if 'RANK' in os.environ:
-                master_process = (int(os.environ['RANK']) == 0)
-                host_name += ' - RANK: %s' % os.environ['RANK']
-            else:
-                master_process = True
-
-            if master_process:
-                contents = ['Your training has started 🎬',
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(DATE_FORMAT)]
-                contents.append(' '.join(user_mentions))
-                dump['text'] = '\n'.join(contents)
-                dump['icon_emoji'] = ':clapper:'
-                requests.post(webhook_url, json.dumps(dump))
-
-            try:
-                value = func(*args, **kwargs)
-
-                if master_process:
-                    end_time = datetime.datetime.now()
-                    elapsed_time = end_time - start_time
-                    contents = ["Your training is complete 🎉",
-                                'Machine name: %s' % host_name,
-                                'Main call: %s' % func_name,
-                                'Starting date: %s' % start_time.strftime(
-                                    DATE_FORMAT),
-                                'End date: %s' % end_time.strftime(
-                                    DATE_FORMAT),
-                                'Training duration: %s' % str(elapsed_time)]
-
-                    try:
-                        str_value = str(value)
-                        contents.append(
-                            'Main call returned value: %s' % str_value)
-                    except:
-                        contents.append('Main call returned value: %s' %
-                                        "ERROR - Couldn't str the returned value.")
-
-                    contents.append(' '.join(user_mentions))
-                    dump['text'] = '\n'.join(contents)
-                    dump['icon_emoji'] = ':tada:'
-                    requests.post(webhook_url, json.dumps(dump))
-
-                return value
-
-            except Exception as ex:
-                end_time = datetime.datetime.now()
-                elapsed_time = end_time - start_time
-                contents = ["Your training has crashed ☠️",
-                            'Machine name: %s' % host_name,
-                            'Main call: %s' % func_name,
-                            'Starting date: %s' % start_time.strftime(
-                                DATE_FORMAT),
-                            'Crash date: %s' % end_time.strftime(DATE_FORMAT),
-                            'Crashed training duration: %s\n\n' % str(
-                                elapsed_time),
-                            "Here's the error:",
-                            '%s\n\n' % ex,
-                            "Traceback:",
-                            '%s' % traceback.format_exc()]
-                contents.append(' '.join(user_mentions))
-                dump['text'] = '\n'.join(contents)
-                dump['icon_emoji'] = ':skull_and_crossbones:'
-                requests.post(webhook_url, json.dumps(dump))
-                raise ex
-
-        return wrapper_sender
-
-    return decorator_sender
+    icons = {'start': ':clapper:',
+             'complete': ':tada:',
+             'crash': ':skull_and_crossbones:',
+             'died': ':skull_and_crossbones:',
+             'stall': ':hourglass:',
+             'resume': ':arrow_forward:',
+             'progress': ':runner:',
+             'match': ':mag:',
+             'checkpoint': ':floppy_disk:',
+             'memory': ':chart_with_upwards_trend:',
+             'log': ':warning:'}
+
+    session = PerProcess(requests.Session)
+
+    def send_message(event: str, contents: List[str]):
+        contents = contents + [' '.join(user_mentions)]
+        payload = dict(dump, text='\n'.join(contents), icon_emoji=icons.get(event, ':bell:'))
+        session.get().post(webhook_url, json.dumps(payload))
+
+    def check(timeout: float):
+        check_reachable(session.get(), webhook_url, timeout)
+
+    return sender_decorator(send_message, max_length=MAX_MESSAGE_LENGTH, check=check, **kwargs)
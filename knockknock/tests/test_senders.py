@@ -2,9 +2,88 @@
 Unittests
 To run the tests: `python -m unittest discover -v knockknock.tests`
 """
+import asyncio
+import email
+import gzip
+import http.server
+import importlib
+import io
+import json
+import logging
+import pickle
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import tracemalloc
+import types
 import unittest
+from unittest import mock
+
+import requests
+
+from knockknock import heartbeat, log, phase
+from knockknock.core import Message, PerProcess, sender_decorator, track
+from knockknock.desktop_sender import desktop_sender, DBusNotifier
+from knockknock.discord_sender import discord_sender
+from knockknock.fingerprint import CrashIndex, fingerprint
+from knockknock.guard import GuardError, parse_size, run_guarded
+from knockknock.distributed import gather_rank_timings, get_job_id, get_rank, report_rank_timing
+from knockknock.history import RunHistory
+from knockknock.__main__ import main
+from knockknock.log_handler import KnockKnockHandler
+from knockknock.metrics import MetricsStore
+from knockknock.notifier import MultiNotifier, Notifier, SlackNotifier
+from knockknock.parallel import parallel_map
+from knockknock.pool import run_commands
+from knockknock import routing
+from knockknock.routing import Route, RoutingNotifier
+from knockknock.preflight import PreflightError, check_backends
+from knockknock.progress_bars import MAX_BARS, TqdmProgress, describe
+from knockknock.matrix_sender import matrix_sender
+from knockknock.slack_sender import slack_sender
+from knockknock.statsd_sender import statsd_sender
+from knockknock.tail import MAX_PARTIAL_LINE, LogTail
+from knockknock.watch import WatchedProcess, watch_pids
+
+
+class FakeNotificationServer(threading.Thread):
+    """
+    Minimal `org.freedesktop.Notifications` service registered on a local bus,
+    recording every `Notify` call it answers.
+    """
+
+    def __init__(self, bus_address):
+        super().__init__(daemon=True)
+        from jeepney.bus_messages import message_bus
+        from jeepney.io.blocking import open_dbus_connection
+        self.connection = open_dbus_connection(bus=bus_address)
+        self.connection.send_and_get_reply(message_bus.RequestName("org.freedesktop.Notifications"))
+        self.calls = []
+
+    def run(self):
+        from jeepney import MessageType, new_method_return
+        from jeepney.low_level import HeaderFields
+        while True:
+            try:
+                message = self.connection.receive()
+            except (ConnectionError, OSError, ValueError):
+                # The connection was closed by `tearDown`.
+                return
+            if message.header.message_type != MessageType.method_call:
+                continue
+            if message.header.fields.get(HeaderFields.member) == "Notify":
+                self.calls.append(message.body)
+                replaces_id = message.body[1]
+                notification_id = replaces_id or len(self.calls)
+                self.connection.send(new_method_return(message, "u", (notification_id,)))
 
-from knockknock.desktop_sender import desktop_sender
 
 class TestSenders(unittest.TestCase):
 
@@ -16,5 +95,1056 @@ class TestSenders(unittest.TestCase):
             return {"loss": 1}
         self.assertEqual(train(), {"loss": 1})
 
+
+@unittest.skipUnless(shutil.which("dbus-daemon"), "requires dbus-daemon")
+class TestDBusNotifier(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.daemon = subprocess.Popen(
+            ["dbus-daemon", "--session", "--nofork", "--print-address"],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        cls.bus_address = cls.daemon.stdout.readline().strip()
+        cls.previous_address = os.environ.get("DBUS_SESSION_BUS_ADDRESS")
+        os.environ["DBUS_SESSION_BUS_ADDRESS"] = cls.bus_address
+        importlib.import_module("knockknock.desktop_sender")._notifier = None
+
+    @classmethod
+    def tearDownClass(cls):
+        module = importlib.import_module("knockknock.desktop_sender")
+        if isinstance(module._notifier, DBusNotifier):
+            module._notifier.close()
+        module._notifier = None
+        cls.daemon.terminate()
+        cls.daemon.wait()
+        cls.daemon.stdout.close()
+        if cls.previous_address is None:
+            os.environ.pop("DBUS_SESSION_BUS_ADDRESS", None)
+        else:
+            os.environ["DBUS_SESSION_BUS_ADDRESS"] = cls.previous_address
+
+    def start_server(self):
+        server = FakeNotificationServer(self.bus_address)
+        server.start()
+        self.addCleanup(server.connection.close)
+        return server
+
+    def test_dbus_notifier_updates_in_place(self):
+        server = self.start_server()
+        notifier = DBusNotifier(bus=self.bus_address)
+        notification_id = notifier.notify("knockknock", "started")
+        self.assertEqual(notifier.notify("knockknock", "complete", replaces_id=notification_id),
+                         notification_id)
+        notifier.close()
+        self.assertEqual([call[1] for call in server.calls], [0, notification_id])
+        self.assertEqual([call[4] for call in server.calls], ["started", "complete"])
+
+    def test_bus_without_notification_server(self):
+        @desktop_sender(title="Test Desktop")
+        def train():
+            return {"loss": 1}
+
+        with mock.patch("subprocess.run") as run, mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.assertEqual(train(), {"loss": 1})
+        self.assertIn("no D-Bus notification server", stderr.getvalue())
+        # notify-send for the start and the completion, the bus was only tried once.
+        self.assertEqual(stderr.getvalue().count("notify-send"), 1)
+        self.assertEqual([call[0][0][:2] for call in run.call_args_list], [["notify-send", "Test Desktop"]] * 2)
+
+
+class TestSidecar(unittest.TestCase):
+
+    SCRIPT = textwrap.dedent("""
+        import os, signal, sys
+        from knockknock.core import Message, PerProcess, sender_decorator, track
+
+        def send_message(event, contents):
+            with open(sys.argv[1], "a") as f:
+                f.write(event + "\\n")
+
+        @sender_decorator(send_message, sidecar=True)
+        def train():
+            %s
+
+        train()
+        """)
+
+    def run_train(self, body):
+        events_file = os.path.join(self.tmp_dir.name, "events")
+        process = subprocess.run([sys.executable, "-c", self.SCRIPT % body, events_file], timeout=30)
+        return process.returncode, events_file
+
+    def read_events(self, events_file, expected_count):
+        # The orphaned sidecar reports after the parent is gone.
+        deadline = time.time() + 10
+        while True:
+            with open(events_file) as f:
+                events = f.read().split()
+            if len(events) >= expected_count or time.time() > deadline:
+                return events
+            time.sleep(0.1)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sidecar_reports_hard_exit(self):
+        returncode, events_file = self.run_train("os._exit(3)")
+        self.assertEqual(returncode, 3)
+        self.assertEqual(self.read_events(events_file, 2), ["start", "died"])
+
+    def test_sigterm_is_reported_once(self):
+        returncode, events_file = self.run_train("os.kill(os.getpid(), signal.SIGTERM)")
+        self.assertEqual(returncode, -signal.SIGTERM)
+        time.sleep(1)
+        self.assertEqual(self.read_events(events_file, 2), ["start", "crash"])
+
+
+class TestStallWatchdog(unittest.TestCase):
+
+    def test_stall_is_reported_with_stacks(self):
+        events = []
+
+        @sender_decorator(lambda event, contents: events.append((event, contents)),
+                          stall_timeout=0.4, stall_detection="heartbeat", max_length=4000)
+        def train():
+            for _ in range(5):
+                heartbeat()
+                time.sleep(0.05)
+            time.sleep(1.5)
+            for _ in range(10):
+                heartbeat()
+                time.sleep(0.05)
+
+        train()
+        self.assertEqual([event for event, _ in events], ["start", "stall", "resume", "complete"])
+        stall_message = "\n".join(events[1][1])
+        self.assertIn("in train", stall_message)
+        self.assertLessEqual(len(stall_message), 4000)
+
+
+class TestGuard(unittest.TestCase):
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "/proc is Linux only")
+    def test_memory_warning_and_timeout(self):
+        self.assertEqual(parse_size("1.5G"), 3 * 1024 ** 3 // 2)
+        messages = []
+        with mock.patch("knockknock.guard.SAMPLE_INTERVAL", 0.1):
+            with self.assertRaisesRegex(GuardError, "--timeout"):
+                run_guarded(["sleep", "10"], lambda event, contents: messages.append((event, contents)),
+                            "sleep", warn_rss=1, timeout=0.5)
+        self.assertEqual([event for event, _ in messages], ["memory"])
+        self.assertTrue(any(line.startswith("Resident memory: ") for line in messages[0][1]))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_log_in_completion_message(self):
+        events = []
+
+        @sender_decorator(lambda event, contents: events.append((event, contents)), total_steps=10000)
+        def train():
+            for step in range(5000):
+                log(step=step + 1, loss=1. / (step + 1))
+            return step
+
+        train()
+        complete = "\n".join(events[-1][1])
+        self.assertIn("Last logged step: 5000/10000", complete)
+        self.assertIn("loss: 0.0002 (smoothed:", complete)
+        self.assertIn("steps/s", complete)
+        self.assertIn("ETA:", complete)
+
+    def test_nested_run_keeps_outer_metrics(self):
+        events = []
+        send = lambda event, contents: events.append((event, contents))
+
+        @sender_decorator(send)
+        def evaluate():
+            log(accuracy=0.9)
+
+        @sender_decorator(send)
+        def train():
+            with phase("epoch"):
+                log(step=1, loss=0.5)
+                evaluate()
+
+        train()
+        complete = "\n".join(events[-1][1])
+        self.assertIn("loss: 0.5", complete)
+        self.assertIn("accuracy: 0.9", complete)
+        self.assertIn("    epoch: ", complete)
+
+    def test_ring_buffer_memory_is_constant(self):
+        store = MetricsStore(size=8)
+        for step in range(100):
+            store.log(loss=float(step))
+        values, count = store.series["loss"]
+        self.assertEqual((len(values), count), (8, 100))
+        self.assertEqual(store.summary("loss"), (99., sum(range(92, 100)) / 8))
+
+
+class TestPhases(unittest.TestCase):
+
+    def test_phase_breakdown_in_completion_message(self):
+        messages = []
+
+        @phase("eval")
+        def evaluate():
+            time.sleep(0.01)
+
+        @sender_decorator(lambda event, contents: messages.append(contents))
+        def train():
+            for _ in range(3):
+                with phase("epoch"):
+                    with phase("data"):
+                        pass
+                    evaluate()
+
+        train()
+        breakdown = messages[-1][messages[-1].index("Phases:") + 1:]
+        self.assertEqual([line.split(":")[0] for line in breakdown], ["    epoch", "        data", "        eval"])
+        self.assertRegex(breakdown[2], r"^        eval: 0\.0\d\ds \(\d+\.\d%\), 3 calls, CPU ")
+
+
+class TestLogHandler(unittest.TestCase):
+
+    def test_records_are_grouped(self):
+        messages = []
+        handler = KnockKnockHandler(lambda event, contents: messages.append((event, contents)), flush_size=4)
+        logger = logging.getLogger("knockknock.tests.trainer")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        logger.info("step done")
+        for batch in range(3):
+            logger.warning("skipping batch %d", batch)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("gradient overflow")
+        logger.warning("skipping batch %d", 3)
+        handler.close()
+
+        self.assertEqual([event for event, _ in messages], ["log", "log"])
+        contents = messages[0][1]
+        self.assertEqual(contents[0], "Your training logged 4 warnings or errors ⚠️")
+        self.assertTrue(contents[3].startswith("[WARNING] knockknock.tests.trainer: skipping batch 2 (x3, last at "))
+        self.assertEqual(contents[4], "[ERROR] knockknock.tests.trainer: gradient overflow")
+        self.assertIn("ZeroDivisionError", contents[-1])
+        self.assertEqual(messages[1][1][3], "[WARNING] knockknock.tests.trainer: skipping batch 3")
+
+
+class TestStatus(unittest.TestCase):
+
+    def test_status_is_served(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        address = os.path.join(directory, "status.sock")
+
+        def get_status():
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(address)
+                client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+                response = b""
+                while True:
+                    chunk = client.recv(65536)
+                    if not chunk:
+                        break
+                    response += chunk
+            return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+        @sender_decorator(lambda event, contents: None, status_address=address, total_steps=10)
+        def train():
+            log(loss=0.5)
+            with phase("eval"):
+                return get_status()
+
+        state = train()
+        self.assertEqual(state["name"], "train")
+        self.assertEqual(state["phase"], "eval")
+        self.assertEqual(state["metrics"]["loss"], {"latest": 0.5, "smoothed": 0.5})
+        self.assertEqual([event["event"] for event in state["events"]], ["start"])
+        self.assertIn("cpu_seconds", state["resources"])
+        self.assertFalse(os.path.exists(address))
+
+        # Anything else than a socket at the address is left alone.
+        with open(address, "w") as f:
+            f.write("precious")
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            with self.assertRaises(OSError):
+                train()
+        self.assertIn("is not a socket", stderr.getvalue())
+        with open(address) as f:
+            self.assertEqual(f.read(), "precious")
+
+
+class TestAllocations(unittest.TestCase):
+
+    def test_memory_error_reports_allocations(self):
+        messages = []
+
+        @sender_decorator(lambda event, contents: messages.append((event, contents)), trace_allocations=1,
+                          allocation_interval=0.05)
+        def train():
+            buffers = [bytearray(1024 * 1024)]
+            time.sleep(0.2)
+            buffers += [bytearray(1024 * 1024) for _ in range(4)]
+            raise MemoryError()
+
+        with self.assertRaises(MemoryError):
+            train()
+        contents = messages[-1][1]
+        top = contents[contents.index("Top allocations:") + 1]
+        self.assertRegex(top, r"test_senders\.py:\d+: 4\.\d MiB \(\d+ blocks\)$")
+        self.assertTrue(any(line.startswith("Growth since ") for line in contents))
+        self.assertFalse(tracemalloc.is_tracing())
+
+        # Still short of memory while describing the allocations.
+        messages.clear()
+        with mock.patch.object(tracemalloc.Snapshot, "statistics", side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                train()
+        self.assertTrue(messages[-1][1][-1].startswith("Traceback"))
+        self.assertIn("Top allocations not available: out of memory", messages[-1][1])
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_checkpoints_are_reported(self):
+        messages = []
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        @sender_decorator(lambda event, contents: messages.append((event, contents)), watch_dir=directory)
+        def train():
+            os.mkdir(os.path.join(directory, "checkpoint-1"))
+            for name in ("model.bin", "optimizer.bin"):
+                path = os.path.join(directory, "checkpoint-1", name)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(b"\0" * 1024 * 1024)
+                os.rename(path + ".tmp", path)
+
+        with mock.patch("knockknock.checkpoints.SETTLE_TIME", 0.2):
+            train()
+        events = [event for event, _ in messages]
+        self.assertEqual(events.count("checkpoint"), 1)
+        contents = messages[events.index("checkpoint")][1]
+        self.assertIn("Files: checkpoint-1/model.bin, checkpoint-1/optimizer.bin", contents)
+        self.assertIn("Size: 2.0 MiB", contents)
+        self.assertTrue(any(line.startswith("Free space: ") for line in contents))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_snapshot_in_crash_message(self):
+        messages = []
+
+        @sender_decorator(lambda event, contents: messages.append((event, contents)), system_snapshot="always")
+        def train():
+            raise ValueError("diverged")
+
+        with self.assertRaises(ValueError):
+            train()
+        for event, contents in messages:
+            self.assertIn("System snapshot:", contents, event)
+            if sys.platform.startswith("linux"):
+                self.assertTrue(any(line.startswith("    Memory available: ") for line in contents))
+                self.assertTrue(any(line.startswith("    Open file descriptors: ") for line in contents))
+
+        # No thread left: the notification is sent without the snapshot.
+        messages.clear()
+        with mock.patch("threading.Thread.start", side_effect=RuntimeError("can't start new thread")):
+            with self.assertRaises(ValueError):
+                train()
+        self.assertEqual([event for event, _ in messages], ["start", "crash"])
+        self.assertNotIn("System snapshot:", messages[-1][1])
+
+
+class TestRunHistory(unittest.TestCase):
+
+    def test_expected_duration_and_regression(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "history.sqlite")
+            history = RunHistory(path)
+            for i in range(10):
+                history.start("train", "train.py", "host", 0, 1000. * i)
+                history.finish("complete", 100. + i)
+            history.close()
+
+            events = []
+
+            @sender_decorator(lambda event, contents: events.append((event, contents)),
+                              history=path, command=["train.py"])
+            def train():
+                time.sleep(0.2)
+
+            with mock.patch("socket.gethostname", return_value="host"):
+                train()
+            self.assertIn("Expected duration: 0:01:44 (median of the last 10 runs)", events[0][1])
+
+            history = RunHistory(path)
+            self.assertTrue(history.regression([100. + i for i in range(10)], 150.)[0].startswith(
+                "⚠️ Duration regression: 0:02:30 is above the 90th percentile"))
+            self.assertEqual(history.regression([100. + i for i in range(10)], 105.), [])
+            rows = history.query(func_name="train", limit=1)
+            self.assertEqual((rows[0]["status"], rows[0]["host"]), ("complete", "host"))
+            history.close()
+
+    def test_failed_setup_is_undone(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            open(os.path.join(tmp_dir, "afile"), "w").close()
+            address = os.path.join(tmp_dir, "status.sock")
+            options = dict(status_address=address, trace_allocations=1, stall_timeout=60, progress_interval=60)
+            with self.assertRaises(OSError):
+                with track(lambda event, contents: None, "train",
+                           history=os.path.join(tmp_dir, "afile", "x.db"), **options):
+                    pass
+            with mock.patch("knockknock.metrics.ProgressReporter.start", side_effect=RuntimeError("no thread")):
+                with self.assertRaises(RuntimeError):
+                    with track(lambda event, contents: None, "train", **options):
+                        pass
+            self.assertFalse(tracemalloc.is_tracing())
+            self.assertFalse(os.path.exists(address))
+            self.assertEqual([thread.name for thread in threading.enumerate() if thread.name.startswith("knockknock")],
+                             [])
+
+
+class TestDistributed(unittest.TestCase):
+
+    def test_rank_discovery(self):
+        for environ, rank in [({}, None),
+                              ({"RANK": "3", "SLURM_PROCID": "5"}, 3),
+                              ({"SLURM_PROCID": "5"}, 5),
+                              ({"OMPI_COMM_WORLD_RANK": "2"}, 2),
+                              ({"PMI_RANK": "1"}, 1),
+                              ({"LOCAL_RANK": "4", "WORLD_SIZE": "8"}, 4),
+                              ({"LOCAL_RANK": "4"}, None)]:
+            with mock.patch.dict(os.environ, environ, clear=True):
+                self.assertEqual(get_rank(), rank, environ)
+
+    def test_rank_timings_breakdown(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for rank, duration in enumerate([10., 12., 11., 30.]):
+                report_rank_timing(tmp_dir, "job", rank, duration, "complete")
+            contents = gather_rank_timings(tmp_dir, "job", world_size=5, timeout=1)
+        self.assertEqual(contents[0], "Per-rank durations (4/5 ranks): min 10.0s, median 11.5s, max 30.0s")
+        self.assertTrue(contents[1].startswith("Slowest ranks: rank 3 on "))
+        self.assertEqual(contents[2], "Ranks without timing after 1s: 4")
+
+    def test_stale_rank_timings(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Left by a previous attempt of the job.
+            report_rank_timing(tmp_dir, "job", 1, 50., "complete")
+            stale = os.path.join(tmp_dir, "job", "rank-1.json")
+            os.utime(stale, (time.time() - 3600, time.time() - 3600))
+            report_rank_timing(tmp_dir, "job", 0, 10., "complete")
+            contents = gather_rank_timings(tmp_dir, "job", world_size=2, timeout=0, start_time=time.time() - 60)
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, "job")))
+        self.assertEqual(contents[0], "Per-rank durations (1/2 ranks): min 10.0s, median 10.0s, max 10.0s")
+        self.assertEqual(contents[2], "Ranks without timing after 0s: 1")
+
+    def test_job_id(self):
+        with mock.patch.dict(os.environ, {"SLURM_JOB_ID": "42", "SLURM_RESTART_COUNT": "1"}, clear=True):
+            self.assertEqual(get_job_id("train"), "train-42-restart1")
+        with mock.patch.dict(os.environ, {"MASTER_ADDR": "node1", "MASTER_PORT": "29500"}, clear=True):
+            self.assertEqual(get_job_id("train"), "train-node1-29500")
+        # The host name differs on each node, the ranks would never meet.
+        with mock.patch.dict(os.environ, {"RANK": "0"}, clear=True):
+            self.assertIsNone(get_job_id("train"))
+
+
+@unittest.skipUnless(os.path.isdir("/proc/self"), "requires /proc")
+class TestWatch(unittest.TestCase):
+
+    def test_watch_many_pids(self):
+        events = []
+        ok = subprocess.Popen(["sleep", "0.5"])
+        failed = subprocess.Popen(["sh", "-c", "sleep 1; exit 3"])
+        killed = subprocess.Popen(["sleep", "30"])
+        threading.Timer(0.2, killed.kill).start()
+        watch_pids([ok.pid, failed.pid, killed.pid],
+                   lambda event, contents: events.append((event, contents)), poll_interval=0.1)
+        for process in (ok, failed, killed):
+            process.wait()
+
+        self.assertEqual(events[0][0], "start")
+        reports = {contents[3]: (event, contents[-1]) for event, contents in events[1:]}
+        self.assertEqual(reports, {"Process id: %d" % ok.pid: ("complete", "Exit status: 0"),
+                                   "Process id: %d" % failed.pid: ("crash", "Exit status: 3"),
+                                   "Process id: %d" % killed.pid: ("crash", "Exit status: killed by SIGKILL")})
+
+    def test_stale_pids_and_unknown_status(self):
+        events = []
+        gone = subprocess.Popen(["true"])
+        gone.wait()
+        running = subprocess.Popen(["sleep", "0.2"])
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            watch_pids([gone.pid, running.pid], lambda event, contents: events.append((event, contents)),
+                       poll_interval=0.1)
+        running.wait()
+        self.assertIn("No process with pid %d. Not watched." % gone.pid, stderr.getvalue())
+        self.assertEqual([event for event, _ in events], ["start", "complete"])
+        with self.assertRaises(ProcessLookupError):
+            watch_pids([gone.pid], lambda event, contents: None)
+
+        # Reaped by its parent before its exit status could be read.
+        process = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        watched = WatchedProcess(process.pid)
+        self.addCleanup(watched.close)
+        watched.report(lambda event, contents: events.append((event, contents)), "host", None)
+        self.assertEqual(events[-1][0], "exit")
+        self.assertEqual(events[-1][1][0], "Your training has exited, its outcome is unknown ❔")
+
+
+class TestTail(unittest.TestCase):
+
+    def test_tail_rotation_and_throttling(self):
+        events = []
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "train.log")
+        with open(path, "w") as f:
+            f.write("step 1 loss=nan\n")
+        tail = LogTail(path, [r"loss=nan", r"CUDA error"],
+                       lambda event, contents: events.append((event, contents)), throttle=3600.)
+        self.addCleanup(tail.close)
+
+        with open(path, "a") as f:
+            f.write("step 2 loss=1.0\nstep 3 loss=nan\nstep 4 loss=na")
+        tail.read_new_data()
+        tail.flush_alerts()
+        # Throttled: counted, not sent.
+        with open(path, "a") as f:
+            f.write("n\nstep 5 loss=nan\n")
+        tail.read_new_data()
+        tail.flush_alerts()
+        # Rotation: the end of the old file is drained, then the new one is read.
+        os.rename(path, path + ".1")
+        with open(path, "w") as f:
+            f.write("CUDA error: out of memory\n")
+        tail.check_rotation()
+        tail.flush_alerts()
+
+        self.assertEqual([event for event, _ in events], ["match", "match"])
+        self.assertIn("Pattern: loss=nan", events[0][1])
+        self.assertEqual(events[0][1][-1], "step 3 loss=nan")
+        self.assertEqual(events[1][1][-1], "CUDA error: out of memory")
+        self.assertEqual(tail.alerts[0].pending, 2)
+        self.assertEqual(tail.next_deadline(), tail.alerts[0].last_sent + 3600.)
+
+    def test_tail_carriage_returns_and_anchors(self):
+        events = []
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "train.log")
+        open(path, "w").close()
+        tail = LogTail(path, [r"^Traceback", r"nan$"],
+                       lambda event, contents: events.append((event, contents)))
+        self.addCleanup(tail.close)
+
+        with open(path, "w") as f:
+            f.write("epoch 1:  10%\repoch 1:  20%\rloss is not nan yet\r")
+            f.write("=" * (MAX_PARTIAL_LINE // 2) + "\rin this Traceback\n")
+        tail.read_new_data()
+        # Redrawn lines are not kept until the next newline.
+        with open(path, "a") as f:
+            f.write("=" * (MAX_PARTIAL_LINE + 1))
+        tail.read_new_data()
+        self.assertEqual(tail.buffer, b"")
+        with open(path, "a") as f:
+            f.write("\nTraceback (most recent call last):\n")
+        tail.read_new_data()
+        tail.flush_alerts()
+
+        self.assertEqual([contents[-1] for _, contents in events],
+                         ["Traceback (most recent call last):"])
+        self.assertEqual(tail.alerts[1].pending, 0)
+
+
+class TestPool(unittest.TestCase):
+
+    def test_run_commands(self):
+        events = []
+        commands = [["true"], ["sh", "-c", "exit 2"], ["sleep", "0.2"]]
+        self.assertFalse(run_commands(commands, lambda event, contents: events.append((event, contents)), jobs=2))
+        self.assertEqual([event for event, _ in events], ["start", "crash", "crash"])
+        self.assertIn("Exit status: 2", events[1][1])
+        self.assertIn("Status: 2 complete, 1 failed", events[2][1])
+        self.assertTrue(events[2][1][-3].startswith("failed (2) | "))
+
+    def test_fail_fast(self):
+        events = []
+        commands = [["sh", "-c", "sleep 0.2; exit 1"], ["sleep", "30"], ["true"]]
+        start = time.time()
+        self.assertFalse(run_commands(commands, lambda event, contents: events.append((event, contents)),
+                                      jobs=2, fail_fast=True))
+        self.assertLess(time.time() - start, 10)
+        self.assertIn("Status: 1 failed, 1 killed, 1 cancelled", events[-1][1])
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def test_subcommands_with_global_options(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        textfile = os.path.join(directory, "cli.prom")
+        commands_file = os.path.join(directory, "commands.txt")
+        with open(commands_file, "w") as f:
+            f.write("true\n")
+        sender = ["statsd", "--no-udp", "--textfile", textfile]
+        options = ["--timeout", "60", "--max-rss", "100G"]
+
+        process = subprocess.Popen(["sleep", "0.2"])
+        with mock.patch.object(sys, "argv", ["knockknock", "watch", str(process.pid)] + sender):
+            main()
+        process.wait()
+        with mock.patch.object(sys, "argv", ["knockknock", "run", "--commands-file", commands_file] + sender):
+            main()
+        with mock.patch("knockknock.__main__.tail_log") as tail_log:
+            with mock.patch.object(sys, "argv", ["knockknock", "tail", "train.log", "--pattern", "nan"] + sender):
+                main()
+        self.assertEqual(tail_log.call_args[1]["patterns"], ["nan"])
+        with mock.patch.object(sys, "argv", ["knockknock"] + options + sender + ["true"]):
+            main()
+
+        with open(textfile) as f:
+            metrics = f.read()
+        self.assertIn('knockknock_events_total{job="sleep 0.2",event="complete"} 1.0', metrics)
+        self.assertIn('knockknock_events_total{job="true",event="complete"} 1.0', metrics)
+
+    def test_guard_options(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        textfile = os.path.join(directory, "cli.prom")
+        sender = ["statsd", "--no-udp", "--textfile", textfile]
+
+        # The guard only applies to a command run by knockknock.
+        for subcommand in (["watch", "1"], ["run", "--commands-file", "commands.txt"], ["tail", "train.log", "--pattern", "nan"]):
+            with mock.patch.object(sys, "argv", ["knockknock", "--timeout", "60"] + subcommand + sender), \
+                    mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                with self.assertRaises(SystemExit):
+                    main()
+            self.assertIn("--timeout only apply to a command run by knockknock", stderr.getvalue())
+
+        # Its messages are sent like the ones of `track`, with the fields of the run.
+        def run_guarded(command, send_message, func_name, **kwargs):
+            send_message("memory", ["Your training is using a lot of memory."])
+        with mock.patch("knockknock.__main__.run_guarded", side_effect=run_guarded), \
+                mock.patch.object(sys, "argv", ["knockknock", "--warn-rss", "1G"] + sender + ["true"]):
+            main()
+        with open(textfile) as f:
+            metrics = f.read()
+        self.assertIn('knockknock_events_total{job="true",event="memory"} 1.0', metrics)
+
+
+class TestStatsd(unittest.TestCase):
+
+    def test_udp_datagrams_and_textfile(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        textfile = os.path.join(directory, "train.prom")
+
+        @statsd_sender(host="127.0.0.1", port=server.getsockname()[1], textfile=textfile)
+        def train():
+            return 1
+
+        train()
+        train()
+        self.assertEqual(server.recv(1024), b"knockknock.train.start:1|c")
+        completion = server.recv(1024).decode().split("\n")
+        self.assertEqual(completion[0], "knockknock.train.complete:1|c")
+        self.assertRegex(completion[1], r"^knockknock\.train\.complete\.duration:\d+\|ms$")
+        with open(textfile) as f:
+            metrics = f.read()
+        self.assertIn("# TYPE knockknock_events_total counter", metrics)
+        self.assertIn('knockknock_events_total{job="train",event="complete"} 2.0', metrics)
+        self.assertIn('knockknock_last_duration_seconds{job="train",event="complete"}', metrics)
+
+        # The fields of the message, not its text, name the metric, even once pickled
+        # and with lines appended.
+        for _ in range(2):
+            # Datagrams of the second run.
+            server.recv(1024)
+        sender = statsd_sender(host="127.0.0.1", port=server.getsockname()[1])
+        message = pickle.loads(pickle.dumps(Message(["Done"], func_name="eval", duration=1.5))) + ["Note"]
+        sender.send_message("complete", message)
+        self.assertEqual(server.recv(1024), b"knockknock.eval.complete:1|c\nknockknock.eval.complete.duration:1500|ms")
+
+
+class ListNotifier(Notifier):
+    """
+    `Notifier` recording its notifications in `events`.
+    """
+
+    @staticmethod
+    def sender_func(events, fail=False, **kwargs):
+        def send_message(event, contents):
+            if fail:
+                raise ConnectionError("backend down")
+            events.append((event, contents))
+        return sender_decorator(send_message, **kwargs)
+
+
+class TestProgressBars(unittest.TestCase):
+
+    @unittest.skipUnless(importlib.util.find_spec("tqdm"), "tqdm is not installed")
+    def test_tqdm_bars_in_messages(self):
+        import tqdm
+        messages = []
+
+        @sender_decorator(lambda event, contents: messages.append((event, contents)), progress="tqdm")
+        def train():
+            for _ in tqdm.tqdm(range(50), desc="eval", file=io.StringIO()):
+                pass
+            bar = tqdm.tqdm(total=100, desc="train", file=io.StringIO())
+            self.addCleanup(bar.close)
+            bar.update(25)
+            raise ValueError("diverged")
+
+        with self.assertRaises(ValueError):
+            train()
+        contents = messages[-1][1]
+        bars = contents[contents.index("Progress bars:") + 1:contents.index("Progress bars:") + 3]
+        self.assertTrue(bars[0].startswith("    eval: 50/50 (100%), "), bars)
+        self.assertTrue(bars[1].startswith("    train: 25/100 (25%)"), bars)
+
+    def test_describe_and_closed_bars_are_bounded(self):
+        bar = types.SimpleNamespace(format_dict={"n": 30, "total": 120, "elapsed": 15., "rate": 2.,
+                                                 "prefix": "train", "unit": "it"})
+        self.assertEqual(describe(bar), "train: 30/120 (25%), 2 it/s, ETA 0:00:45")
+        self.assertEqual(describe(bar, closed=True), "train: 30/120 (25%), 2 it/s, took 0:00:15")
+
+        class FakeTqdm:
+            disable = False
+
+            def __init__(self, desc):
+                self.desc = desc
+                self.format_dict = {"n": 1, "total": None, "elapsed": 1., "prefix": desc}
+
+            def close(self):
+                self.disable = True
+
+        fake_std = types.ModuleType("tqdm.std")
+        fake_std.tqdm = FakeTqdm
+        progress = TqdmProgress()
+        with mock.patch.dict(sys.modules, {"tqdm": types.ModuleType("tqdm"), "tqdm.std": fake_std}):
+            progress.start()
+        self.addCleanup(progress.stop)
+        # A new description per bar, e.g. one per shard.
+        for shard in range(MAX_BARS + 5):
+            FakeTqdm("shard %d" % shard).close()
+        self.assertEqual(len(progress.closed), MAX_BARS)
+        self.assertEqual(progress.format()[1], "    shard 5: 1, 1 it/s, took 0:00:01")
+
+
+class TestNotifier(unittest.TestCase):
+
+    def test_track_and_send(self):
+        events = []
+        notifier = MultiNotifier(ListNotifier(events, max_length=100), ListNotifier([], fail=True))
+        self.assertEqual(notifier.options["max_length"], 100)
+        with mock.patch("sys.stderr"):
+            with notifier.track("eval"):
+                pass
+            with self.assertRaises(ValueError):
+                with notifier.track("eval"):
+                    raise ValueError("diverged")
+            notifier.send("checkpoint", "Checkpoint saved", step=3)
+
+        self.assertEqual([event for event, _ in events], ["start", "complete", "start", "crash", "checkpoint"])
+        self.assertIn("Main call: eval", events[1][1])
+        self.assertFalse(any(line.startswith("Main call returned value") for line in events[1][1]))
+        self.assertIn("diverged\n\n", events[3][1])
+        self.assertEqual(events[4][1][0], "Checkpoint saved")
+        self.assertEqual(events[4][1][-1], "step: 3")
+
+
+class TestRouting(unittest.TestCase):
+
+    def test_routes_and_batches(self):
+        pages, digests = [], []
+        notifier = RoutingNotifier(Route(ListNotifier(pages), events=["crash"], func_names=["train*"]),
+                                   Route(ListNotifier(digests), events=["start", "complete"], batch_window=60,
+                                         max_batch=3))
+        for name in ("train", "eval", "train_again"):
+            with notifier.track(name):
+                pass
+        with self.assertRaises(ValueError):
+            with notifier.track("eval"):
+                raise ValueError("diverged")
+        self.assertEqual(pages, [])
+        self.assertEqual(digests, [])
+        with self.assertRaises(ValueError):
+            with notifier.track("train"):
+                raise ValueError("diverged")
+        self.assertEqual([event for event, _ in pages], ["crash"])
+
+        notifier.flush()
+        self.assertEqual(len(digests), 1)
+        event, contents = digests[0]
+        self.assertEqual(event, "digest")
+        self.assertTrue(contents[0].startswith("8 notifications since "))
+        self.assertEqual(contents[-1], "And 5 more notifications")
+        notifier.flush()
+        self.assertEqual(len(digests), 1)
+        self.assertEqual(routing._pending_routes, set())
+
+        # The machine name is matched without the rank added to the messages.
+        machines = []
+        notifier = RoutingNotifier(Route(ListNotifier(machines), hosts=[socket.gethostname()], ranks=[1]))
+        with mock.patch.dict(os.environ, {"RANK": "1", "WORLD_SIZE": "2"}):
+            with self.assertRaises(ValueError):
+                with notifier.track("train"):
+                    raise ValueError("diverged")
+        self.assertEqual([event for event, _ in machines], ["crash"])
+        self.assertIn("Machine name: %s - RANK: 1" % socket.gethostname(), machines[0][1])
+
+
+class TestGenerators(unittest.TestCase):
+
+    def test_generators_are_tracked_while_iterated(self):
+        events = []
+        notifier = ListNotifier(events)
+
+        @notifier(progress_items=2)
+        def shards():
+            for i in range(5):
+                yield i
+            return "done"
+
+        generator = shards()
+        self.assertEqual(events, [])
+        self.assertEqual(list(generator), [0, 1, 2, 3, 4])
+        self.assertEqual([event for event, _ in events], ["start", "progress", "progress", "complete"])
+        self.assertIn("Items yielded: 4", events[2][1][5])
+        self.assertIn("Main call returned value: done", events[-1][1])
+        self.assertTrue(events[-1][1][7].startswith("Items yielded: 5"))
+
+        events.clear()
+        for i in notifier.iterate(range(10), "loop"):
+            if i == 3:
+                break
+        self.assertEqual([event for event, _ in events], ["start", "complete"])
+        self.assertIn("Iteration stopped by the caller before the end", events[-1][1])
+
+        @notifier
+        async def stream():
+            yield 1
+            raise ValueError("bad shard")
+
+        async def consume():
+            return [item async for item in stream()]
+
+        events.clear()
+        with self.assertRaises(ValueError):
+            asyncio.run(consume())
+        self.assertEqual([event for event, _ in events], ["start", "crash"])
+        self.assertTrue(events[-1][1][6].startswith("Items yielded: 1"))
+
+
+class TestBudget(unittest.TestCase):
+
+    def test_preflight_and_notification_budget(self):
+        def check(timeout):
+            raise ConnectionError("invalid token")
+
+        def hang(timeout):
+            time.sleep(10)
+
+        with self.assertRaisesRegex(PreflightError, "ListNotifier: invalid token"):
+            MultiNotifier(ListNotifier([], check=check), ListNotifier([]), preflight=True)
+        sender_decorator(print, check=lambda timeout: None, preflight=True)
+        start = time.monotonic()
+        with self.assertRaisesRegex(PreflightError, "no answer within 0.2s"):
+            check_backends([sender_decorator(print, check=hang)], timeout=0.2)
+        self.assertLess(time.monotonic() - start, 1)
+
+        def send_message(event, contents):
+            time.sleep(0.3 if event == "start" else 10)
+
+        @sender_decorator(send_message, notification_timeout=1, notification_budget=0.5)
+        def train():
+            return 1
+
+        start = time.monotonic()
+        with mock.patch("sys.stderr"):
+            train()
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Local webhook recording the requests it receives in `requests` of the server.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.headers["Content-Type"], body))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAttachments(unittest.TestCase):
+
+    def test_discord_attachments(self):
+        server = http.server.HTTPServer(("127.0.0.1", 0), RecordingHandler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log_path = os.path.join(directory, "train.log")
+        with open(log_path, "wb") as f:
+            for step in range(200000):
+                f.write(b"step %d loss=%s\n" % (step, os.urandom(8).hex().encode()))
+        metrics_path = os.path.join(directory, "metrics.json")
+        with open(metrics_path, "w") as f:
+            json.dump({"loss": 0.1}, f)
+
+        @mock.patch("knockknock.discord_sender.MAX_ATTACHMENT_SIZE", 100000)
+        @discord_sender(webhook_url="http://127.0.0.1:%d/webhook" % server.server_port,
+                        attachments=[log_path, metrics_path, os.path.join(directory, "missing.png")])
+        def train():
+            return 1
+        train()
+
+        self.assertEqual(len(server.requests), 4)
+        message = json.loads(server.requests[1][1])["content"]
+        self.assertIn("Attachment: metrics.json (13 bytes)", message)
+        self.assertIn("Attachment not sent (missing or too large): %s" % os.path.join(directory, "missing.png"),
+                      message)
+        files = {}
+        for content_type, body in server.requests[2:]:
+            parts = email.message_from_bytes(b"Content-Type: %s\r\n\r\n%s" % (content_type.encode(), body))
+            part = parts.get_payload()[1]
+            files[part.get_filename()] = part.get_payload(decode=True)
+        self.assertEqual(json.loads(files["metrics.json"]), {"loss": 0.1})
+        self.assertLessEqual(len(files["train.log.gz"]), 100000)
+        log = gzip.decompress(files["train.log.gz"])
+        self.assertTrue(log.startswith(b"[knockknock: the first "))
+        self.assertTrue(log.endswith(b"step 199999 loss=" + log[-17:-1] + b"\n"))
+
+
+class TestWebhooks(unittest.TestCase):
+
+    def test_concurrent_slack_messages(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        sender = slack_sender(webhook_url="http://127.0.0.1:%d/webhook" % server.server_port, channel="runs")
+
+        # As the watchdog, progress and checkpoint threads of a run do.
+        threads = [threading.Thread(target=sender.send_message, args=(event, ["%s %d" % (event, i)]))
+                   for i in range(10) for event in ("progress", "checkpoint")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        icons = {"progress": ":runner:", "checkpoint": ":floppy_disk:"}
+        payloads = [json.loads(body) for _, body in server.requests]
+        self.assertEqual(len(payloads), 20)
+        for payload in payloads:
+            self.assertEqual(payload["icon_emoji"], icons[payload["text"].split()[0]])
+
+    def test_matrix_check_timeout(self):
+        # A homeserver accepting the connection but never answering.
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        self.addCleanup(server.close)
+        sender = matrix_sender(homeserver="http://127.0.0.1:%d" % server.getsockname()[1], token="token",
+                               room="#runs:example.org")
+
+        # The request itself times out, rather than a thread left hanging by the preflight.
+        start = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            sender.check(0.2)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+class TestCrashIndex(unittest.TestCase):
+
+    def test_fingerprint_and_suppression(self):
+        def crash(value):
+            return 1 / value
+
+        exceptions = []
+        for value in (0, 0., "0"):
+            try:
+                crash(value)
+            except (ZeroDivisionError, TypeError) as ex:
+                exceptions.append(ex)
+        self.assertEqual(fingerprint(exceptions[0]), fingerprint(exceptions[1]))
+        self.assertNotEqual(fingerprint(exceptions[0]), fingerprint(exceptions[2]))
+        self.assertNotEqual(fingerprint(exceptions[0], "train"), fingerprint(exceptions[0], "eval"))
+        failures = []
+        for command in (["false"], ["false"], ["sh", "-c", "exit 2"]):
+            try:
+                subprocess.run(command, check=True)
+            except subprocess.CalledProcessError as ex:
+                failures.append(fingerprint(ex, "run", "knockknock slack"))
+        self.assertEqual(failures[0], failures[1])
+        self.assertNotEqual(failures[0], failures[2])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        index = CrashIndex(os.path.join(directory, "crashes.sqlite"), window=100.)
+        self.addCleanup(index.close)
+        self.assertEqual(index.record("abc", "ZeroDivisionError", now=0.), ["Crash fingerprint: abc"])
+        self.assertIsNone(index.record("abc", "ZeroDivisionError", now=10.))
+        self.assertIsNotNone(index.record("def", "TypeError", now=20.))
+        self.assertIsNone(index.record("abc", "ZeroDivisionError", now=50.))
+        contents = index.record("abc", "ZeroDivisionError", now=105.)
+        self.assertTrue(contents[1].startswith("Seen 4 times since "))
+        self.assertTrue(contents[1].endswith("(2 not notified)"))
+        self.assertEqual(index.record("abc", "ZeroDivisionError", now=300.), ["Crash fingerprint: abc"])
+
+
+def square(x):
+    return x * x
+
+
+class TestProcesses(unittest.TestCase):
+
+    def test_pickle_and_fork(self):
+        notifier = pickle.loads(pickle.dumps(SlackNotifier(webhook_url="http://localhost/hook", channel="C1")))
+        self.assertEqual(notifier.sender.factory[0].keywords, {"webhook_url": "http://localhost/hook", "channel": "C1"})
+        tracked = pickle.loads(pickle.dumps(notifier(square)))
+        self.assertIs(tracked.func, square)
+        self.assertEqual(tracked.decorator.options, notifier.options)
+
+        client = PerProcess(object)
+        parent_client = client.get()
+        self.assertIs(client.get(), parent_client)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if client.value is None and client.get() is not parent_client else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+        events = []
+        self.assertEqual(parallel_map(square, range(10), lambda event, contents: events.append((event, contents)),
+                                      max_workers=2, chunksize=3), [x * x for x in range(10)])
+        self.assertEqual([event for event, _ in events], ["start", "complete"])
+        self.assertIn("Main call returned value: 10 results", events[1][1])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,173 @@
+import datetime
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import List, Optional
+
+from knockknock.core import DATE_FORMAT, Message
+
+# Seconds between two checks of `/proc` when `pidfd_open` isn't available.
+POLL_INTERVAL = 5.
+
+
+def read_stat(pid: int) -> Optional[List[str]]:
+    """
+    Fields of `/proc/<pid>/stat` after the command name (i.e. starting at the state),
+    or None if the process is gone.
+    """
+    try:
+        with open('/proc/%d/stat' % pid, 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    return stat[stat.rindex(b')') + 2:].decode().split()
+
+
+def process_start_time(pid: int) -> Optional[datetime.datetime]:
+    """
+    Start date of a process, from its start time in clock ticks since boot.
+    """
+    fields = read_stat(pid)
+    if fields is None:
+        return None
+    with open('/proc/stat') as f:
+        boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime '))
+    return datetime.datetime.fromtimestamp(boot_time + int(fields[19]) / os.sysconf('SC_CLK_TCK'))
+
+
+def process_command(pid: int) -> str:
+    try:
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            command = f.read().rstrip(b'\0').replace(b'\0', b' ').decode(errors='replace')
+    except OSError:
+        command = ''
+    return command or 'pid %d' % pid
+
+
+def exit_status(pid: int) -> Optional[int]:
+    """
+    Wait status of a process that exited but was not reaped by its parent yet (a
+    zombie), from the `exit_code` field of `/proc/<pid>/stat` (Linux >= 3.5). None once
+    the process has been reaped.
+    """
+    fields = read_stat(pid)
+    if fields is None or fields[0] != 'Z' or len(fields) < 50:
+        return None
+    return int(fields[49])
+
+
+class WatchedProcess:
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.start_time = process_start_time(pid)
+        if self.start_time is None:
+            raise ProcessLookupError('No process with pid %d.' % pid)
+        self.command = process_command(pid)
+        self.pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self.pidfd = os.pidfd_open(pid)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+
+    def report(self, send_message, host_name: str, status: Optional[int]):
+        end_time = datetime.datetime.now()
+        elapsed_time = end_time - self.start_time
+        if status is None:
+            event = 'exit'
+            status_text = 'unknown (the process was reaped by its parent)'
+        elif os.WIFSIGNALED(status):
+            event = 'crash'
+            status_text = 'killed by %s' % signal.Signals(os.WTERMSIG(status)).name
+        else:
+            event = 'crash' if os.WEXITSTATUS(status) != 0 else 'complete'
+            status_text = str(os.WEXITSTATUS(status))
+        if event == 'crash':
+            contents = ["Your training has crashed ☠️",
+                        'Machine name: %s' % host_name,
+                        'Main call: %s' % self.command,
+                        'Process id: %d' % self.pid,
+                        'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                        'Crash date: %s' % end_time.strftime(DATE_FORMAT),
+                        'Crashed training duration: %s' % str(elapsed_time),
+                        'Exit status: %s' % status_text]
+        else:
+            # Without the exit status, the run may as well have failed.
+            contents = ["Your training is complete 🎉" if event == 'complete'
+                        else "Your training has exited, its outcome is unknown ❔",
+                        'Machine name: %s' % host_name,
+                        'Main call: %s' % self.command,
+                        'Process id: %d' % self.pid,
+                        'Starting date: %s' % self.start_time.strftime(DATE_FORMAT),
+                        'End date: %s' % end_time.strftime(DATE_FORMAT),
+                        'Training duration: %s' % str(elapsed_time),
+                        'Exit status: %s' % status_text]
+        send_message(event, Message(contents, func_name=self.command, host_name=host_name,
+                                    duration=elapsed_time.total_seconds()))
+
+
+def watch_pids(pids: List[int], send_message, poll_interval: float = POLL_INTERVAL):
+    """
+    Sleep until each of the already running processes `pids` exits, and send the usual
+    completion (or crash) notification for each of them, with the runtime observed from
+    `/proc/<pid>/stat` and the exit status when it can be determined (an "exit"
+    notification with an unknown outcome otherwise).
+
+    On Linux >= 5.3, the watcher blocks in `poll` on a `pidfd` per process and wakes up
+    exactly when one exits. Otherwise, `/proc` is checked every `poll_interval` seconds.
+    Processes that are not running are skipped with a warning, `ProcessLookupError` is
+    raised if none is.
+    """
+    host_name = socket.gethostname()
+    processes = []
+    for pid in pids:
+        try:
+            processes.append(WatchedProcess(pid))
+        except ProcessLookupError as ex:
+            print('knockknock: %s Not watched.' % ex, file=sys.stderr)
+    if not processes:
+        raise ProcessLookupError('None of the processes to watch is running.')
+    contents = ['Your training is being watched 👀',
+                'Machine name: %s' % host_name]
+    for process in processes:
+        contents.append('Main call: %s (pid %d, started %s)' % (
+            process.command, process.pid, process.start_time.strftime(DATE_FORMAT)))
+    send_message('start', contents)
+
+    poller = select.poll() if hasattr(select, 'poll') else None
+    by_fd = {}
+    for process in processes:
+        if process.pidfd is not None and poller is not None:
+            poller.register(process.pidfd, select.POLLIN)
+            by_fd[process.pidfd] = process
+    polled = [process for process in processes if process.pidfd is None or poller is None]
+
+    while by_fd or polled:
+        exited = []
+        if by_fd:
+            # Block until a process exits, or until the next `/proc` check if some
+            # processes can't be watched with a pidfd.
+            timeout = poll_interval * 1000 if polled else None
+            for fd, _ in poller.poll(timeout):
+                poller.unregister(fd)
+                exited.append(by_fd.pop(fd))
+        else:
+            time.sleep(poll_interval)
+        for process in list(polled):
+            fields = read_stat(process.pid)
+            if fields is None or fields[0] == 'Z' or process_start_time(process.pid) != process.start_time:
+                polled.remove(process)
+                exited.append(process)
+
+        for process in exited:
+            process.report(send_message, host_name, exit_status(process.pid))
+            process.close()